@@ -0,0 +1,115 @@
+"""
+Insert throughput of the collection writer on synthetic commit/file/method rows: the previous
+per-repository to_sql appends of stringified dataframes against bulk_writer (typed executemany
+inserts, one transaction per batch of repositories, WAL).
+
+Runs without the CVEfixes configuration and writes to a temporary directory:
+  python Code/bench_bulk_insert.py [--repos 200] [--commits 3] [--files 4] [--methods 6] [--batch 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+
+from bulk_writer import configure_bulk_load, finish_bulk_load, insert_rows, typed_rows
+
+commit_columns = ['hash', 'repo_url', 'author', 'author_date', 'author_timezone', 'committer', 'committer_date',
+                  'committer_timezone', 'msg', 'merge', 'parents', 'num_lines_added', 'num_lines_deleted',
+                  'dmm_unit_complexity', 'dmm_unit_interfacing', 'dmm_unit_size']
+file_columns = ['file_change_id', 'hash', 'filename', 'old_path', 'new_path', 'change_type', 'diff', 'diff_parsed',
+                'num_lines_added', 'num_lines_deleted', 'code_after', 'code_before', 'nloc', 'complexity',
+                'token_count', 'programming_language']
+method_columns = ['method_change_id', 'file_change_id', 'name', 'signature', 'parameters', 'start_line', 'end_line',
+                  'code', 'nloc', 'complexity', 'token_count', 'top_nesting_level', 'before_change']
+
+
+def synthetic_repo(rng, r, n_commits, n_files, n_methods):
+    """
+    returns commit, file and method rows of one repository shaped like extract_commits output
+    """
+    body = '\n'.join(f'    x{i} = buf[{i}] + len;' for i in range(30))
+    commits, files, methods = [], [], []
+    for c in range(n_commits):
+        hsh = f'{rng.getrandbits(160):040x}'
+        commits.append({'hash': hsh, 'repo_url': f'https://github.com/owner{r}/repo{r}', 'author': 'dev',
+                        'author_date': pd.Timestamp('2021-01-01 10:00:00+0200'), 'author_timezone': -7200,
+                        'committer': 'dev', 'committer_date': pd.Timestamp('2021-01-02 10:00:00+0200'),
+                        'committer_timezone': -7200, 'msg': 'fix overflow\n\nCVE-2021-0000', 'merge': False,
+                        'parents': [f'{rng.getrandbits(160):040x}'], 'num_lines_added': 12, 'num_lines_deleted': 3,
+                        'dmm_unit_complexity': 0.5, 'dmm_unit_interfacing': None, 'dmm_unit_size': 1.0})
+        for f in range(n_files):
+            file_id = rng.getrandbits(48)
+            code = '\n'.join(f'int f{m}(int len) {{\n{body}\n    return len;\n}}' for m in range(n_methods))
+            files.append({'file_change_id': file_id, 'hash': hsh, 'filename': f'f{f}.c', 'old_path': f'src/f{f}.c',
+                          'new_path': f'src/f{f}.c', 'change_type': 'ModificationType.MODIFY',
+                          'diff': '@@ -1,3 +1,4 @@\n' + body, 'diff_parsed': {'added': [(1, 'x')], 'deleted': []},
+                          'num_lines_added': 4, 'num_lines_deleted': 1, 'code_after': code, 'code_before': code,
+                          'nloc': 40 * n_methods, 'complexity': 2 * n_methods, 'token_count': 300 * n_methods,
+                          'programming_language': 'C'})
+            for m in range(n_methods):
+                for before in ('True', 'False'):
+                    methods.append({'method_change_id': rng.getrandbits(48), 'file_change_id': file_id,
+                                    'name': f'f{m}', 'signature': f'f{m}( int len)', 'parameters': ['int len'],
+                                    'start_line': 34 * m + 1, 'end_line': 34 * m + 33,
+                                    'code': f'int f{m}(int len) {{\n{body}\n    return len;\n}}', 'nloc': 32,
+                                    'complexity': 1, 'token_count': 300, 'top_nesting_level': 0,
+                                    'before_change': before})
+    return commits, files, methods
+
+
+def run_to_sql(path, repos):
+    # previous writer: per repository, applymap(str) (astype(str) here) and one to_sql append per table
+    con = sqlite3.connect(path, timeout=10)
+    for commits, files, methods in repos:
+        with con:
+            pd.DataFrame(commits)[commit_columns].astype(str).to_sql('commits', con, if_exists='append', index=False)
+            pd.DataFrame(files)[file_columns].astype(str).to_sql('file_change', con, if_exists='append', index=False)
+            pd.DataFrame(methods)[method_columns].astype(str).to_sql('method_change', con, if_exists='append', index=False)
+    con.close()
+
+
+def run_bulk(path, repos, batch):
+    con = sqlite3.connect(path, timeout=10)
+    configure_bulk_load(con)
+    for b in range(0, len(repos), batch):
+        # rows are converted in the mining workers in store_tables, here in the writer loop
+        with con:
+            for commits, files, methods in repos[b:b + batch]:
+                insert_rows(con, 'method_change', method_columns, typed_rows(methods, method_columns))
+                insert_rows(con, 'file_change', file_columns, typed_rows(files, file_columns))
+                insert_rows(con, 'commits', commit_columns, typed_rows(commits, commit_columns))
+    finish_bulk_load(con)
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', type=int, default=200)
+    parser.add_argument('--commits', type=int, default=3)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--methods', type=int, default=6)
+    parser.add_argument('--batch', type=int, default=20, help='repositories per transaction of the bulk writer')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    repos = [synthetic_repo(rng, r, args.commits, args.files, args.methods) for r in range(args.repos)]
+    n_rows = sum(len(c) + len(f) + len(m) for c, f, m in repos)
+    print(f'{args.repos} repositories, {n_rows} rows')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, run in [('to_sql per repository', lambda p: run_to_sql(p, repos)),
+                          ('bulk_writer', lambda p: run_bulk(p, repos, args.batch))]:
+            path = os.path.join(tmp, name.split()[0] + '.db')
+            start = time.perf_counter()
+            run(path)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>22}: {elapsed:7.2f}s  {n_rows / elapsed:10.0f} rows/s  '
+                  f'{os.path.getsize(path) / 2 ** 20:7.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Changed-method lookup of collect_commits.changed_methods_both on synthetic files: the previous
+check of every (diff line, method) pair against code_index.methods_touching.
+
+Runs without the CVEfixes configuration:
+  python Code/bench_changed_methods.py [--methods 5000] [--lines 20000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+from collections import namedtuple
+
+from code_index import methods_touching
+
+Method = namedtuple('Method', ['name', 'start_line', 'end_line'])
+
+
+def synthetic_file(rng, n_methods, n_lines):
+    """
+    returns methods laid out one after another (every tenth with a nested method, as lizard reports
+    for closures) and the (line number, text) pairs of a diff touching random lines
+    """
+    methods = []
+    line = 1
+    for m in range(n_methods):
+        length = rng.randint(3, 40)
+        methods.append(Method(f'f{m}', line, line + length - 1))
+        if m % 10 == 0 and length > 6:
+            methods.append(Method(f'f{m}_inner', line + 2, line + length - 3))
+        line += length + rng.randint(0, 3)
+    lines = [(rng.randint(1, line), 'x') for _ in range(n_lines)]
+    return methods, lines
+
+
+def nested_loop(methods, diff_lines):
+    # previous implementation
+    return {
+        y
+        for x in diff_lines
+        for y in methods
+        if y.start_line <= x[0] <= y.end_line
+    }
+
+
+def bench(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--methods', type=int, default=5000)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for n_methods, n_lines in [(100, 200), (1000, 2000), (args.methods, args.lines)]:
+        methods, diff_lines = synthetic_file(rng, n_methods, n_lines)
+        old_time, old = bench(lambda: nested_loop(methods, diff_lines), args.repeat)
+        new_time, new = bench(lambda: methods_touching(methods, [x[0] for x in diff_lines]), args.repeat)
+        assert old == new, 'methods_touching differs from the nested loop'
+        print(f'{len(methods):>6} methods x {n_lines:>6} diff lines: nested loop {old_time * 1000:9.1f} ms, '
+              f'methods_touching {new_time * 1000:7.2f} ms ({old_time / new_time:.0f}x), {len(new)} changed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Repository fetches of the mining step against a local upstream repository served over file://:
+a full clone per run (what pydriller does without a mirror) against git_mirror, which fetches
+only the fix commits and their parents into a mirror that later runs reuse.
+
+Checks that the first run fetches the fix commits and their parents but not the rest of the
+history, that a rerun fetches nothing, that after new upstream commits only the new fix hashes
+are fetched, and that pydriller finds every fix commit in the mirror with `single`.
+
+Runs without the CVEfixes configuration and works in a temporary directory:
+  python Code/bench_git_mirror.py [--commits 300] [--fixes 10] [--lines 200]
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from pydriller import Repository
+
+import git_mirror
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='dev', GIT_AUTHOR_EMAIL='dev@example.org',
+               GIT_COMMITTER_NAME='dev', GIT_COMMITTER_EMAIL='dev@example.org')
+
+
+def git(path, *args):
+    return subprocess.run(['git', '-C', str(path), *args], check=True, capture_output=True, text=True,
+                          env=GIT_ENV).stdout
+
+
+def add_commits(work, start, count, n_lines):
+    """
+    commits count changes of a C file to the work tree and returns their hashes, oldest first
+    """
+    source = work / 'src' / 'main.c'
+    source.parent.mkdir(exist_ok=True)
+    for i in range(start, start + count):
+        source.write_text(f'int f{i}(int len) {{\n' +
+                          ''.join(f'    int x{j} = len + {i * j};\n' for j in range(n_lines)) + '}\n')
+        git(work, 'add', '-A')
+        git(work, 'commit', '--quiet', '-m', f'change {i}')
+    return git(work, 'rev-list', '--reverse', f'-{count}', 'HEAD').split()
+
+
+def fetches(calls):
+    return [args for args in calls if args[0] == 'fetch']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commits', type=int, default=300, help='commits of the upstream repository')
+    parser.add_argument('--fixes', type=int, default=10, help='fix commits mined from it')
+    parser.add_argument('--lines', type=int, default=200, help='lines of the file changed by every commit')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        work, upstream = tmp / 'work', tmp / 'upstream.git'
+        git(tmp, 'init', '--quiet', str(work))
+        history = add_commits(work, 0, args.commits, args.lines)
+        subprocess.run(['git', 'clone', '--quiet', '--bare', str(work), str(upstream)], check=True)
+        url = upstream.as_uri()
+        step = max(len(history) // args.fixes, 2)
+        fixes = history[step - 1::step][:args.fixes]
+        print(f'upstream: {len(history)} commits, mining {len(fixes)} fix commits')
+
+        # record the git commands of git_mirror
+        calls = []
+        run_git = git_mirror._git
+
+        def recording_git(path, *git_args, **kwargs):
+            calls.append(git_args)
+            return run_git(path, *git_args, **kwargs)
+        git_mirror._git = recording_git
+
+        def timed(name, run):
+            start = time.perf_counter()
+            result = run()
+            print(f'{name:>28}: {time.perf_counter() - start:6.2f}s')
+            return result
+
+        mirror_root = tmp / 'mirrors'
+        timed('full clone', lambda: subprocess.run(
+            ['git', 'clone', '--quiet', '--bare', url, str(tmp / 'clone.git')], check=True))
+        mirror = timed('mirror, first run', lambda: git_mirror.ensure_mirror(url, mirror_root, fixes))
+        assert git_mirror.missing_commits(mirror, fixes) == []
+        parents = {history[history.index(h) - 1] for h in fixes}
+        others = [h for h in history if h not in fixes and h not in parents]
+        assert not git_mirror._present(mirror, others), 'commits other than the fixes and parents were fetched'
+
+        calls.clear()
+        rerun = timed('mirror, rerun', lambda: git_mirror.ensure_mirror(url + '/', mirror_root, fixes))
+        assert rerun == mirror and not fetches(calls), 'the rerun did not reuse the mirror'
+
+        new = add_commits(work, args.commits, 5, args.lines)
+        git(work, 'push', '--quiet', str(upstream), 'HEAD')
+        calls.clear()
+        timed('mirror, new upstream fix', lambda: git_mirror.ensure_mirror(url, mirror_root, fixes + new[-1:]))
+        fetched = [h for args_ in fetches(calls) for h in args_ if h in history + new]
+        assert fetched == new[-1:], f'fetched {fetched} instead of only the new fix commit'
+
+        found = timed('pydriller single, mirror', lambda: [
+            commit.hash for h in fixes + new[-1:]
+            for commit in Repository(path_to_repo=str(mirror), single=h).traverse_commits()])
+        assert found == fixes + new[-1:]
+
+        size = sum(f.stat().st_size for f in mirror.rglob('*') if f.is_file())
+        clone_size = sum(f.stat().st_size for f in (tmp / 'clone.git').rglob('*') if f.is_file())
+        print(f'mirror {size / 2 ** 10:.0f} KiB, full clone {clone_size / 2 ** 10:.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
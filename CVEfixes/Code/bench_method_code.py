@@ -0,0 +1,73 @@
+"""
+Method code extraction of collect_commits.get_methods on large synthetic C files: the previous
+split and join of the whole file per method against one code_index.LineIndex per file version.
+
+Runs without the CVEfixes configuration:
+  python Code/bench_method_code.py [--methods 2000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+
+from code_index import LineIndex
+
+
+def synthetic_c_file(rng, n_methods):
+    """
+    returns the source of a C file and the (start_line, end_line) ranges of its functions
+    """
+    lines = ['#include <stdio.h>', '#include <string.h>', '']
+    ranges = []
+    for m in range(n_methods):
+        start = len(lines) + 1
+        lines.append(f'static int handler_{m}(const char *buf, size_t len)')
+        lines.append('{')
+        for i in range(rng.randint(5, 60)):
+            lines.append(f'    if (len > {i}) {{ total += buf[{i}] * {m}; }}  /* step {i} */')
+        lines.append('    return total;')
+        lines.append('}')
+        ranges.append((start, len(lines)))
+        lines.append('')
+    return '\n'.join(lines), ranges
+
+
+def split_per_method(source_code, ranges):
+    # previous get_method_code, called once per method
+    return ['\n'.join(source_code.split('\n')[int(s) - 1: int(e)]) for s, e in ranges]
+
+
+def line_index(source_code, ranges):
+    index = LineIndex(source_code)
+    return [index.lines(s, e) for s, e in ranges]
+
+
+def bench(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--methods', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for n_methods in (50, 500, args.methods):
+        source_code, ranges = synthetic_c_file(rng, n_methods)
+        # all methods changed, plus ranges past the end of the file and empty ranges
+        ranges = ranges + [(1, 1), (len(ranges) * 100, len(ranges) * 100 + 5), (5, 3)]
+        old_time, old = bench(lambda: split_per_method(source_code, ranges), args.repeat)
+        new_time, new = bench(lambda: line_index(source_code, ranges), args.repeat)
+        assert old == new, 'LineIndex differs from splitting the file'
+        print(f'{n_methods:>6} methods, {source_code.count(chr(10)) + 1:>7} lines, {len(source_code) / 2 ** 20:5.1f} MiB: '
+              f'split per method {old_time * 1000:9.1f} ms, LineIndex {new_time * 1000:7.2f} ms '
+              f'({old_time / new_time:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
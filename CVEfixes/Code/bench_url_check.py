@@ -0,0 +1,112 @@
+"""
+Repository availability checks against a local HTTP stub with a fixed latency per request: the
+previous serial requests.head loop against url_checker (concurrent HEAD requests with a per-host
+cap), followed by a rerun of url_checker that is answered from its cache.
+
+The stub answers like GitHub/GitLab: 200 for available repositories, 404 for removed ones, a
+redirect to the GitLab sign-in page for private ones and a plain redirect for renamed ones. Above
+--rate requests per second it answers 429 with Retry-After, as the hosts limit a single client.
+
+Runs without the CVEfixes configuration:
+  python Code/bench_url_check.py [--urls 400] [--latency 0.05] [--rate 100] [--per-host 8]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import url_checker
+
+KINDS = ['ok', 'ok', 'ok', 'ok', 'ok', 'gone', 'private', 'moved']
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.05
+    rate = 100
+    window = [0, 0]  # second, requests in it
+    lock = threading.Lock()
+
+    def limited(self):
+        with self.lock:
+            second = int(time.time())
+            if self.window[0] != second:
+                self.window[:] = [second, 0]
+            self.window[1] += 1
+            return self.window[1] > self.rate
+
+    def do_HEAD(self):
+        time.sleep(self.latency)
+        kind = self.path.split('/')[-1].split('-')[0]
+        if self.limited():
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+        elif kind == 'gone':
+            self.send_response(404)
+        elif kind == 'private':
+            self.send_response(302)
+            self.send_header('Location', url_checker.GITLAB_SIGN_IN)
+        elif kind == 'moved':
+            self.send_response(301)
+            self.send_header('Location', 'https://github.com/new-owner/repo')
+        else:
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def find_unavailable_serial(urls):
+    # previous find_unavailable_urls: one blocking HEAD per url and a growing sleep on every 429
+    sleeptime = 0
+    unavailable_urls = []
+    for url in urls:
+        response = requests.head(url)
+        while response.status_code == 429:
+            sleeptime += 10
+            time.sleep(sleeptime)
+            response = requests.head(url)
+        sleeptime = 0
+        if (response.status_code >= 400) or \
+                (response.is_redirect and response.headers['location'] == url_checker.GITLAB_SIGN_IN):
+            unavailable_urls.append(url)
+    return unavailable_urls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--urls', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stub takes per request')
+    parser.add_argument('--rate', type=int, default=100, help='requests per second the stub answers without 429')
+    parser.add_argument('--per-host', type=int, default=url_checker.PER_HOST)
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.rate = args.rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    urls = [f'{base}/owner/{KINDS[i % len(KINDS)]}-{i}' for i in range(args.urls)]
+    expected = {url for url in urls if url.rsplit('/', 1)[-1].split('-')[0] in ('gone', 'private')}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_file = os.path.join(tmp, 'url_availability.json')
+        runs = [('serial requests.head', lambda: find_unavailable_serial(urls)),
+                ('url_checker', lambda: url_checker.find_unavailable(urls, cache_file, per_host=args.per_host)),
+                ('url_checker cached', lambda: url_checker.find_unavailable(urls, cache_file, per_host=args.per_host))]
+        for name, run in runs:
+            start = time.perf_counter()
+            unavailable = run()
+            elapsed = time.perf_counter() - start
+            assert set(unavailable) == expected, name
+            print(f'{name:>20}: {elapsed:7.2f}s  {len(urls)} urls, {len(unavailable)} unavailable')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
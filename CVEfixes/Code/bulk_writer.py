@@ -0,0 +1,95 @@
+import math
+
+# connection settings while the collection appends rows: WAL lets the single writer append without
+# rewriting a rollback journal, and a transaction only waits for the OS write on checkpoints
+BULK_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64 MiB
+    'PRAGMA wal_autocheckpoint=10000',
+]
+
+# SQLite types of the columns of commits, file_change, method_change, repository_checkpoint and collection_run.
+# Only used when a table is created, columns of existing tables keep their (TEXT) type.
+# before_change and merge stay 'True'/'False' strings as queried by the downstream exports.
+COLUMN_TYPES = {
+    'author_timezone': 'INTEGER',
+    'committer_timezone': 'INTEGER',
+    'num_lines_added': 'INTEGER',
+    'num_lines_deleted': 'INTEGER',
+    'dmm_unit_complexity': 'REAL',
+    'dmm_unit_interfacing': 'REAL',
+    'dmm_unit_size': 'REAL',
+    'file_change_id': 'INTEGER',
+    'method_change_id': 'INTEGER',
+    'nloc': 'INTEGER',
+    'complexity': 'INTEGER',
+    'token_count': 'INTEGER',
+    'start_line': 'INTEGER',
+    'end_line': 'INTEGER',
+    'top_nesting_level': 'INTEGER',
+    'run_id': 'INTEGER',
+}
+
+
+def configure_bulk_load(con):
+    for pragma in BULK_PRAGMAS:
+        con.execute(pragma)
+
+
+def finish_bulk_load(con):
+    """
+    folds the WAL back into the database file and returns to the default journal, so the .db file
+    is self-contained again (e.g. for read-only use or copying)
+    """
+    con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    con.execute('PRAGMA journal_mode=DELETE')
+
+
+def sql_value(value, sql_type):
+    """
+    converts a value extracted by pydriller/lizard to the column type; None and NaN become NULL,
+    values that do not fit a numeric column are stored as text
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    try:
+        if sql_type == 'INTEGER':
+            return int(value)
+        if sql_type == 'REAL':
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    return value if isinstance(value, str) else str(value)
+
+
+def typed_rows(records, columns):
+    """
+    returns the records (dicts or a dataframe) as tuples of typed values in the order of columns
+    """
+    if records is None:
+        return []
+    if hasattr(records, 'to_dict'):
+        records = records.to_dict('records')
+    types = [COLUMN_TYPES.get(c, 'TEXT') for c in columns]
+    return [tuple(sql_value(r[c], t) for c, t in zip(columns, types)) for r in records]
+
+
+def create_table(con, table, columns):
+    schema = ', '.join(f'"{c}" {COLUMN_TYPES.get(c, "TEXT")}' for c in columns)
+    con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({schema})')
+
+
+def insert_rows(con, table, columns, rows):
+    """
+    appends rows (tuples in the order of columns) with one prepared statement, creating the table
+    if needed. Commits are left to the caller, so several tables can be written in one transaction.
+    """
+    if not rows:
+        return 0
+    create_table(con, table, columns)
+    names = ', '.join(f'"{c}"' for c in columns)
+    con.executemany(f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))})', rows)
+    return len(rows)
+
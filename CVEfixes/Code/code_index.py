@@ -0,0 +1,55 @@
+import re
+from bisect import bisect_left
+
+_newline = re.compile('\n')
+
+
+def methods_touching(methods, line_numbers):
+    """
+    returns the set of methods whose [start_line, end_line] range contains at least one of the
+    line numbers. The line numbers are sorted once and each method is checked with a binary search
+    for the first changed line at or after its start, so nested or overlapping methods are handled
+    the same as by a check of every (line, method) pair.
+    """
+    lines = sorted(line_numbers)
+    if not lines:
+        return set()
+    touched = set()
+    for method in methods:
+        i = bisect_left(lines, method.start_line)
+        if i < len(lines) and lines[i] <= method.end_line:
+            touched.add(method)
+    return touched
+
+
+class LineIndex:
+    """
+    Offsets of the line starts of one version of a file, computed once so the code of every method
+    is a single slice of the source instead of a split and join of the whole file per method.
+    """
+    def __init__(self, source_code):
+        self.source = source_code
+        self.starts = [0]
+        self.starts.extend(m.end() for m in _newline.finditer(source_code))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, start_line, end_line):
+        """
+        returns the (begin, end) character offsets of lines start_line..end_line (1-based, inclusive),
+        with the same clamping as slicing the list of lines
+        """
+        lines = range(len(self.starts))[int(start_line) - 1: int(end_line)]
+        if not lines:
+            return 0, 0
+        last = lines[-1]
+        end = self.starts[last + 1] - 1 if last + 1 < len(self.starts) else len(self.source)
+        return self.starts[lines[0]], end
+
+    def lines(self, start_line, end_line):
+        """
+        same as '\\n'.join(source_code.split('\\n')[start_line - 1: end_line])
+        """
+        begin, end = self.span(start_line, end_line)
+        return self.source[begin:end]
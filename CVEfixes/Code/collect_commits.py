@@ -1,10 +1,14 @@
 import ast
+import hashlib
 import os
 import re
 import uuid
+from collections import Counter, OrderedDict
 
 import pandas as pd
 import configuration as cf
+import git_mirror
+from code_index import LineIndex, methods_touching
 from guesslang import Guess
 from pydriller import Repository
 from utils import log_commit_urls
@@ -100,22 +104,158 @@ def extract_project_links(df_master):
     return df_fixes
 
 
-def guess_pl(code):
+# extensions naming a single guesslang language; ambiguous ones (.h, .m, .pl, .inc, ...) go through the model
+EXTENSION_LANGUAGES = {
+    '.c': 'C', '.cc': 'C++', '.cpp': 'C++', '.cxx': 'C++', '.hpp': 'C++', '.hh': 'C++', '.hxx': 'C++',
+    '.cs': 'C#', '.java': 'Java', '.kt': 'Kotlin', '.scala': 'Scala', '.groovy': 'Groovy', '.go': 'Go',
+    '.rs': 'Rust', '.swift': 'Swift', '.py': 'Python', '.rb': 'Ruby', '.php': 'PHP', '.js': 'JavaScript',
+    '.ts': 'TypeScript', '.coffee': 'CoffeeScript', '.dart': 'Dart', '.lua': 'Lua', '.erl': 'Erlang',
+    '.ex': 'Elixir', '.exs': 'Elixir', '.hs': 'Haskell', '.ml': 'OCaml', '.clj': 'Clojure', '.jl': 'Julia',
+    '.sh': 'Shell', '.bash': 'Shell', '.ps1': 'PowerShell', '.bat': 'Batchfile', '.sql': 'SQL',
+    '.html': 'HTML', '.htm': 'HTML', '.css': 'CSS', '.xml': 'XML', '.json': 'JSON', '.yml': 'YAML',
+    '.yaml': 'YAML', '.toml': 'TOML', '.ini': 'INI', '.md': 'Markdown', '.tex': 'TeX', '.cmake': 'CMake',
+    '.f90': 'Fortran', '.pas': 'Pascal', '.vb': 'Visual Basic', '.cbl': 'COBOL', '.asm': 'Assembly',
+    '.csv': 'CSV', '.v': 'Verilog',
+}
+EXTENSION_FILENAMES = {'Makefile': 'Makefile', 'Dockerfile': 'Dockerfile', 'CMakeLists.txt': 'CMake'}
+
+
+class LanguageDetector:
+    """
+    Programming language detection shared by all files mined in a process. The guesslang model is
+    loaded on first use, files with an unambiguous extension skip it, the remaining files of a commit
+    go through the model as one batch and results are memoized by content hash.
+    `counts` tells how many files took each path (empty, extension, cache, model).
+    """
+    MODEL_BATCH = 32
+
+    def __init__(self, cache_size=50000):
+        self._guess = None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.counts = Counter()
+
+    def _model(self):
+        if self._guess is None:
+            self._guess = Guess()
+        return self._guess
+
+    def _predict(self, sources):
+        """
+        language names of the (stripped, non-empty) sources, as Guess.language_name would return them
+        """
+        guess = self._model()
+        try:
+            # Guess.probabilities runs the serving signature of the saved model on a single text,
+            # it is run on the batch here (falls back to one call per text if guesslang changes)
+            serve = guess._model.signatures['serving_default']
+        except (AttributeError, KeyError):
+            return [guess.language_name(source) for source in sources]
+        import tensorflow as tf
+        predicted = serve(tf.constant(sources))
+        scores, classes = predicted['scores'].numpy(), predicted['classes'].numpy()
+        names = []
+        for row_scores, row_classes in zip(scores, classes):
+            probabilities = [float(value) for value in row_scores]
+            if not Guess._is_reliable(probabilities):
+                names.append(None)
+            else:
+                best = max(range(len(probabilities)), key=probabilities.__getitem__)
+                names.append(guess._extension_map[row_classes[best].decode()])
+        return names
+
+    @staticmethod
+    def extension_language(filename):
+        if not filename:
+            return None
+        if filename in EXTENSION_FILENAMES:
+            return EXTENSION_FILENAMES[filename]
+        return EXTENSION_LANGUAGES.get(os.path.splitext(filename)[1].lower())
+
+    def detect_many(self, files):
+        """
+        :param files: list of (filename, code) pairs
+        :returns guessed programming language of each file, 'unknown' for files without code
+        """
+        languages = [None] * len(files)
+        todo = OrderedDict()  # content hash -> (stripped source, positions)
+        for i, (filename, code) in enumerate(files):
+            if not code:
+                languages[i] = 'unknown'
+                self.counts['empty'] += 1
+                continue
+            by_extension = self.extension_language(filename)
+            if by_extension is not None:
+                languages[i] = by_extension
+                self.counts['extension'] += 1
+                continue
+            source = code.strip()
+            if not source:
+                # whitespace only, Guess.language_name detects no language
+                self.counts['empty'] += 1
+                continue
+            key = hashlib.blake2b(source.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                languages[i] = self.cache[key]
+                self.counts['cache'] += 1
+            elif key in todo:
+                todo[key][1].append(i)
+                self.counts['cache'] += 1
+            else:
+                todo[key] = (source, [i])
+                self.counts['model'] += 1
+
+        pending = [(key, source) for key, (source, _) in todo.items()]
+        for b in range(0, len(pending), self.MODEL_BATCH):
+            chunk = pending[b:b + self.MODEL_BATCH]
+            for (key, _), language in zip(chunk, self._predict([source for _, source in chunk])):
+                self.cache[key] = language
+                for i in todo[key][1]:
+                    languages[i] = language
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return languages
+
+    def detect(self, code, filename=None):
+        return self.detect_many([(filename, code)])[0]
+
+    def describe(self):
+        return ', '.join(f'{path}: {self.counts[path]}' for path in ('extension', 'cache', 'model', 'empty'))
+
+
+_detector = None
+
+
+def language_detector():
+    """
+    returns the LanguageDetector of this process (each mining worker loads its own model)
+    """
+    global _detector
+    if _detector is None:
+        _detector = LanguageDetector()
+    return _detector
+
+
+def guess_pl(code, filename=None):
     """
     :returns guessed programming language of the code
     """
-    if code:
-        return Guess().language_name(code.strip())
-    else:
-        return 'unknown'
+    return language_detector().detect(code, filename)
 
 
 def clean_string(signature):
     return signature.strip().replace(' ', '')
 
 
-def get_method_code(source_code, start_line, end_line):
+def get_method_code(source_code, start_line, end_line, line_index=None):
+    """
+    returns lines start_line..end_line of source_code, sliced from line_index (a LineIndex of
+    source_code) when given instead of splitting the whole file
+    """
     try:
+        if line_index is not None:
+            return line_index.lines(start_line, end_line)
         if source_code is not None:
             code = ('\n'.join(source_code.split('\n')[int(start_line) - 1: int(end_line)]))
             return code
@@ -136,18 +276,9 @@ def changed_methods_both(file):
     added = file.diff_parsed["added"]
     deleted = file.diff_parsed["deleted"]
 
-    methods_changed_new = {
-        y
-        for x in added
-        for y in new_methods
-        if y.start_line <= x[0] <= y.end_line
-    }
-    methods_changed_old = {
-        y
-        for x in deleted
-        for y in old_methods
-        if y.start_line <= x[0] <= y.end_line
-    }
+    # methods containing an added (new code) or deleted (old code) line
+    methods_changed_new = methods_touching(new_methods, [x[0] for x in added])
+    methods_changed_old = methods_touching(old_methods, [x[0] for x in deleted])
     return methods_changed_new, methods_changed_old
 
 
@@ -186,14 +317,20 @@ def get_methods(file, file_change_id):
 
             if file.changed_methods:
                 methods_after, methods_before = changed_methods_both(file)  # in source_code_after/_before
+                # each version of the file is read and indexed by line once for all of its methods
+                source_code_before = file.source_code_before if methods_before else None
+                source_code_after = file.source_code if methods_after else None
+                index_before = LineIndex(source_code_before) if source_code_before is not None else None
+                index_after = LineIndex(source_code_after) if source_code_after is not None else None
                 if methods_before:
                     for mb in methods_before:
                         # filtering out code not existing, and (anonymous)
                         # because lizard API classifies the code part not as a correct function.
                         # Since, we did some manual test, (anonymous) function are not function code.
                         # They are also not listed in the changed functions.
-                        if file.source_code_before is not None and mb.name != '(anonymous)':
-                            method_before_code = get_method_code(file.source_code_before, mb.start_line, mb.end_line)
+                        if source_code_before is not None and mb.name != '(anonymous)':
+                            method_before_code = get_method_code(source_code_before, mb.start_line, mb.end_line,
+                                                                 index_before)
                             method_before_row = {
                                 'method_change_id': uuid.uuid4().fields[-1],
                                 'file_change_id': file_change_id,
@@ -213,9 +350,9 @@ def get_methods(file, file_change_id):
 
                 if methods_after:
                     for mc in methods_after:
-                        if file.source_code is not None and mc.name != '(anonymous)':
-                            # changed_method_code = ('\n'.join(file.source_code.split('\n')[int(mc.start_line) - 1: int(mc.end_line)]))
-                            changed_method_code = get_method_code(file.source_code, mc.start_line, mc.end_line)
+                        if source_code_after is not None and mc.name != '(anonymous)':
+                            changed_method_code = get_method_code(source_code_after, mc.start_line, mc.end_line,
+                                                                  index_after)
                             changed_method_row = {
                                 'method_change_id': uuid.uuid4().fields[-1],
                                 'file_change_id': file_change_id,
@@ -253,11 +390,12 @@ def get_files(commit):
     commit_methods = []
     try:
         cf.logger.info(f'Extracting files for {commit.hash}')
-        if commit.modified_files:
-            for file in commit.modified_files:
+        modified_files = commit.modified_files
+        if modified_files:
+            # guessing the programming language of the fixed code of all files at once
+            languages = language_detector().detect_many([(file.filename, file.source_code) for file in modified_files])
+            for file, programming_language in zip(modified_files, languages):
                 cf.logger.debug(f'Processing file {file.filename} in {commit.hash}')
-                # programming_language = (file.filename.rsplit(".')[-1] if '.' in file.filename else None)
-                programming_language = guess_pl(file.source_code)  # guessing the programming language of fixed code
                 file_change_id = uuid.uuid4().fields[-1]
 
                 file_row = {
@@ -293,6 +431,39 @@ def get_files(commit):
         pass
 
 
+def traverse_fix_commits(repo_url, hashes):
+    """
+    yields the pydriller commits of the given hashes. With MIRROR_PATH configured the repository is
+    kept as a bare mirror and only the missing commits (and their parents) are fetched, otherwise
+    pydriller clones it to a temporary directory.
+    """
+    if cf.MIRROR_PATH:
+        mirror = git_mirror.ensure_mirror(repo_url, cf.MIRROR_PATH, hashes)
+        # the fix commits need not be reachable from the branches of a shallow mirror,
+        # so every hash is looked up directly instead of filtering a walk from HEAD
+        for single_hash in hashes:
+            try:
+                yield from Repository(path_to_repo=str(mirror),
+                                      single=single_hash,
+                                      num_workers=cf.NUM_WORKERS).traverse_commits()
+            except Exception as e:
+                cf.logger.warning(f'Commit {single_hash} not found in the mirror of {repo_url}: {e}')
+        return
+
+    # giving first priority to 'single' parameter for single hash because
+    # it has been tested that 'single' gets commit information in some cases where 'only_commits' does not,
+    # for example: https://github.com/hedgedoc/hedgedoc.git/35b0d39a12aa35f27fba8c1f50b1886706e7efef
+    single_hash = None
+    if len(hashes) == 1:
+        single_hash = hashes[0]
+        hashes = None
+
+    yield from Repository(path_to_repo=repo_url,
+                          only_commits=hashes,
+                          single=single_hash,
+                          num_workers=cf.NUM_WORKERS).traverse_commits()
+
+
 def extract_commits(repo_url, hashes):
     """This function extract git commit information of only the hashes list that were specified in the
     commit URL. All the commit_fields of the corresponding commit have been obtained.
@@ -315,18 +486,7 @@ def extract_commits(repo_url, hashes):
     cf.logger.debug(f'Extracting commits for {repo_url} with {cf.NUM_WORKERS} worker(s) looking for the following hashes:')
     log_commit_urls(repo_url, hashes)
 
-    # giving first priority to 'single' parameter for single hash because
-    # it has been tested that 'single' gets commit information in some cases where 'only_commits' does not,
-    # for example: https://github.com/hedgedoc/hedgedoc.git/35b0d39a12aa35f27fba8c1f50b1886706e7efef
-    single_hash = None
-    if len(hashes) == 1:
-        single_hash = hashes[0]
-        hashes = None
-
-    for commit in Repository(path_to_repo=repo_url,
-                             only_commits=hashes,
-                             single=single_hash,
-                             num_workers=cf.NUM_WORKERS).traverse_commits():
+    for commit in traverse_fix_commits(repo_url, hashes):
         cf.logger.debug(f'Processing {commit.hash}')
         try:
             commit_row = {
@@ -355,6 +515,8 @@ def extract_commits(repo_url, hashes):
             cf.logger.warning(f'Problem while fetching the commits: {e}')
             pass
 
+    cf.logger.info(f'Language detection of the files mined by this process so far - {language_detector().describe()}')
+
     if repo_commits:
         df_repo_commits = pd.DataFrame.from_dict(repo_commits)
         df_repo_commits = df_repo_commits[commit_columns]  # ordering the columns
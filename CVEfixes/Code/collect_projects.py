@@ -1,16 +1,30 @@
 import pandas as pd
-import requests
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from math import floor
+from pathlib import Path
 from github import Github
 from github.GithubException import BadCredentialsException
 
 import configuration as cf
 import database as db
-from collect_commits import extract_commits, extract_project_links
+from bulk_writer import typed_rows
+from collect_commits import commit_columns, extract_commits, extract_project_links, file_columns, method_columns
 import cve_importer
+import url_checker
 from utils import prune_tables
 
+# progress of store_tables per collection run and fix hash, so an interrupted run resumes with the
+# repositories it has not attempted yet, while the next run mines new hashes and retries missed ones
+RUN_TABLE = 'collection_run'
+run_columns = ['run_id', 'started_at', 'finished_at']
+CHECKPOINT_TABLE = 'repository_checkpoint'
+checkpoint_columns = ['run_id', 'repo_url', 'hash', 'status', 'mined_at']
+# repositories collected by the writer before their rows are inserted in one transaction
+WRITE_BATCH_REPOS = 20
+# results of find_unavailable_urls of earlier runs, in the data directory
+AVAILABILITY_CACHE = 'url_availability.json'
+
 repo_columns = [
     'repo_url',
     'repo_name',
@@ -27,32 +41,13 @@ repo_columns = [
 
 def find_unavailable_urls(urls):
     """
-    returns the unavailable urls (repositories that are removed or made private)
+    returns the unavailable urls (repositories that are removed or made private). The urls are checked
+    concurrently and the results are cached in the data directory for URL_CACHE_DAYS.
     """
-    sleeptime = 0
-    unavailable_urls = []
-    for url in urls:
-        response = requests.head(url)
-
-        # wait while sending too many requests (increasing timeout on every iteration)
-        while response.status_code == 429:
-            sleeptime += 10
-            time.sleep(sleeptime)
-            response = requests.head(url)
-        sleeptime = 0
-
-        # GitLab responds to unavailable repositories by redirecting to their login page.
-        # This code is a bit brittle with a hardcoded URL but we want to allow for projects
-        # that are redirected due to renaming or transferal to new owners...
-        if (response.status_code >= 400) or \
-                (response.is_redirect and
-                 response.headers['location'] == 'https://gitlab.com/users/sign_in'):
-            cf.logger.debug(f'Reference {url} is not available with code: {response.status_code}')
-            unavailable_urls.append(url)
-        else:
-            cf.logger.debug(f'Reference {url} is available with code: {response.status_code}')
-
-    return unavailable_urls
+    return url_checker.find_unavailable(urls,
+                                        cache_file=Path(cf.DATA_PATH) / AVAILABILITY_CACHE,
+                                        ttl_days=cf.URL_CACHE_DAYS,
+                                        per_host=cf.URL_CHECK_CONCURRENCY)
 
 
 def convert_runtime(start_time, end_time) -> (int, int, int):
@@ -141,75 +136,220 @@ def get_github_meta(repo_url, username, token):
     return meta_row
 
 
-def save_repo_meta(repo_url):
+def get_repo_meta(repo_url):
     """
-    populate repository meta-information in repository table.
+    returns the repository table row of repo_url as a dataframe, or None for non-GitHub repositories
     """
     if 'github.' in repo_url:
         try:
             meta_dict = get_github_meta(repo_url, cf.USER, cf.TOKEN)
-            df_meta = pd.DataFrame([meta_dict], columns=repo_columns)
-
-            if db.table_exists('repository'):
-                # ignore when the meta-information of the given repo is already saved.
-                if db.fetchone_query('repository', 'repo_url', repo_url) is False:
-                    df_meta.to_sql(name='repository', con=db.conn, if_exists="append", index=False)
-            else:
-                df_meta.to_sql(name='repository', con=db.conn, if_exists="replace", index=False)
+            return pd.DataFrame([meta_dict], columns=repo_columns)
         except Exception as e:
             cf.logger.warning(f'Problem while fetching repository meta-information: {e}')
+    return None
+
+
+def save_repo_meta(repo_url, df_meta=None):
+    """
+    populate repository meta-information in repository table.
+    """
+    if df_meta is None:
+        df_meta = get_repo_meta(repo_url)
+    if df_meta is None:
+        return
+    try:
+        if db.table_exists('repository'):
+            # ignore when the meta-information of the given repo is already saved.
+            if db.fetchone_query('repository', 'repo_url', repo_url) is False:
+                df_meta.to_sql(name='repository', con=db.conn, if_exists="append", index=False)
+        else:
+            df_meta.to_sql(name='repository', con=db.conn, if_exists="replace", index=False)
+    except Exception as e:
+        cf.logger.warning(f'Problem while saving repository meta-information: {e}')
+
+
+def mine_repo(repo_url, hashes):
+    """
+    clones/traverses a single repository, run in the worker processes of store_tables.
+    :returns (repo_url, commit_rows, file_rows, method_rows, df_meta, error) with the rows as typed tuples
+    in the order of commit_columns, file_columns and method_columns (commit_rows is None without commits)
+    """
+    try:
+        df_commit, df_file, df_method = extract_commits(repo_url, hashes)
+        if df_commit is None:
+            return repo_url, None, None, None, None, None
+        df_meta = get_repo_meta(repo_url)
+        return (repo_url, typed_rows(df_commit, commit_columns), typed_rows(df_file, file_columns),
+                typed_rows(df_method, method_columns), df_meta, None)
+    except Exception as e:
+        return repo_url, None, None, None, None, str(e)
+
+
+def iter_mined_repos(repo_hashes, repo_urls, workers):
+    """
+    yields the mine_repo results of repo_urls, in order with a single worker, otherwise as they finish
+    """
+    if workers <= 1:
+        for repo_url in repo_urls:
+            yield mine_repo(repo_url, repo_hashes[repo_url])
+        return
+
+    pending = iter(repo_urls)
+    in_flight = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # at most two repositories per worker are queued, so finished ones do not pile up in memory
+            for repo_url in pending:
+                in_flight.add(pool.submit(mine_repo, repo_url, repo_hashes[repo_url]))
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def start_run():
+    """
+    returns the id of the collection run that was interrupted, or of a new one if the last run finished
+    """
+    if db.table_exists(CHECKPOINT_TABLE) and 'run_id' not in pd.read_sql(
+            f"SELECT * FROM {CHECKPOINT_TABLE} LIMIT 0", con=db.conn).columns:
+        # checkpoints per repository without their hashes, they only served resuming
+        db.execute_sql_cmd(f"DROP TABLE {CHECKPOINT_TABLE}")
+    if db.table_exists(RUN_TABLE):
+        run_id, finished_at = db.conn.execute(
+            f"SELECT run_id, finished_at FROM {RUN_TABLE} ORDER BY run_id DESC LIMIT 1").fetchone()
+        if finished_at is None:
+            cf.logger.info(f'Resuming collection run {run_id}')
+            return run_id
+        run_id += 1
+    else:
+        run_id = 1
+    with db.conn:
+        db.bulk_insert(RUN_TABLE, run_columns, [(run_id, time.strftime('%Y-%m-%d %H:%M:%S'), None)])
+    return run_id
+
+
+def finish_run(run_id):
+    db.execute_data_cmd(f"UPDATE {RUN_TABLE} SET finished_at = ? WHERE run_id = ?",
+                        (time.strftime('%Y-%m-%d %H:%M:%S'), run_id))
+
+
+def attempted_hashes(run_id):
+    """
+    returns {repo_url: hashes} of the fix hashes the run already mined or looked for without finding them
+    (hashes of failed repositories are tried again)
+    """
+    if not db.table_exists(CHECKPOINT_TABLE):
+        return {}
+    df = pd.read_sql(f"SELECT repo_url, hash FROM {CHECKPOINT_TABLE} WHERE run_id = ? AND status != 'failed'",
+                     con=db.conn, params=(run_id,))
+    return {repo_url: set(group.hash) for repo_url, group in df.groupby('repo_url')}
+
+
+def discard_partial_commits():
+    """
+    file_change and method_change rows without their commits row are left over from an interrupted
+    write (before batches were written in one transaction). They are removed and the commit is mined again.
+    """
+    with db.conn:
+        if db.table_exists('file_change'):
+            if db.table_exists('commits'):
+                db.execute_sql_cmd("DELETE FROM file_change WHERE hash NOT IN (SELECT hash FROM commits)")
+            else:
+                db.execute_sql_cmd("DELETE FROM file_change")
+        if db.table_exists('method_change'):
+            if db.table_exists('file_change'):
+                db.execute_sql_cmd("DELETE FROM method_change "
+                                   "WHERE file_change_id NOT IN (SELECT file_change_id FROM file_change)")
+            else:
+                db.execute_sql_cmd("DELETE FROM method_change")
 
 
-def store_tables(df_fixes):
+def write_mined_repos(results, repo_hashes, run_id):
+    """
+    appends the rows of a batch of mine_repo results and records the fix hashes of the repositories in
+    the checkpoint table, all in one transaction. Only the main process writes to the database.
+    """
+    tables = {'method_change': [], 'file_change': [], 'commits': []}
+    checkpoints = []
+    for repo_url, commit_rows, file_rows, method_rows, df_meta, error in results:
+        if error is not None:
+            cf.logger.warning(f'Problem occurred while retrieving the project: {repo_url}: {error}')
+            status = 'failed'
+        elif commit_rows is None:
+            cf.logger.warning(f'Could not retrieve commit information from: {repo_url}')
+            status = 'no_commits'
+        else:
+            cf.logger.debug(f'#Commits: {len(commit_rows)}, #Files: {len(file_rows)}, '
+                            f'#Methods: {len(method_rows)} ({repo_url})')
+            tables['commits'].extend(commit_rows)
+            tables['file_change'].extend(file_rows)
+            tables['method_change'].extend(method_rows)
+            status = 'mined'
+        # hash is the first of commit_columns; the fix hashes may be abbreviated
+        found = [row[0] for row in commit_rows or []]
+        mined_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        for h in repo_hashes[repo_url]:
+            hash_status = 'not_found' if status == 'mined' and not any(c.startswith(h) for c in found) else status
+            checkpoints.append((run_id, repo_url, h, hash_status, mined_at))
+
+    with db.conn:
+        db.bulk_insert('method_change', method_columns, tables['method_change'])
+        db.bulk_insert('file_change', file_columns, tables['file_change'])
+        db.bulk_insert('commits', commit_columns, tables['commits'])
+        if db.table_exists(CHECKPOINT_TABLE):
+            db.conn.executemany(f"DELETE FROM {CHECKPOINT_TABLE} WHERE run_id = ? AND repo_url = ? AND hash = ?",
+                                [c[:3] for c in checkpoints])
+        db.bulk_insert(CHECKPOINT_TABLE, checkpoint_columns, checkpoints)
+
+    for repo_url, commit_rows, file_rows, method_rows, df_meta, error in results:
+        if df_meta is not None:
+            save_repo_meta(repo_url, df_meta)
+
+
+def store_tables(df_fixes, workers=None):
     """
     Fetch the commits and save the extracted data into commit-, file- and method level tables.
+    Repositories are mined by `workers` processes (REPO_WORKERS of the configuration by default)
+    and written in batches by this process. When the previous run was interrupted, the repositories
+    whose pending fix hashes it already attempted are skipped.
     """
+    workers = cf.REPO_WORKERS if workers is None else workers
+    db.start_bulk_load()
+    discard_partial_commits()
+    run_id = start_run()
 
     if db.table_exists('commits'):
         query_done_hashes = "SELECT x.hash FROM fixes x, commits c WHERE x.hash = c.hash;"
         hash_done = list((pd.read_sql(query_done_hashes, con=db.conn))['hash'])
         df_fixes = df_fixes[~df_fixes.hash.isin(hash_done)]  # filtering out already fetched commits
 
-    repo_urls = df_fixes.repo_url.unique()
+    repo_hashes = {repo_url: list(group.hash.unique())
+                   for repo_url, group in df_fixes.groupby('repo_url', sort=False)}
+    attempted = attempted_hashes(run_id)
+    repo_urls = [repo_url for repo_url, hashes in repo_hashes.items()
+                 if not set(hashes) <= attempted.get(repo_url, set())]
     # repo_urls = ['https://github.com/khaledhosny/ots']  # just to check for debugging
     # hashes = ['003c62d28ae438aa8943cb31535563397f838a2c', 'fd']
-    pcount = 0
+    cf.logger.info(f'Retrieving fixes of {len(repo_urls)} repositories with {workers} worker(s), '
+                   f'skipping {len(repo_hashes) - len(repo_urls)} attempted before run {run_id} was interrupted')
 
-    for repo_url in repo_urls:
+    pcount = 0
+    batch = []
+    for result in iter_mined_repos(repo_hashes, repo_urls, workers):
         pcount += 1
-        try:
-            df_single_repo = df_fixes[df_fixes.repo_url == repo_url]
-            hashes = list(df_single_repo.hash.unique())
-            cf.logger.info('-' * 70)
-            cf.logger.info(f'Retrieving fixes for repo {pcount} of {len(repo_urls)} - {repo_url.rsplit("/")[-1]}')
-
-            # extract_commits method returns data at different granularity levels
-            df_commit, df_file, df_method = extract_commits(repo_url, hashes)
-
-            if df_commit is not None:
-                with db.conn:
-                    # ----------------appending each project data to the tables-------------------------------
-                    df_commit = df_commit.applymap(str)
-                    df_commit.to_sql(name="commits", con=db.conn, if_exists="append", index=False)
-                    cf.logger.debug(f'#Commits: {len(df_commit)}')
-
-                    if df_file is not None:
-                        df_file = df_file.applymap(str)
-                        df_file.to_sql(name="file_change", con=db.conn, if_exists="append", index=False)
-                        cf.logger.debug(f'#Files: {len(df_file)}')
-
-                    if df_method is not None:
-                        df_method = df_method.applymap(str)
-                        df_method.to_sql(name="method_change", con=db.conn, if_exists="append", index=False)
-                        cf.logger.debug(f'#Methods: {len(df_method)}')
-
-                    save_repo_meta(repo_url)
-            else:
-                cf.logger.warning(f'Could not retrieve commit information from: {repo_url}')
-
-        except Exception as e:
-            cf.logger.warning(f'Problem occurred while retrieving the project: {repo_url}: {e}')
-            pass  # skip fetching repository if is not available.
+        cf.logger.info(f'Retrieved fixes for repo {pcount} of {len(repo_urls)} - {result[0].rsplit("/")[-1]}')
+        batch.append(result)
+        if len(batch) >= WRITE_BATCH_REPOS:
+            write_mined_repos(batch, repo_hashes, run_id)
+            batch = []
+    if batch:
+        write_mined_repos(batch, repo_hashes, run_id)
+    finish_run(run_id)
+    db.finish_bulk_load()
 
     cf.logger.debug('-' * 70)
     if db.table_exists('commits'):
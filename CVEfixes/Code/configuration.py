@@ -10,6 +10,10 @@ USER = None
 TOKEN = None
 SAMPLE_LIMIT = 25
 NUM_WORKERS = 4
+REPO_WORKERS = 1
+MIRROR_PATH = None
+URL_CHECK_CONCURRENCY = 8
+URL_CACHE_DAYS = 7
 LOGGING_LEVEL = logging.WARNING
 
 # full path to the .db file
@@ -36,7 +40,8 @@ def read_config() -> None:
 
     Sets global constants with values found in the ini file.
     """
-    global DATA_PATH, DATABASE_NAME, DATABASE, USER, TOKEN, SAMPLE_LIMIT, NUM_WORKERS, LOGGING_LEVEL, config_read
+    global DATA_PATH, DATABASE_NAME, DATABASE, USER, TOKEN, SAMPLE_LIMIT, NUM_WORKERS, REPO_WORKERS, MIRROR_PATH, \
+        URL_CHECK_CONCURRENCY, URL_CACHE_DAYS, LOGGING_LEVEL, config_read
 
     config = ConfigParser()
     if config.read(['.CVEfixes.ini',
@@ -49,6 +54,10 @@ def read_config() -> None:
         TOKEN = config.get('GitHub', 'token', fallback=TOKEN)
         SAMPLE_LIMIT = config.getint('CVEfixes', 'sample_limit', fallback=SAMPLE_LIMIT)
         NUM_WORKERS = config.getint('CVEfixes', 'num_workers', fallback=NUM_WORKERS)
+        REPO_WORKERS = config.getint('CVEfixes', 'repo_workers', fallback=REPO_WORKERS)
+        MIRROR_PATH = config.get('CVEfixes', 'mirror_path', fallback=MIRROR_PATH)
+        URL_CHECK_CONCURRENCY = config.getint('CVEfixes', 'url_check_concurrency', fallback=URL_CHECK_CONCURRENCY)
+        URL_CACHE_DAYS = config.getint('CVEfixes', 'url_cache_days', fallback=URL_CACHE_DAYS)
         Path(DATA_PATH).mkdir(parents=True, exist_ok=True)  # create the directory if not exists.
         DATABASE = Path(DATA_PATH) / DATABASE_NAME
         LOGGING_LEVEL = log_level_map.get(config.get('CVEfixes', 'logging_level', fallback='WARNING'), logging.WARNING)
@@ -64,6 +73,7 @@ if not config_read:
     logging.getLogger("requests").setLevel(LOGGING_LEVEL)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     logging.getLogger("urllib3.connection").setLevel(logging.WARNING)
+    logging.getLogger("aiohttp").setLevel(logging.WARNING)
     logging.getLogger("pathlib").setLevel(LOGGING_LEVEL)
     logging.getLogger("subprocess").setLevel(LOGGING_LEVEL)
     logging.getLogger("h5py._conv").setLevel(logging.WARNING)
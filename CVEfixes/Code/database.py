@@ -1,6 +1,7 @@
 import sqlite3
 import sys
 import configuration as cf
+import bulk_writer
 from sqlite3 import Error
 
 conn = None
@@ -37,10 +38,35 @@ def execute_sql_cmd(query):
     cursor.execute(query)
 
 
-def execute_data_cmd(query, data):
+def execute_data_cmd(query, data, commit=True):
     cursor = conn.cursor()
     cursor.execute(query, data)
-    conn.commit()
+    if commit:
+        conn.commit()
+
+
+def execute_many(query, rows):
+    """
+    executes a prepared statement for all rows in a single transaction
+    """
+    with conn:
+        conn.executemany(query, rows)
+
+
+def bulk_insert(table_name, columns, rows):
+    """
+    appends typed rows (see bulk_writer.typed_rows) to the table, creating it with typed columns if needed.
+    The caller commits, e.g. with `with db.conn:` around all tables of a batch
+    """
+    return bulk_writer.insert_rows(conn, table_name, columns, rows)
+
+
+def start_bulk_load():
+    bulk_writer.configure_bulk_load(conn)
+
+
+def finish_bulk_load():
+    bulk_writer.finish_bulk_load(conn)
 
 
 def fetchone_query(table_name, col, value):
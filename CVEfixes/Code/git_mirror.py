@@ -0,0 +1,156 @@
+import fcntl
+import hashlib
+import logging
+import re
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+
+# same logger as configuration.logger; this module does not read the configuration itself
+logger = logging.getLogger('CVEfixes')
+
+# fix commits are fetched with their parents, which is all pydriller needs for the diffs
+FETCH_DEPTH = 2
+FULL_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+
+class GitMirrorError(Exception):
+    pass
+
+
+def _git(path, *args, input=None):
+    result = subprocess.run(['git', '-C', str(path), *args], input=input, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise GitMirrorError(f'git {" ".join(args[:2])} failed in {path}: {result.stderr.strip()}')
+    return result.stdout
+
+
+def normalize_url(repo_url):
+    url = repo_url.rstrip('/')
+    return url[:-4] if url.endswith('.git') else url
+
+
+def mirror_dir(mirror_root, repo_url):
+    """
+    returns the bare mirror of repo_url under mirror_root: a readable name plus a hash of the
+    normalized url, so the url with or without '.git' share one mirror
+    """
+    url = normalize_url(repo_url)
+    readable = re.sub(r'[^A-Za-z0-9._-]+', '_', re.sub(r'^[a-z+]+://', '', url)).strip('_')[-80:]
+    return Path(mirror_root) / f'{readable}-{hashlib.sha1(url.encode()).hexdigest()[:10]}.git'
+
+
+@contextmanager
+def _locked(path):
+    # workers of different runs may mine the same repository; git itself only locks single refs
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path) + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _init_mirror(path, repo_url):
+    subprocess.run(['git', 'init', '--bare', '--quiet', str(path)], check=True, capture_output=True)
+    _git(path, 'remote', 'add', 'origin', repo_url)
+
+
+def _present(path, objects):
+    """
+    returns the subset of objects (full or abbreviated hashes) that are commits in the mirror
+    """
+    if not objects:
+        return set()
+    out = _git(path, 'cat-file', '--batch-check', input=''.join(f'{o}^{{commit}}\n' for o in objects))
+    return {o for o, line in zip(objects, out.splitlines()) if not line.endswith('missing') and 'ambiguous' not in line}
+
+
+def missing_commits(path, hashes):
+    """
+    returns the hashes whose commit or one of its parents is not in the mirror
+    """
+    hashes = list(dict.fromkeys(hashes))
+    found = _present(path, hashes)
+    present = [h for h in hashes if h in found]
+    missing = [h for h in hashes if h not in present]
+    if present:
+        full = _git(path, 'rev-parse', *[f'{h}^{{commit}}' for h in present]).split()
+        parents = {}
+        for line in _git(path, 'rev-list', '--no-walk=unsorted', '--parents', *full).splitlines():
+            commit, *commit_parents = line.split()
+            parents[commit] = commit_parents
+        all_parents = list({p for commit_parents in parents.values() for p in commit_parents})
+        present_parents = _present(path, all_parents)
+        # commits at the shallow boundary are listed without their parents
+        shallow = set((path / 'shallow').read_text().split()) if (path / 'shallow').exists() else set()
+        for h, commit in zip(present, full):
+            if commit in shallow or any(p not in present_parents for p in parents.get(commit, [])):
+                missing.append(h)
+    return missing
+
+
+def fetch_commits(path, hashes, depth=FETCH_DEPTH):
+    """
+    fetches the given commits and their parents only. Servers refuse commits that are not given by
+    their full hash or are unreachable from their refs, so the result is checked with missing_commits
+    """
+    full_hashes = [h for h in hashes if re.fullmatch(r'[0-9a-f]{40}', h)]
+    if full_hashes:
+        try:
+            _git(path, 'fetch', '--quiet', f'--depth={depth}', 'origin', *full_hashes)
+        except GitMirrorError as e:
+            logger.debug(f'Shallow fetch of {len(full_hashes)} commit(s) failed: {e}')
+    return missing_commits(path, hashes)
+
+
+def pin_commits(path, hashes):
+    """
+    keeps the commits from being pruned by git gc: commits fetched by hash are not reachable from any ref
+    """
+    found = _present(path, list(hashes))
+    if found:
+        full = _git(path, 'rev-parse', *[f'{h}^{{commit}}' for h in found]).split()
+        _git(path, 'update-ref', '--stdin', input=''.join(f'update refs/fixes/{c} {c}\n' for c in full))
+
+
+def fetch_all(path):
+    args = ['fetch', '--quiet', '--prune', '--tags']
+    if (path / 'shallow').exists():
+        args.append('--unshallow')
+    _git(path, *args, 'origin', *FULL_REFSPECS)
+
+
+def ensure_mirror(repo_url, mirror_root, hashes=None):
+    """
+    returns the path of an up-to-date bare mirror of repo_url under mirror_root. With hashes, only
+    the commits (and their parents) not in the mirror yet are fetched, falling back to fetching
+    everything when the remote does not serve them; without hashes all branches and tags are fetched.
+    """
+    path = mirror_dir(mirror_root, repo_url)
+    with _locked(path):
+        if not (path / 'HEAD').exists():
+            logger.info(f'Creating mirror {path} for {repo_url}')
+            _init_mirror(path, repo_url)
+        if not hashes:
+            fetch_all(path)
+            return path
+        missing = missing_commits(path, hashes)
+        if missing:
+            logger.debug(f'Fetching {len(missing)} of {len(hashes)} commit(s) of {repo_url}')
+            missing = fetch_commits(path, missing)
+        if missing:
+            logger.debug(f'Fetching all of {repo_url} for {len(missing)} commit(s)')
+            fetch_all(path)
+        else:
+            logger.debug(f'Mirror {path} has all {len(hashes)} commit(s)')
+        pin_commits(path, hashes)
+    return path
+
+
+if __name__ == '__main__':
+    # python Code/git_mirror.py <mirror root> <repo url> [<hash> ...]
+    import sys
+    logging.basicConfig(level=logging.DEBUG)
+    print(ensure_mirror(sys.argv[2], sys.argv[1], sys.argv[3:]))
@@ -0,0 +1,179 @@
+import asyncio
+import email.utils
+import json
+import logging
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# same logger as configuration.logger; this module does not read the configuration itself
+logger = logging.getLogger('CVEfixes')
+
+# open connections in total and per host; GitHub and GitLab rate limit a single client well below the former
+MAX_CONNECTIONS = 64
+PER_HOST = 8
+REQUEST_TIMEOUT = 30
+# answers to 429 are retried this many times before the url is given up for this run
+MAX_RETRIES = 8
+BACKOFF_STEP = 10  # seconds added per retry when the response has no Retry-After
+MAX_BACKOFF = 300
+CACHE_TTL_DAYS = 7
+
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+GITLAB_SIGN_IN = 'https://gitlab.com/users/sign_in'
+
+
+def retry_after(value, attempt, now=None):
+    """
+    returns the seconds to wait for a Retry-After header (delay-seconds or an HTTP date), or the
+    increasing back-off of the earlier checker when it is missing or malformed
+    """
+    now = time.time() if now is None else now
+    if value:
+        value = value.strip()
+        if value.isdigit():
+            return min(int(value), MAX_BACKOFF)
+        try:
+            return min(max(email.utils.parsedate_to_datetime(value).timestamp() - now, 0), MAX_BACKOFF)
+        except (TypeError, ValueError):
+            pass
+    return min(BACKOFF_STEP * attempt, MAX_BACKOFF)
+
+
+def is_unavailable(status, location=None):
+    # GitLab responds to unavailable repositories by redirecting to their login page.
+    # This code is a bit brittle with a hardcoded URL but we want to allow for projects
+    # that are redirected due to renaming or transferal to new owners...
+    return status >= 400 or (status in REDIRECT_CODES and location == GITLAB_SIGN_IN)
+
+
+class AvailabilityCache:
+    """
+    Results of earlier checks in a JSON file, {url: {"status": ..., "available": ..., "checked_at": ...}},
+    so a rerun only checks urls that are new or older than ttl_days.
+    """
+    def __init__(self, path=None, ttl_days=CACHE_TTL_DAYS):
+        self.path = Path(path) if path else None
+        self.ttl = ttl_days * 24 * 3600
+        self.entries = {}
+        if self.path and self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except ValueError as e:
+                logger.warning(f'Ignoring unreadable availability cache {self.path}: {e}')
+
+    def get(self, url, now=None):
+        """
+        returns True/False for a fresh entry of url, otherwise None
+        """
+        entry = self.entries.get(url)
+        now = time.time() if now is None else now
+        if entry is None or now - entry['checked_at'] > self.ttl:
+            return None
+        return entry['available']
+
+    def put(self, url, status, available):
+        self.entries[url] = {'status': status, 'available': available, 'checked_at': time.time()}
+
+    def save(self):
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+            tmp.write_text(json.dumps(self.entries, indent=0, sort_keys=True))
+            tmp.replace(self.path)
+
+
+class HostLimiter:
+    """
+    At most per_host requests in flight per host; a 429 pauses all requests to that host until its
+    Retry-After has passed, instead of only the request that got it.
+    """
+    def __init__(self, per_host=PER_HOST):
+        self.per_host = per_host
+        self.semaphores = {}
+        self.resume_at = {}
+
+    def semaphore(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self.semaphores[host]
+
+    def pause(self, host, seconds):
+        self.resume_at[host] = max(self.resume_at.get(host, 0), time.monotonic() + seconds)
+
+    async def wait(self, host):
+        delay = self.resume_at.get(host, 0) - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.resume_at.get(host, 0) - time.monotonic()
+
+
+async def check_url(session, limiter, url):
+    """
+    returns the HTTP status of a HEAD request to url (redirects are not followed) and whether the
+    repository is available, or (None, None) when no answer was obtained
+    """
+    host = urlsplit(url).netloc
+    for attempt in range(1, MAX_RETRIES + 1):
+        await limiter.wait(host)
+        async with limiter.semaphore(host):
+            await limiter.wait(host)
+            try:
+                async with session.head(url, allow_redirects=False) as response:
+                    status = response.status
+                    location = response.headers.get('Location')
+                    delay = retry_after(response.headers.get('Retry-After'), attempt) if status == 429 else 0
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f'Could not check {url}: {e!r}')
+                return None, None
+        if status != 429:
+            return status, not is_unavailable(status, location)
+        logger.debug(f'Too many requests to {host}, waiting {delay:.0f}s ({url})')
+        limiter.pause(host, delay)
+    logger.warning(f'Could not check {url}: still rate limited after {MAX_RETRIES} attempts')
+    return None, None
+
+
+async def check_urls(urls, per_host=PER_HOST, max_connections=MAX_CONNECTIONS, timeout=REQUEST_TIMEOUT):
+    """
+    returns {url: (status, available)} for the urls, checked concurrently over one connection pool
+    """
+    limiter = HostLimiter(per_host)
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=per_host)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        results = await asyncio.gather(*[check_url(session, limiter, url) for url in urls])
+    return dict(zip(urls, results))
+
+
+def find_unavailable(urls, cache_file=None, ttl_days=CACHE_TTL_DAYS, per_host=PER_HOST):
+    """
+    returns the unavailable urls (repositories that are removed or made private). Urls that could not
+    be checked count as available and are not cached, so mining decides and the next run checks again.
+    """
+    urls = list(dict.fromkeys(urls))
+    cache = AvailabilityCache(cache_file, ttl_days)
+    known = {url: cache.get(url) for url in urls}
+    stale = [url for url, available in known.items() if available is None]
+    logger.debug(f'Checking {len(stale)} of {len(urls)} urls, {len(urls) - len(stale)} cached')
+
+    if stale:
+        for url, (status, available) in asyncio.run(check_urls(stale, per_host)).items():
+            if status is None:
+                available = True
+            else:
+                cache.put(url, status, available)
+                logger.debug(f'Reference {url} is {"" if available else "not "}available with code: {status}')
+            known[url] = available
+        cache.save()
+
+    return [url for url, available in known.items() if not available]
+
+
+if __name__ == '__main__':
+    # python Code/url_checker.py <url> ...
+    import sys
+    logging.basicConfig(level=logging.DEBUG)
+    print(find_unavailable(sys.argv[1:]))
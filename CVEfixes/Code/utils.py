@@ -74,7 +74,8 @@ def filter_non_textual(df_file):
     non_text_files = []
     count_files = 0
     for i in range(len(df_file)):
-        if df_file.num_lines_added[i] == '0' and df_file.num_lines_deleted[i] == '0':
+        # compared as strings: older databases store the counts as text, typed tables as integers
+        if str(df_file.num_lines_added[i]) == '0' and str(df_file.num_lines_deleted[i]) == '0':
             non_text_files.append(df_file.file_change_id[i])
             count_files += 1
     cf.logger.debug(f'Non-textual files: {count_files}')
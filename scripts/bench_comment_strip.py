@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Throughput of the shared comment stripper (secvul-llm-study/utils/comments.py) against the
+implementations it replaced, on a CVEfixes method export.
+
+Usage:
+  python scripts/bench_comment_strip.py --csv data/cvefixed_ba.csv [--columns method_code_before method_code_after] [--repeat 3]
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "secvul-llm-study"))
+from utils.comments import HASH_LANGS, comment_style, strip_comments  # noqa: E402
+
+
+# ----------------------------------------
+# Previous implementations (reference)
+# ----------------------------------------
+
+def strip_c_like_state_machine(src):
+    # former build_utsv_cvefixes_csv._strip_c_like_comments (verbatim)
+    if src is None:
+        return ""
+    n = len(src)
+    i = 0
+    out = []
+    in_sl_comment = False
+    in_bl_comment = False
+    in_s = False
+    in_d = False
+    in_c = False  # char literal
+    while i < n:
+        ch = src[i]
+        ch2 = src[i+1] if i+1 < n else ""
+
+        # end single line comment
+        if in_sl_comment:
+            if ch == "\n":
+                in_sl_comment = False
+                out.append(ch)
+            i += 1
+            continue
+
+        # end block comment
+        if in_bl_comment:
+            if ch == "*" and ch2 == "/":
+                in_bl_comment = False
+                i += 2
+            else:
+                i += 1
+            continue
+
+        # handle string/char literals with escapes
+        if in_s:
+            out.append(ch)
+            if ch == "\\":
+                if i+1 < n:
+                    out.append(src[i+1])
+                    i += 2
+                else:
+                    i += 1
+            elif ch == "'":
+                in_s = False
+                i += 1
+            else:
+                i += 1
+            continue
+
+        if in_d:
+            out.append(ch)
+            if ch == "\\":
+                if i+1 < n:
+                    out.append(src[i+1])
+                    i += 2
+                else:
+                    i += 1
+            elif ch == '"':
+                in_d = False
+                i += 1
+            else:
+                i += 1
+            continue
+
+        if in_c:
+            out.append(ch)
+            if ch == "\\":
+                if i+1 < n:
+                    out.append(src[i+1])
+                    i += 2
+                else:
+                    i += 1
+            elif ch == "'":
+                in_c = False
+                i += 1
+            else:
+                i += 1
+            continue
+
+        # detect starts
+        if ch == "/" and ch2 == "/":
+            in_sl_comment = True
+            i += 2
+            continue
+        if ch == "/" and ch2 == "*":
+            in_bl_comment = True
+            i += 2
+            continue
+        if ch == '"':
+            in_d = True
+            out.append(ch)
+            i += 1
+            continue
+        if ch == "'":
+            in_c = True
+            out.append(ch)
+            i += 1
+            continue
+
+        out.append(ch)
+        i += 1
+
+    return "".join(out)
+
+
+def strip_hash_lines(src):
+    out_lines = []
+    for line in src.splitlines(True):
+        m = re.match(r"^(\s*)#", line)
+        out_lines.append(m.group(1) + "\n" if m else line)
+    return "".join(out_lines)
+
+
+def remove_comments_cpp_loader(code):
+    # former CVEFixes.remove_comments_cpp
+    code = re.sub(re.compile(r"/\*.*?\*/", re.DOTALL), "", code)
+    code = re.sub(re.compile(r"[^:]//.*?\n|^//.*?\n"), "", code)
+    return code
+
+
+_ws_re = re.compile(r"\s+", re.S)
+
+
+def normalize_reference(src, lang):
+    s = strip_c_like_state_machine(src)
+    if lang in HASH_LANGS:
+        s = strip_hash_lines(s)
+    return _ws_re.sub("", s)
+
+
+def normalize(src, lang):
+    return _ws_re.sub("", strip_comments(src, comment_style(lang)))
+
+
+# ----------------------------------------
+# Benchmark
+# ----------------------------------------
+
+def load_corpus(path, columns):
+    csv.field_size_limit(sys.maxsize)
+    corpus = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            lang = row.get("programming_language", None)
+            for c in columns:
+                if row.get(c):
+                    corpus.append((row[c], lang))
+    return corpus
+
+
+def bench(fn, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        st = time.perf_counter()
+        for src, lang in corpus:
+            fn(src, lang)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark comment stripping on a CVEfixes CSV export.")
+    p.add_argument("--csv", required=True, help="CSV with method code columns")
+    p.add_argument("--columns", nargs="*", default=["method_code_before", "method_code_after"])
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    corpus = load_corpus(args.csv, args.columns)
+    if not corpus:
+        print("No code found in", args.csv)
+        sys.exit(1)
+    chars = sum(len(src) for src, _ in corpus)
+    print(f"snippets: {len(corpus)}, characters: {chars}")
+
+    differ = sum(1 for src, lang in corpus if normalize(src, lang) != normalize_reference(src, lang))
+    print(f"normalized differently from the previous export normalization: {differ}")
+
+    cases = [
+        ("export state machine", lambda src, lang: strip_c_like_state_machine(src)),
+        ("loader regexes", lambda src, lang: remove_comments_cpp_loader(src)),
+        ("strip_comments", lambda src, lang: strip_comments(src, comment_style(lang))),
+    ]
+    for name, fn in cases:
+        t = bench(fn, corpus, args.repeat)
+        print(f"{name:>22}: {t:.3f}s  {len(corpus) / t:.0f} snippets/s  {chars / t / 1e6:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,21 +8,40 @@ Logic:
   - Always strip comments and whitespace for COMPARISON ONLY.
   - Skip pairs whose normalized(before) == normalized(after).
   - Stream results (no ORDER BY) with fetchmany().
+  - --incremental appends only pairs whose before row has a method_change rowid above the
+    high-water mark of the previous run (recorded in <out>.state.json); the after row of a
+    method is stored together with its before row, so pairs never straddle the mark.
+  - --prepare materializes the pairing join (as rowids) into a sidecar DB; later exports
+    read through it while it is up to date with the source DB.
+  - --format parquet|arrow writes the same columns (all strings) with pyarrow, one row group
+    (Parquet) or record batch (Arrow IPC file) per --row-group-size rows, so loaders can read
+    the metadata without the code columns.
+  - --near-dup J clusters pairs whose normalized before bodies have estimated Jaccard similarity
+    >= J over character shingles (MinHash signatures, banded LSH, first pair of a cluster is its
+    representative) and adds a cluster_id column; --one-per-cluster keeps only representatives.
 
 Usage:
   python build_method_pairs_paired.py --db CVEfixes.db --out method_pairs.csv \
     [--language C C++] [--cwe 79 89] [--include-unknown-cwe] \
     [--include-path sub1 sub2] [--exclude-path sub1 sub2] \
-    [--limit N] [--chunk-size 1000] [--flush-every 200] [--no-commit-msg] [--verbose]
+    [--limit N] [--chunk-size 1000] [--flush-every 200] [--no-commit-msg] [--verbose] \
+    [--workers N] [--unordered] [--prepare] [--sidecar PATH] [--incremental [--delta new_pairs.csv]] \
+    [--format csv|parquet|arrow] [--row-group-size N] [--near-dup 0.8 [--num-perm 128] [--one-per-cluster]]
 """
 
 import argparse
 import csv
+import json
 import os
 import re
 import sqlite3
+import sys
 import time
-from typing import Iterable, List, Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from tqdm import tqdm
 
@@ -31,130 +50,9 @@ from tqdm import tqdm
 # Comment stripping for comparison
 # ----------------------------------------
 
-HASH_LANGS = {
-    "Python", "Ruby", "Perl", "Shell", "Makefile", "R", "Haskell", "YAML"
-}
-
-def _strip_c_like_comments(src: str) -> str:
-    """Remove // and /* */ comments while preserving strings and chars."""
-    if src is None:
-        return ""
-    n = len(src)
-    i = 0
-    out = []
-    in_sl_comment = False
-    in_bl_comment = False
-    in_s = False
-    in_d = False
-    in_c = False  # char literal
-    while i < n:
-        ch = src[i]
-        ch2 = src[i+1] if i+1 < n else ""
-
-        # end single line comment
-        if in_sl_comment:
-            if ch == "\n":
-                in_sl_comment = False
-                out.append(ch)
-            i += 1
-            continue
-
-        # end block comment
-        if in_bl_comment:
-            if ch == "*" and ch2 == "/":
-                in_bl_comment = False
-                i += 2
-            else:
-                i += 1
-            continue
-
-        # handle string/char literals with escapes
-        if in_s:
-            out.append(ch)
-            if ch == "\\":
-                if i+1 < n:
-                    out.append(src[i+1])
-                    i += 2
-                else:
-                    i += 1
-            elif ch == "'":
-                in_s = False
-                i += 1
-            else:
-                i += 1
-            continue
-
-        if in_d:
-            out.append(ch)
-            if ch == "\\":
-                if i+1 < n:
-                    out.append(src[i+1])
-                    i += 2
-                else:
-                    i += 1
-            elif ch == '"':
-                in_d = False
-                i += 1
-            else:
-                i += 1
-            continue
-
-        if in_c:
-            out.append(ch)
-            if ch == "\\":
-                if i+1 < n:
-                    out.append(src[i+1])
-                    i += 2
-                else:
-                    i += 1
-            elif ch == "'":
-                in_c = False
-                i += 1
-            else:
-                i += 1
-            continue
-
-        # detect starts
-        if ch == "/" and ch2 == "/":
-            in_sl_comment = True
-            i += 2
-            continue
-        if ch == "/" and ch2 == "*":
-            in_bl_comment = True
-            i += 2
-            continue
-        if ch == '"':
-            in_d = True
-            out.append(ch)
-            i += 1
-            continue
-        if ch == "'":
-            in_c = True
-            out.append(ch)
-            i += 1
-            continue
-
-        out.append(ch)
-        i += 1
-
-    return "".join(out)
-
-
-def _strip_hash_line_comments(src: str) -> str:
-    """Strip leading-# line comments (Python, Perl, Shell, etc.)."""
-    if src is None:
-        return ""
-    out_lines = []
-    for line in src.splitlines(True):
-        # If a line starts with optional whitespace then '#', drop from that point
-        m = re.match(r"^(\s*)#", line)
-        if m:
-            # whole line is comment
-            # keep newline to avoid accidental token concatenation across lines
-            out_lines.append(m.group(1) + "\n")
-        else:
-            out_lines.append(line)
-    return "".join(out_lines)
+# shared with the dataset loaders in secvul-llm-study
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "secvul-llm-study"))
+from utils.comments import comment_style, strip_comments  # noqa: E402
 
 
 _ws_re = re.compile(r"\s+", re.S)
@@ -162,14 +60,156 @@ _ws_re = re.compile(r"\s+", re.S)
 def normalize_for_compare(src: str, lang: Optional[str]) -> str:
     if not src:
         return ""
-    s = _strip_c_like_comments(src)
-    if lang and lang in HASH_LANGS:
-        s = _strip_hash_line_comments(s)
+    s = strip_comments(src, comment_style(lang))
     # collapse whitespace for equality check
     s = _ws_re.sub("", s)
     return s
 
 
+def check_chunk(pairs: List[tuple], num_perm: int = 0) -> Tuple[List[bool], Optional[List[Optional[bytes]]]]:
+    """
+    Changed mask of (before, after, lang) pairs (True where they differ beyond comments and
+    whitespace) and, with num_perm > 0, the MinHash signature of each changed normalized before body.
+    """
+    mask = []
+    signatures = [] if num_perm else None
+    for b, a, lang in pairs:
+        nb = normalize_for_compare(b, lang)
+        mask.append(nb != normalize_for_compare(a, lang))
+        if signatures is not None:
+            signatures.append(minhash(nb, num_perm) if mask[-1] else None)
+    return mask, signatures
+
+
+# ----------------------------------------
+# Near-duplicate clustering
+# ----------------------------------------
+
+SHINGLE_SIZE = 5  # characters of the normalized body per shingle
+_PERM_SEED = 1    # fixed so every worker process draws the same hash functions
+_SHINGLE_BLOCK = 4096
+
+
+@lru_cache(maxsize=None)
+def _hash_params(num_perm: int):
+    import numpy as np
+    rng = np.random.RandomState(_PERM_SEED)
+    a = rng.randint(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def minhash(normalized: str, num_perm: int) -> bytes:
+    """
+    MinHash signature (num_perm uint32 values) of the character shingles of a normalized body.
+    Shingles are hashed with a polynomial rolling hash and permuted with multiply-shift hashing,
+    all in 64-bit wrapping arithmetic, so signatures are identical across processes.
+    """
+    import numpy as np
+    data = np.frombuffer(normalized.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    k = min(SHINGLE_SIZE, len(data))
+    n = len(data) - k + 1
+    shingles = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        shingles = shingles * np.uint64(1099511628211) + data[i:i + n]
+    shingles = np.unique(shingles)
+    a, b = _hash_params(num_perm)
+    sig = np.full(num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(shingles), _SHINGLE_BLOCK):
+        block = shingles[None, start:start + _SHINGLE_BLOCK]
+        sig = np.minimum(sig, ((a * block + b) >> np.uint64(32)).min(axis=1))
+    return sig.astype(np.uint32).tobytes()
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    (bands, rows per band) for banded LSH: the most rows per band (fewest spurious candidates)
+    that still makes a pair with Jaccard similarity `threshold` a candidate with probability >= 0.95.
+    """
+    best = (num_perm, 1)
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        if 1 - (1 - threshold ** r) ** b >= 0.95:
+            best = (b, r)
+    return best
+
+
+class NearDupIndex:
+    """
+    Online leader clustering of MinHash signatures. A signature joins the earliest cluster whose
+    representative shares an LSH band with it and agrees on at least `threshold` of the positions
+    (estimated Jaccard similarity), otherwise it starts a new cluster. Only representatives are
+    indexed, so lookups cost a few bucket probes regardless of how many rows were seen.
+    """
+
+    def __init__(self, threshold: float, num_perm: int):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = [dict() for _ in range(self.bands)]
+        self.representatives = []
+
+    def _keys(self, sig: bytes) -> List[bytes]:
+        width = 4 * self.rows
+        return [sig[i * width:(i + 1) * width] for i in range(self.bands)]
+
+    def assign(self, sig: bytes) -> Tuple[int, bool]:
+        """Returns (cluster id, True if sig starts a new cluster)."""
+        import numpy as np
+        values = np.frombuffer(sig, dtype=np.uint32)
+        keys = self._keys(sig)
+        candidates = sorted({c for bucket, key in zip(self.buckets, keys) for c in bucket.get(key, ())})
+        for c in candidates:
+            if np.mean(self.representatives[c] == values) >= self.threshold:
+                return c, False
+        cluster_id = len(self.representatives)
+        self.representatives.append(values)
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(cluster_id)
+        return cluster_id, True
+
+
+def _pairs(rows: List[sqlite3.Row]) -> List[tuple]:
+    # only the code and language cross the process boundary, not the full rows
+    return [(r["method_code_before"], r["method_code_after"], r["programming_language"]) for r in rows]
+
+
+def iter_changed(cur: sqlite3.Cursor, chunk_size: int, workers: int, ordered: bool = True,
+                 num_perm: int = 0) -> Iterator[Tuple[List[sqlite3.Row], List[bool], Optional[List[Optional[bytes]]]]]:
+    """
+    Yields (rows, changed mask, MinHash signatures or None) per fetchmany chunk. With workers > 1
+    the main thread keeps fetching while a process pool normalizes up to 2 * workers chunks; chunks
+    come back in fetch order unless ordered is False, in which case they are yielded as they finish.
+    """
+    if workers <= 1:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield (rows,) + check_chunk(_pairs(rows), num_perm)
+
+    max_in_flight = 2 * workers
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        exhausted = False
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < max_in_flight:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    exhausted = True
+                    break
+                in_flight.append((pool.submit(check_chunk, _pairs(rows), num_perm), rows))
+            if not in_flight:
+                break
+            if ordered:
+                future, rows = in_flight.popleft()
+            else:
+                wait([f for f, _ in in_flight], return_when=FIRST_COMPLETED)
+                idx = next(i for i, (f, _) in enumerate(in_flight) if f.done())
+                future, rows = in_flight[idx]
+                del in_flight[idx]
+            yield (rows,) + future.result()
+
+
 # ----------------------------------------
 # CLI and DB
 # ----------------------------------------
@@ -177,7 +217,7 @@ def normalize_for_compare(src: str, lang: Optional[str]) -> str:
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Export method-level before/after pairs (comment-insensitive).")
     p.add_argument("--db", required=True, help="Path to CVEfixes SQLite DB")
-    p.add_argument("--out", default="method_pairs.csv", help="Output CSV path")
+    p.add_argument("--out", default="method_pairs.csv", help="Output path (CSV, or Parquet/Arrow with --format)")
     p.add_argument("--language", nargs="*", default=None, help="Filter by file_change.programming_language")
     p.add_argument("--cwe", nargs="*", default=None, help="Filter by CWE IDs, e.g. 79 89 120")
     p.add_argument("--include-unknown-cwe", action="store_true", help="Allow rows with NULL CWE")
@@ -186,16 +226,38 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--no-commit-msg", action="store_true", help="Omit commit message text")
     p.add_argument("--limit", type=int, default=None, help="Stop after writing N rows total")
     p.add_argument("--chunk-size", type=int, default=1000, help="fetchmany size for streaming")
+    p.add_argument("--prepare", action="store_true", help="(Re)build the sidecar DB with the materialized pairing table before exporting")
+    p.add_argument("--sidecar", default=None, help="Sidecar DB path (default: <db>.pairs.db). Used whenever it is up to date with --db")
+    p.add_argument("--incremental", action="store_true", help="Append only pairs added since the last export of --out (state in <out>.state.json)")
+    p.add_argument("--delta", default=None, help="With --incremental, also write this run's new pairs to this CSV")
+    p.add_argument("--workers", type=int, default=1, help="Processes used to normalize code for the change check")
+    p.add_argument("--unordered", action="store_true", help="With --workers, write chunks as they finish instead of in fetch order")
+    p.add_argument("--near-dup", type=float, default=None, metavar="JACCARD",
+                   help="Cluster near-duplicate before bodies (MinHash/LSH over the normalized code) at this similarity and add a cluster_id column")
+    p.add_argument("--num-perm", type=int, default=128, help="MinHash signature length for --near-dup")
+    p.add_argument("--one-per-cluster", action="store_true", help="With --near-dup, only write the first pair of each cluster")
+    p.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv", help="Output format (parquet/arrow need pyarrow)")
+    p.add_argument("--row-group-size", type=int, default=10000, help="Rows per Parquet row group / Arrow record batch")
     p.add_argument("--flush-every", type=int, default=200, help="Flush CSV every N rows")
     p.add_argument("--progress-steps", type=int, default=200000, help="SQLite progress callback step interval")
     p.add_argument("--verbose", action="store_true", help="Print progress info")
-    return p.parse_args()
+    args = p.parse_args()
+    if args.incremental and args.limit is not None:
+        p.error("--limit cannot be combined with --incremental")
+    if args.delta and not args.incremental:
+        p.error("--delta requires --incremental")
+    return args
 
 
-def connect(db_path: str, verbose: bool, progress_steps: int) -> sqlite3.Connection:
+def connect(db_path: str, verbose: bool, progress_steps: int, sidecar: Optional[str] = None) -> sqlite3.Connection:
     t0 = time.perf_counter()
     uri = f"file:{os.path.abspath(db_path)}?mode=ro"
-    con = sqlite3.connect(uri, uri=True)
+    if sidecar:
+        # the sidecar is the main schema; CVEfixes tables resolve unqualified through the attached DB
+        con = sqlite3.connect(f"file:{os.path.abspath(sidecar)}?mode=ro", uri=True)
+        con.execute("ATTACH DATABASE ? AS src", (uri,))
+    else:
+        con = sqlite3.connect(uri, uri=True)
     con.row_factory = sqlite3.Row
     con.execute("PRAGMA temp_store=FILE;")
     con.execute("PRAGMA cache_size=-100000;")
@@ -221,6 +283,7 @@ def build_where_and_params(
     include_path: Optional[List[str]],
     exclude_path: Optional[List[str]],
     no_commit_msg: bool,
+    rowid_range: Optional[Tuple[int, int]] = None,
 ):
     parts: List[str] = []
 
@@ -259,15 +322,17 @@ def build_where_and_params(
             like = f"%{s}%"
             params.extend([like, like])
 
+    if rowid_range is not None:
+        # incremental export: pairs whose before row was added since the last run
+        parts.append("b.rowid > ? AND b.rowid <= ?")
+        params.extend(rowid_range)
+
     where_clause = "WHERE " + " AND ".join(parts) if parts else ""
     commit_msg_col = "NULL AS commit_msg" if no_commit_msg else "cm.msg AS commit_msg"
     return where_clause, params, commit_msg_col
 
 
-def build_sql(where_clause: str, limit: Optional[int], commit_msg_col: str) -> str:
-    limit_clause = f" LIMIT {int(limit)}" if limit is not None else ""
-    return f"""
-    SELECT
+_SELECT_COLUMNS = """
       fx.cve_id                 AS cve_id,
       cc.cwe_id                 AS cwe_id,
       cw.cwe_name               AS cwe_name,
@@ -298,7 +363,10 @@ def build_sql(where_clause: str, limit: Optional[int], commit_msg_col: str) -> s
       a.end_line                AS after_end_line,
 
       b.code                    AS method_code_before,
-      a.code                    AS method_code_after
+      a.code                    AS method_code_after"""
+
+# pairs before/after versions of a method and joins the commit/CVE/CWE context
+_JOIN_FROM = """
     FROM method_change b
     JOIN method_change a
       ON a.file_change_id = b.file_change_id
@@ -315,14 +383,164 @@ def build_sql(where_clause: str, limit: Optional[int], commit_msg_col: str) -> s
     LEFT JOIN cwe_classification cc
       ON cc.cve_id = fx.cve_id
     LEFT JOIN cwe cw
-      ON cw.cwe_id = cc.cwe_id
+      ON cw.cwe_id = cc.cwe_id"""
+
+# same rows through the materialized pairing table: every join is a rowid lookup
+_PAIRS_FROM = """
+    FROM method_pairs p
+    JOIN method_change b      ON b.rowid = p.b
+    JOIN method_change a      ON a.rowid = p.a
+    JOIN file_change fc       ON fc.rowid = p.fc
+    JOIN fixes fx             ON fx.rowid = p.fx
+    JOIN commits cm           ON cm.rowid = p.cm
+    LEFT JOIN repository rp   ON rp.rowid = p.rp
+    LEFT JOIN cwe_classification cc ON cc.rowid = p.cc
+    LEFT JOIN cwe cw          ON cw.rowid = p.cw"""
+
+
+def build_sql(where_clause: str, limit: Optional[int], commit_msg_col: str, use_pairs: bool = False) -> str:
+    limit_clause = f" LIMIT {int(limit)}" if limit is not None else ""
+    return f"""
+    SELECT{_SELECT_COLUMNS.format(commit_msg_col=commit_msg_col)}{_PAIRS_FROM if use_pairs else _JOIN_FROM}
     {where_clause}
     {limit_clause}
     """.strip()
 
 
-def fieldnames() -> List[str]:
-    return [
+# ----------------------------------------
+# Sidecar DB with the materialized pairing table
+# ----------------------------------------
+
+SIDECAR_VERSION = "1"
+
+# the filters that do not depend on CLI options are applied once when materializing
+_PAIRS_SQL = f"""
+    SELECT b.rowid AS b, a.rowid AS a, fc.rowid AS fc, fx.rowid AS fx, cm.rowid AS cm,
+           rp.rowid AS rp, cc.rowid AS cc, cw.rowid AS cw{_JOIN_FROM}
+    WHERE TRIM(b.before_change)='True'
+      AND TRIM(a.before_change)='False'
+      AND b.code IS NOT NULL AND TRIM(b.code) <> ''
+      AND a.code IS NOT NULL AND TRIM(a.code) <> ''
+"""
+
+
+def default_sidecar(db_path: str) -> str:
+    return db_path + ".pairs.db"
+
+
+def source_stamp(db_path: str) -> str:
+    st = os.stat(db_path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def prepare_sidecar(db_path: str, sidecar: str, verbose: bool) -> int:
+    """
+    Materializes the before/after pairing join as rowids into `sidecar`, with the source DB
+    attached read-only. Built under a temporary name so an interrupted run leaves no sidecar.
+    """
+    t0 = time.perf_counter()
+    tmp = sidecar + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    con = sqlite3.connect(f"file:{os.path.abspath(tmp)}", uri=True)
+    con.execute("PRAGMA journal_mode=OFF;")
+    con.execute("PRAGMA synchronous=OFF;")
+    con.execute("PRAGMA temp_store=FILE;")
+    con.execute("PRAGMA cache_size=-100000;")
+    # one-off join: let SQLite build transient indexes on the (read-only) source tables
+    con.execute("PRAGMA automatic_index=ON;")
+    con.execute("ATTACH DATABASE ? AS src", (f"file:{os.path.abspath(db_path)}?mode=ro",))
+    con.execute("CREATE TABLE method_pairs AS " + _PAIRS_SQL)
+    con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    con.executemany("INSERT INTO meta VALUES (?, ?)", [
+        ("version", SIDECAR_VERSION),
+        ("source", os.path.abspath(db_path)),
+        ("source_stamp", source_stamp(db_path)),
+    ])
+    con.commit()
+    n = con.execute("SELECT COUNT(*) FROM method_pairs").fetchone()[0]
+    con.close()
+    os.replace(tmp, sidecar)
+    if verbose:
+        print(f"[prepare] {n} method pairs written to {sidecar} in {time.perf_counter() - t0:.1f}s")
+    return n
+
+
+def sidecar_is_fresh(db_path: str, sidecar: str) -> bool:
+    if not os.path.exists(sidecar):
+        return False
+    try:
+        con = sqlite3.connect(f"file:{os.path.abspath(sidecar)}?mode=ro", uri=True)
+        meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        con.close()
+    except sqlite3.Error:
+        return False
+    if meta.get("version") != SIDECAR_VERSION or meta.get("source_stamp") != source_stamp(db_path):
+        print(f"[sidecar] WARNING: {sidecar} is out of date with {db_path}; rerun with --prepare")
+        return False
+    return True
+
+
+# ----------------------------------------
+# Incremental export state
+# ----------------------------------------
+
+def state_path(out_path: str) -> str:
+    return out_path + ".state.json"
+
+
+def load_state(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def resume_point(state: Optional[dict], out_path: str, filters: dict, max_rowid: int) -> Optional[dict]:
+    """
+    Returns the previous run's state if new pairs can be appended to its output, None if the
+    export has to start over (no previous run, different filters, or rowids went backwards).
+    """
+    if state is None or not os.path.exists(out_path):
+        return None
+    if state.get("filters") != filters:
+        print("[incremental] WARNING: filters differ from the previous export; re-exporting from scratch")
+        return None
+    if max_rowid < state["method_change_rowid"]:
+        print(f"[incremental] WARNING: max method_change rowid {max_rowid} is below the recorded high-water mark "
+              f"{state['method_change_rowid']} (tables rewritten?); re-exporting from scratch")
+        return None
+    if os.path.getsize(out_path) < state["out_bytes"]:
+        print("[incremental] WARNING: output is shorter than recorded; re-exporting from scratch")
+        return None
+    return state
+
+
+def check_query_plan(con: sqlite3.Connection, sql: str, params: tuple) -> List[str]:
+    """
+    Warns about full table scans in the export query beyond the outermost loop, which
+    turn the join quadratic. Returns the offending plan lines.
+    """
+    plan = con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    scans = [r[3] for r in plan if r[3].startswith("SCAN") and "INDEX" not in r[3]]
+    for detail in scans[1:]:
+        print(f"[eqp] WARNING: export query does a full scan inside the join: {detail}"
+              " (run with --prepare to materialize the pairing table)")
+    return scans[1:]
+
+
+def fieldnames(cluster_id: bool = False) -> List[str]:
+    return ([
         "cve_id", "cwe_id", "cwe_name",
         "repo_url", "repo_name",
         "commit_hash", "author", "author_date", "commit_msg",
@@ -334,11 +552,68 @@ def fieldnames() -> List[str]:
         "before_start_line", "before_end_line",
         "after_start_line", "after_end_line",
         "method_code_before", "method_code_after",
-    ]
+    ] + (["cluster_id"] if cluster_id else []))
+
+
+class ArrowTableWriter:
+    """
+    Stand-in for csv.DictWriter that buffers rows column-wise and writes them as one Parquet row
+    group or Arrow record batch every rows_per_group rows. Every column is a nullable string, so
+    values match what the CSV export holds.
+    """
+
+    def __init__(self, path: str, fmt: str, fields: List[str], rows_per_group: int):
+        import pyarrow as pa
+        self.pa = pa
+        self.fields = fields
+        self.rows_per_group = max(1, rows_per_group)
+        self.schema = pa.schema([(c, pa.string()) for c in fields])
+        self.columns = {c: [] for c in fields}
+        self.buffered = 0
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self.sink = None
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            # uncompressed IPC file, so readers can memory-map the batches
+            self.sink = pa.OSFile(path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def writerow(self, row: dict) -> None:
+        for c in self.fields:
+            v = row[c]
+            self.columns[c].append(None if v is None else str(v))
+        self.buffered += 1
+        if self.buffered >= self.rows_per_group:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffered == 0:
+            return
+        batch = self.pa.RecordBatch.from_arrays(
+            [self.pa.array(self.columns[c], type=self.pa.string()) for c in self.fields], schema=self.schema)
+        if self.sink is None:
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.columns = {c: [] for c in self.fields}
+        self.buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def __enter__(self) -> "ArrowTableWriter":
+        return self
 
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
 
-def write_row(writer: csv.DictWriter, row: sqlite3.Row) -> None:
-    writer.writerow({
+
+def write_row(writer: csv.DictWriter, row: sqlite3.Row, cluster_id: Optional[int] = None) -> None:
+    out = {
         "cve_id": row["cve_id"],
         "cwe_id": row["cwe_id"],
         "cwe_name": row["cwe_name"],
@@ -367,12 +642,29 @@ def write_row(writer: csv.DictWriter, row: sqlite3.Row) -> None:
         "after_end_line": row["after_end_line"],
         "method_code_before": row["method_code_before"],
         "method_code_after": row["method_code_after"],
-    })
+    }
+    if cluster_id is not None:
+        out["cluster_id"] = cluster_id
+    writer.writerow(out)
 
 
 def main() -> None:
     args = parse_args()
-    con = connect(args.db, args.verbose, args.progress_steps)
+    if args.format != "csv" and (args.incremental or args.delta):
+        sys.exit("--incremental/--delta append to a CSV export; use --format csv")
+    if args.near_dup is not None and args.incremental:
+        sys.exit("--near-dup clusters within one export and cannot be combined with --incremental")
+    if args.near_dup is not None and args.unordered:
+        sys.exit("--near-dup assigns clusters in row order and cannot be combined with --unordered")
+    if args.one_per_cluster and args.near_dup is None:
+        sys.exit("--one-per-cluster requires --near-dup")
+    sidecar = args.sidecar or default_sidecar(args.db)
+    if args.prepare:
+        prepare_sidecar(args.db, sidecar, args.verbose)
+    use_pairs = sidecar_is_fresh(args.db, sidecar)
+    con = connect(args.db, args.verbose, args.progress_steps, sidecar if use_pairs else None)
+    if args.verbose:
+        print(f"[sidecar] {'using ' + sidecar if use_pairs else 'not used, joining method_change directly'}")
 
     # quick sanity probes
     if args.verbose:
@@ -380,6 +672,19 @@ def main() -> None:
             con.execute(f"SELECT 1 FROM {tbl} LIMIT 1").fetchone()
         print("[probe] basic table probes ok")
 
+    rowid_range = None
+    resume = None
+    if args.incremental:
+        filters = {
+            "language": args.language, "cwe": args.cwe, "include_unknown_cwe": args.include_unknown_cwe,
+            "include_path": args.include_path, "exclude_path": args.exclude_path, "no_commit_msg": args.no_commit_msg,
+        }
+        max_rowid = con.execute("SELECT COALESCE(MAX(rowid), 0) FROM method_change").fetchone()[0]
+        resume = resume_point(load_state(state_path(args.out)), args.out, filters, max_rowid)
+        rowid_range = (resume["method_change_rowid"] if resume else 0, max_rowid)
+        print(f"[incremental] method_change rowids ({rowid_range[0]}, {rowid_range[1]}]"
+              f" {'appended to ' + args.out if resume else 'full export'}")
+
     where_clause, params, commit_msg_col = build_where_and_params(
         languages=args.language,
         cwe_ids=args.cwe,
@@ -387,8 +692,10 @@ def main() -> None:
         include_path=args.include_path,
         exclude_path=args.exclude_path,
         no_commit_msg=args.no_commit_msg,
+        rowid_range=rowid_range,
     )
-    sql = build_sql(where_clause, args.limit, commit_msg_col)
+    sql = build_sql(where_clause, args.limit, commit_msg_col, use_pairs)
+    check_query_plan(con, sql, tuple(params))
 
     if args.verbose:
         try:
@@ -401,11 +708,31 @@ def main() -> None:
 
     os.makedirs(os.path.dirname(os.path.abspath(args.out)) or ".", exist_ok=True)
 
+    if resume is not None:
+        # drop anything a crashed run appended after the last recorded state
+        with open(args.out, "r+b") as f:
+            f.truncate(resume["out_bytes"])
+
     total_out = 0
     total_seen = 0
-    with open(args.out, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames(), quoting=csv.QUOTE_ALL)
-        writer.writeheader()
+    total_near_dup = 0
+    clusters = NearDupIndex(args.near_dup, args.num_perm) if args.near_dup is not None else None
+    if clusters is not None and args.verbose:
+        print(f"[near-dup] jaccard >= {args.near_dup}, {clusters.bands} bands x {clusters.rows} rows")
+    with ExitStack() as stack:
+        f = None
+        if args.format == "csv":
+            f = stack.enter_context(open(args.out, "a" if resume else "w", encoding="utf-8", newline=""))
+            writer = csv.DictWriter(f, fieldnames=fieldnames(clusters is not None), quoting=csv.QUOTE_ALL)
+            if resume is None:
+                writer.writeheader()
+        else:
+            writer = stack.enter_context(ArrowTableWriter(args.out, args.format, fieldnames(clusters is not None), args.row_group_size))
+        delta_writer = None
+        if args.delta:
+            df = stack.enter_context(open(args.delta, "w", encoding="utf-8", newline=""))
+            delta_writer = csv.DictWriter(df, fieldnames=fieldnames(clusters is not None), quoting=csv.QUOTE_ALL)
+            delta_writer.writeheader()
 
         if args.verbose:
             print("[exec] starting execute")
@@ -414,24 +741,42 @@ def main() -> None:
             print("[exec] cursor ready, starting fetch loop")
 
         with tqdm(unit="rows") as pbar:
-            while True:
-                rows = cur.fetchmany(args.chunk_size)
-                if not rows:
-                    break
-                for row in rows:
+            num_perm = args.num_perm if clusters is not None else 0
+            for rows, changed, signatures in iter_changed(cur, args.chunk_size, args.workers,
+                                                          ordered=not args.unordered, num_perm=num_perm):
+                for i, (row, is_changed) in enumerate(zip(rows, changed)):
                     total_seen += 1
-                    lang = row["programming_language"]
-                    nb = normalize_for_compare(row["method_code_before"], lang)
-                    na = normalize_for_compare(row["method_code_after"], lang)
-                    if nb == na:
+                    if not is_changed:
                         # comment or whitespace only change, skip
                         continue
-                    write_row(writer, row)
+                    cluster_id = None
+                    if clusters is not None:
+                        cluster_id, is_new = clusters.assign(signatures[i])
+                        if not is_new:
+                            total_near_dup += 1
+                            if args.one_per_cluster:
+                                continue
+                    write_row(writer, row, cluster_id)
+                    if delta_writer is not None:
+                        write_row(delta_writer, row, cluster_id)
                     total_out += 1
                     pbar.update(1)
-                    if args.flush_every and (total_out % args.flush_every == 0):
+                    if f is not None and args.flush_every and (total_out % args.flush_every == 0):
                         f.flush()
 
+    if args.incremental:
+        save_state(state_path(args.out), {
+            "method_change_rowid": rowid_range[1],
+            "out_bytes": os.path.getsize(args.out),
+            "rows": (resume["rows"] if resume else 0) + total_out,
+            "filters": filters,
+            "db": os.path.abspath(args.db),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+
+    if clusters is not None:
+        print(f"[near-dup] {len(clusters.representatives)} clusters, {total_near_dup} near-duplicate pairs"
+              f" {'dropped' if args.one_per_cluster else 'kept'}")
     if args.verbose:
         print(f"[done] wrote {total_out} rows to {args.out} (scanned {total_seen})")
 
@@ -1,8 +1,13 @@
 import argparse
 import os
+import sys
 import json
+from functools import lru_cache
 import google.generativeai as genai
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "secvul-llm-study"))
+from data.packed import PackedCorpus
+
 # --- Configuration ---
 API_KEY_FILE = "gemini.key"
 
@@ -16,6 +21,30 @@ with open(API_KEY_FILE, 'r') as f:
 
 genai.configure(api_key=api_key)
 
+# packed copy of data/preprocessed, built with (from secvul-llm-study):
+#   python -m data.packed --benchmark preprocessed --source ../data/preprocessed --out ../data/preprocessed.packed
+PACKED_CORPUS = os.path.join("data", "preprocessed.packed")
+
+
+@lru_cache(maxsize=None)
+def load_packed_corpus():
+    if not PackedCorpus.exists(PACKED_CORPUS):
+        return None, None
+    corpus = PackedCorpus(PACKED_CORPUS)
+    rows = corpus.read_meta()['row'].to_dict()
+    return corpus, rows
+
+
+def read_code(cwe_id, code_file):
+    corpus, rows = load_packed_corpus()
+    if corpus is not None and "{}/{}".format(cwe_id, code_file) in rows:
+        return corpus.get(rows["{}/{}".format(cwe_id, code_file)])
+    code_path = os.path.join("data", "preprocessed", cwe_id, code_file)
+    if not os.path.exists(code_path):
+        return None
+    with open(code_path, 'r') as f:
+        return f.read()
+
 
 
 
@@ -35,7 +64,8 @@ def run_experiment(code, prompt_path):
         return
 
     code_path = os.path.join("data", "preprocessed", cwe_id, code_file)
-    if not os.path.exists(code_path):
+    code_snippet = read_code(cwe_id, code_file)
+    if code_snippet is None:
         print(f"Error: Code file not found at {code_path}")
         return
 
@@ -57,9 +87,7 @@ def run_experiment(code, prompt_path):
     else:
         experiment_type = "unknown"
 
-    # 2. Read the code snippet
-    with open(code_path, 'r') as f:
-        code_snippet = f.read()
+    # 2. The code snippet was read above (from the packed corpus when available)
 
     # 3. Inject code into the user prompt
     prompt = user_prompt_template.format(code_snippet=code_snippet)
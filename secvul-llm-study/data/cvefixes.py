@@ -1,7 +1,11 @@
 import pandas as pd
 import os
 import models.config as config
-import re 
+from data.stream import columnar_file, read_metadata, stream_records
+from utils.comments import strip_comments
+
+# method code is only read for the selected rows
+_CODE_COLUMNS = ['code']
 
 class CVEFixes:
     def __init__(self, data_name, logger, **kwargs):
@@ -14,7 +18,8 @@ class CVEFixes:
         elif self.data_name == 'cvefixes-c-cpp-method': # both c and cpp samples
             self.csv_file = os.path.join(config.config['DATA_DIR_PATH'],"CVEFixes_v1.0.7", "cvefixed_c_cpp_method.csv")
     
-        
+        # a Parquet/Arrow copy of the CSV (python -m data.stream --csv <file>) is read instead when present
+        self.csv_file = columnar_file(self.csv_file)
         self.kwargs = kwargs
         self.logger = logger
         self.df = None
@@ -22,8 +27,7 @@ class CVEFixes:
     
     def _read_cvefixes(self):
         
-        f=open(self.csv_file, 'r', encoding='utf-8')
-        df = pd.read_csv(f, delimiter=',', quotechar='"', header=0, encoding='utf-8')
+        df = read_metadata(self.csv_file, _CODE_COLUMNS, delimiter=',', quotechar='"', header=0, encoding='utf-8')
         # select only vulnerable
         #print(df.columns)
         #df=df[df['vul'] == 1]
@@ -31,7 +35,7 @@ class CVEFixes:
             df=df.loc[self.kwargs['indices']]
             self.logger.log("Read {} rows from indices".format(len(df)))
             self.df = df
-            return df.iterrows()
+            return self.records()
         
         if 'vul' in self.kwargs and self.kwargs['vul'] is not None:
             from utils.utils import is_true
@@ -66,7 +70,14 @@ class CVEFixes:
         # print("After", len(self.df))
         ##########
 
-        return df.iterrows()
+        return self.records()
+
+    def records(self, df=None):
+        """
+        (index, record) pairs for the rows of `df` (defaults to the selected rows), with the code read in chunks
+        """
+        return stream_records(self.csv_file, self.df if df is None else df, _CODE_COLUMNS,
+                              delimiter=',', quotechar='"', header=0, encoding='utf-8')
     
     def get_items(self, n):
         try: 
@@ -82,16 +93,10 @@ class CVEFixes:
             return n[0], cwe_id, n[1]['vul'], self.remove_comments_cpp(str(n[1]['code']))
 
     def remove_comments_python(self, code):
-        code = re.sub(re.compile("#.*?\n" ) ,"" ,code)     
-        return code
+        return strip_comments(code, "hash")
     
     def remove_comments_cpp(self, code):        
-        code = re.sub(re.compile("/\*.*?\*/",re.DOTALL ) ,"" , code)
-        code = re.sub(re.compile("[^:]//.*?\n|^//.*?\n" ) ,"" , code)
-        return code
+        return strip_comments(code, "c")
 
     def remove_comments_java(self, code):
-        code = re.sub(re.compile("/\*.*?\*/",re.DOTALL ) ,"" ,code)
-        code = re.sub(re.compile("[^:]//.*?\n|^//.*?\n" ) ,"" ,code)
-        return code
-
+        return strip_comments(code, "c")
@@ -3,6 +3,7 @@ import pandas as pd
 import models.config as config
 from utils.utils import is_true
 from utils.mylogger import MyLogger
+from data.packed import PackedCodeWriter, PackedCode
 
 cwe_names = [
     (78, "OS Command Injection"),
@@ -54,19 +55,59 @@ class Juliet:
             self.csv_file = os.path.join(config.config['DATA_DIR_PATH'],"juliet", "juliet-java-1.3.csv")
         elif self.data_name == 'juliet-cpp-1.3':
             self.csv_file = os.path.join(config.config['DATA_DIR_PATH'],"juliet", "juliet-cpp-1.3.csv")
+        # built once from the csv and the source files: metadata + sloc + offsets into the code blob
+        self.index_file = Juliet.index_path(self.data_name)
+        self.code_file = Juliet.code_path(self.data_name)
         self.kwargs = kwargs
         self.df = None
         self.logger = logger
         self.iterator = self._read_csv()
 
+    @staticmethod
+    def index_path(data_name):
+        return os.path.join(config.config['DATA_DIR_PATH'],"juliet", data_name + ".index.csv")
+
+    @staticmethod
+    def code_path(data_name):
+        return os.path.join(config.config['DATA_DIR_PATH'],"juliet", data_name + ".code.bin")
+
+    def index_is_stale(self):
+        if not os.path.exists(self.index_file) or not os.path.exists(self.code_file):
+            return True
+        return os.path.getmtime(self.index_file) < os.path.getmtime(self.csv_file)
+
+    def build_index(self):
+        """
+        Reads every source file once, packing the code into one blob and storing its
+        sloc and byte offsets next to the csv metadata
+        """
+        df = pd.read_csv(self.csv_file, delimiter=',', quotechar='"', header=0)
+        offsets, lengths, slocs = [], [], []
+        with PackedCodeWriter(self.code_file) as writer:
+            for path in df['file']:
+                code = self.get_code(path)
+                offset, length = writer.add(code)
+                offsets.append(offset)
+                lengths.append(length)
+                slocs.append(self.get_sloc(code))
+        df['sloc'] = slocs
+        df['offset'] = offsets
+        df['length'] = lengths
+        tmp_file = self.index_file + ".tmp"
+        df.to_csv(tmp_file, index=False)
+        os.replace(tmp_file, self.index_file)
+        self.logger.log("Built Juliet index for {} files: {}".format(len(df), self.index_file))
+
     def _read_csv(self):
-        f=open(self.csv_file)
-        df = pd.read_csv(f, delimiter=',', quotechar='"', header=0)
+        if self.index_is_stale():
+            self.build_index()
+        self.code = PackedCode(self.code_file)
+        df = pd.read_csv(self.index_file, delimiter=',', quotechar='"', header=0)
         if self.kwargs.get('indices', None) is not None:
             df=df.loc[self.kwargs['indices']]
             self.logger.log("Read {} rows from indices".format(len(df)))
             self.df = df
-            return df.iterrows()
+            return self.records()
 
         if 'vul' in self.kwargs and self.kwargs['vul'] is not None:
             if is_true(self.kwargs['vul']):
@@ -95,14 +136,17 @@ class Juliet:
             else:
                 df = df.head(int(self.kwargs['n_examples']))
 
-        # read code snippets and filter by loc
-        df['code']=df['file'].map(lambda x: self.get_code(x))
-        df['sloc']=df['code'].map(lambda x: self.get_sloc(x))
+        # filter by loc (precomputed in the index)
         df['cwe_name']=df['cwe'].map(lambda x: self.get_cwe_name(x))
         if self.kwargs.get('loc', None) is not None:
             df = df[df['sloc'] >= int(self.kwargs['loc'])]
         self.df = df
-        return df.iterrows()
+        return self.records()
+
+    def records(self, df=None):
+        # lightweight (index, dict) records; get_items slices the code out of the packed blob
+        df = self.df if df is None else df
+        return zip(df.index, df.to_dict('records'))
 
     def get_sloc(self, code):
         lines=code.splitlines()
@@ -124,5 +168,19 @@ class Juliet:
         # item 2 is vul or not
         # item 3 is the code snippet
         # item 4 path to code file
-        return n[0], n[1]['cwe'].replace("CWE", ""), n[1]['vul'], self.get_code(n[1]['file']), n[1]['file']
+        return n[0], n[1]['cwe'].replace("CWE", ""), n[1]['vul'], self.code.get(n[1]['offset'], n[1]['length']), n[1]['file']
+
 
+if __name__ == '__main__':
+    # builds (or rebuilds) the packed index ahead of time: python -m data.juliet --data_name juliet-cpp-1.3
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_name", type=str, required=True, choices=["juliet-java-1.3", "juliet-cpp-1.3"])
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the index is up to date")
+    args = parser.parse_args()
+    if args.rebuild:
+        for f in [Juliet.index_path(args.data_name), Juliet.code_path(args.data_name)]:
+            if os.path.exists(f):
+                os.remove(f)
+    juliet = Juliet(args.data_name, MyLogger(os.path.join("logs", "juliet_index.txt")))
+    print("Indexed {} files, {} selected".format(len(pd.read_csv(juliet.index_file)), len(juliet.df)))
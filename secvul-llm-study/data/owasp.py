@@ -12,8 +12,8 @@ class OWASP:
         
 
     def fetch_examples(self):
-        # read all code snippets
-        examples={ k.split(".")[0]:open(os.path.join(self.data_dir, k)).read() for k in os.listdir(self.data_dir)}
+        # map test names to their files; code is only read for the selected tests
+        self.files={ k.split(".")[0]:k for k in os.listdir(self.data_dir)}
 
         # read all expected results
         df=pd.read_csv(self.expected_results, index_col='# test name')
@@ -22,10 +22,8 @@ class OWASP:
         if self.kwargs.get('indices', None) is not None:
             df=df.loc[self.kwargs['indices']]
             self.logger.log("Read {} rows from indices".format(len(df)))
-            s=pd.Series(examples, name='code')
-            df['code']=df.index.map(s)
             self.df = df
-            return df.iterrows()
+            return self.records()
         
         if 'vul' in self.kwargs and self.kwargs['vul'] is not None:
             if self.kwargs['vul']  in ['True', 'true', '1', 't', 'T', 'y', 'Y']:
@@ -52,11 +50,20 @@ class OWASP:
             else:
                 df = df.head(int(self.kwargs['n_examples']))
         
-        # join
-        s=pd.Series(examples, name='code')
-        df['code']=df.index.map(s)
         self.df = df
-        return df.iterrows()
+        return self.records()
+
+    def records(self, df=None):
+        # (index, dict) records with the code of each test read as it is reached
+        df = self.df if df is None else df
+        for k, record in zip(df.index, df.to_dict('records')):
+            record['code'] = self.get_code(k)
+            yield k, record
+
+    def get_code(self, name):
+        if name not in self.files:
+            return None
+        return open(os.path.join(self.data_dir, self.files[name])).read()
 
     def get_items(self, n):
         return n[0], n[1]['cwe'], n[1]['real vulnerability'], n[1]['code']
@@ -0,0 +1,248 @@
+import mmap
+import os
+import numpy as np
+import pandas as pd
+import models.config as config
+
+
+class PackedCodeWriter:
+    """
+    Appends snippets to a single UTF-8 blob; add() returns the (offset, length) in bytes
+    to store in the index. The blob only appears under `path` once closed
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.f = open(self.tmp_path, "wb")
+        self.offset = 0
+
+    def add(self, code):
+        data = code.encode("utf-8")
+        self.f.write(data)
+        offset = self.offset
+        self.offset += len(data)
+        return offset, len(data)
+
+    def close(self):
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.tmp_path)
+
+
+class PackedCode:
+    """
+    Read-only view of a blob written by PackedCodeWriter, memory-mapped so snippets are
+    served by slicing without reading the whole file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        # empty files cannot be mapped
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) > 0 else b""
+        self.view = memoryview(self.mm)
+
+    def get_bytes(self, offset, length):
+        # zero-copy slice of the mapped blob
+        return self.view[int(offset):int(offset) + int(length)]
+
+    def get(self, offset, length):
+        return str(self.get_bytes(offset, length), "utf-8")
+
+
+def packed_path(benchmark):
+    return os.path.join(config.config['DATA_DIR_PATH'], "packed", benchmark)
+
+
+class PackedCorpus:
+    """
+    Benchmark snippets packed into one directory:
+      code.bin     all snippets as one UTF-8 blob (memory-mapped)
+      offsets.npy  int64 offset table, snippet i is code.bin[offsets[i]:offsets[i+1]]
+      meta.csv     one row per snippet: id, row (position in the offset table), cwe, vul, file,
+                   cwe_sort (the benchmark's own cwe value, for sorting) and any other metadata
+    """
+    def __init__(self, path):
+        self.path = path
+        self.meta_file = os.path.join(path, "meta.csv")
+        self.code = PackedCode(os.path.join(path, "code.bin"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_bytes(self, row):
+        return self.code.get_bytes(self.offsets[row], self.offsets[row + 1] - self.offsets[row])
+
+    def get(self, row):
+        return str(self.get_bytes(row), "utf-8")
+
+    def read_meta(self):
+        return pd.read_csv(self.meta_file, index_col='id', dtype={'cwe': str})
+
+    @staticmethod
+    def exists(path):
+        return all(os.path.exists(os.path.join(path, f)) for f in ["code.bin", "offsets.npy", "meta.csv"])
+
+    @staticmethod
+    def write(path, records):
+        """
+        Packs (id, code, metadata dict) records into `path`
+        """
+        os.makedirs(path, exist_ok=True)
+        offsets = [0]
+        meta = []
+        with PackedCodeWriter(os.path.join(path, "code.bin")) as writer:
+            for id, code, metadata in records:
+                offset, length = writer.add("" if code is None else code)
+                offsets.append(offset + length)
+                meta.append(dict(metadata, id=id, row=len(meta)))
+        np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        df = pd.DataFrame(meta)
+        df = df[['id', 'row'] + [c for c in df.columns if c not in ('id', 'row')]]
+        # meta.csv is written last: its presence marks a complete corpus
+        tmp_file = os.path.join(path, "meta.csv.tmp")
+        df.to_csv(tmp_file, index=False)
+        os.replace(tmp_file, os.path.join(path, "meta.csv"))
+        return len(meta)
+
+
+class PackedDataset:
+    """
+    Loader for a packed benchmark with the same filters (indices, vul, top_cwe, sort,
+    n_examples, loc) as the per-benchmark loaders
+    """
+    def __init__(self, data_name, logger, **kwargs):
+        self.data_name = data_name
+        self.corpus = PackedCorpus(packed_path(data_name))
+        self.csv_file = self.corpus.meta_file
+        self.kwargs = kwargs
+        self.df = None
+        self.logger = logger
+        self.iterator = self._read_meta()
+
+    def _read_meta(self):
+        df = self.corpus.read_meta()
+        if self.kwargs.get('indices', None) is not None:
+            df=df.loc[self.kwargs['indices']]
+            self.logger.log("Read {} rows from indices".format(len(df)))
+            self.df = df
+            return self.records()
+
+        if self.kwargs.get('vul', None) is not None:
+            from utils.utils import is_true
+            if is_true(self.kwargs['vul']):
+                df=df[df['vul'] == True]
+            else:
+                df=df[df['vul'] == False]
+        if self.kwargs.get('top_cwe', None) is not None:
+            top_cwes = [k.strip() for k in open("utils/cwe_top_25.txt").read().strip().splitlines()[:int(self.kwargs['top_cwe'])]]
+            df = df[df['cwe'].isin(top_cwes)]
+
+        # sorting after cwe selection, but before n_examples to allow both positive and negative examples
+        if self.kwargs.get('sort', None) == 'random':
+            df=df.sample(frac=1, random_state=1)
+        elif self.kwargs.get('sort', None) == 'cwe':
+            df=df.sort_values(by='cwe_sort', ascending=True)
+        elif self.kwargs.get('sort', None) == 'random-cwe':
+            df=df.sample(frac=1, random_state=1)
+            df=df.sort_values(by='cwe_sort', ascending=True)
+
+        if self.kwargs.get('n_examples', None) is not None:
+            if self.kwargs.get('top_cwe', None) is not None:
+                df = df.groupby('cwe').head(int(self.kwargs['n_examples']))
+            else:
+                df = df.head(int(self.kwargs['n_examples']))
+
+        if self.kwargs.get('loc', None) is not None and 'sloc' in df.columns:
+            df = df[df['sloc'] >= int(self.kwargs['loc'])]
+        self.df = df
+        return self.records()
+
+    def records(self, df=None):
+        df = self.df if df is None else df
+        return zip(df.index, df.to_dict('records'))
+
+    def get_items(self, n):
+        file = n[1]['file'] if isinstance(n[1].get('file', None), str) else None
+        return n[0], n[1]['cwe'], n[1]['vul'], self.corpus.get(n[1]['row']), file
+
+
+class _NullLogger:
+    def log(self, text):
+        print(text)
+
+
+def _from_loader(data, cwe_column):
+    # the loaders already apply their per-benchmark preprocessing (e.g. comment removal) in get_items
+    for n in data.iterator:
+        item = data.get_items(n)
+        metadata = {k: v for k, v in n[1].items() if k not in ('code', 'offset', 'length', 'row', 'id')}
+        metadata.update({'cwe': item[1], 'vul': item[2], 'file': item[4] if len(item) > 4 else None,
+                         'cwe_sort': n[1][cwe_column]})
+        yield item[0], item[3], metadata
+
+
+def convert_owasp():
+    from data.owasp import OWASP
+    return _from_loader(OWASP(_NullLogger()), 'cwe')
+
+
+def convert_juliet(data_name):
+    from data.juliet import Juliet
+    return _from_loader(Juliet(data_name, _NullLogger()), 'cwe')
+
+
+def convert_cvefixes(data_name):
+    from data.cvefixes import CVEFixes
+    return _from_loader(CVEFixes(data_name, _NullLogger()), 'cwe_id')
+
+
+def convert_preprocessed(root):
+    # <root>/<CWE-id>/<name>.cpp as used by scripts/run_experiment.py; ids are <CWE-id>/<name>.cpp
+    for cwe_dir in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, cwe_dir)):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, cwe_dir))):
+            code = open(os.path.join(root, cwe_dir, name)).read()
+            cwe = cwe_dir.split("-")[-1]
+            yield cwe_dir + "/" + name, code, {'cwe': cwe, 'vul': "_bad" in name, 'file': os.path.join(cwe_dir, name),
+                                               'cwe_sort': cwe_dir}
+
+
+def convert(benchmark, source=None):
+    if benchmark.startswith("owasp"):
+        return convert_owasp()
+    elif benchmark.startswith("juliet"):
+        return convert_juliet(benchmark)
+    elif benchmark.startswith("cvefixes"):
+        return convert_cvefixes(benchmark)
+    elif benchmark.startswith("preprocessed"):
+        return convert_preprocessed(source or os.path.join("..", "data", "preprocessed"))
+    raise ValueError("No converter for " + benchmark)
+
+
+if __name__ == '__main__':
+    # packs a benchmark into <DATA_DIR_PATH>/packed/<benchmark>, which main.py then loads instead of the raw files
+    # usage: python -m data.packed --benchmark cvefixes-c-cpp-method
+    #        python -m data.packed --benchmark preprocessed --source ../data/preprocessed --out ../data/preprocessed.packed
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", type=str, required=True)
+    parser.add_argument("--source", type=str, default=None, help="Source directory (preprocessed snippets only)")
+    parser.add_argument("--out", type=str, default=None, help="Output directory. Defaults to <DATA_DIR_PATH>/packed/<benchmark>")
+    args = parser.parse_args()
+
+    st = time.time()
+    out = args.out or packed_path(args.benchmark)
+    n = PackedCorpus.write(out, convert(args.benchmark, args.source))
+    print("Packed {} snippets into {} in {:.1f}s".format(n, out, time.time() - st))
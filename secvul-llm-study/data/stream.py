@@ -0,0 +1,147 @@
+import os
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+# rows per chunk when streaming code columns from a CSV
+CHUNKSIZE = 10000
+
+# columnar copies of a dataset CSV (see columnar_file); pyarrow is only imported when one is read
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow', '.feather')
+
+
+def is_columnar(path):
+    return path.endswith(COLUMNAR_EXTENSIONS)
+
+
+def columnar_file(csv_file):
+    """
+    Parquet/Arrow copy of `csv_file` (same name, other extension) if one exists and is not older
+    than the CSV, else `csv_file`
+    """
+    stem = os.path.splitext(csv_file)[0]
+    csv_mtime = os.path.getmtime(csv_file) if os.path.exists(csv_file) else 0
+    for ext in COLUMNAR_EXTENSIONS:
+        if os.path.exists(stem + ext) and os.path.getmtime(stem + ext) >= csv_mtime:
+            return stem + ext
+    return csv_file
+
+
+def _columnar_columns(path):
+    import pyarrow as pa
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return pa.ipc.open_file(pa.memory_map(path)).schema.names
+
+
+def read_metadata(csv_file, code_columns, **read_kwargs):
+    """
+    Reads every column of `csv_file` except the (large) code columns. For Parquet/Arrow files
+    only the metadata columns are read from disk and the CSV `read_kwargs` are ignored
+    """
+    if is_columnar(csv_file):
+        columns = [c for c in _columnar_columns(csv_file) if c not in code_columns]
+        if csv_file.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            return pq.read_table(csv_file, columns=columns).to_pandas()
+        import pyarrow.feather as feather
+        return feather.read_table(csv_file, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(csv_file, usecols=lambda c: c not in code_columns, **read_kwargs)
+
+
+def _columnar_chunks(path, code_columns, wanted):
+    """
+    Code columns of each Parquet row group / Arrow record batch that holds a row of `wanted`
+    (sorted row positions), as DataFrames indexed by row position. Other groups are not read
+    """
+    import pyarrow as pa
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        f = pq.ParquetFile(path)
+        groups = [(f.metadata.row_group(i).num_rows, lambda i=i: f.read_row_group(i, columns=code_columns))
+                  for i in range(f.num_row_groups)]
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        # batches of a memory-mapped IPC file are not copied until converted
+        batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+        groups = [(b.num_rows, lambda b=b: pa.Table.from_batches([b]).select(code_columns)) for b in batches]
+    start = 0
+    for n, read in groups:
+        if n > 0 and np.searchsorted(wanted, start) < np.searchsorted(wanted, start + n):
+            chunk = read().to_pandas()
+            chunk.index = pd.RangeIndex(start, start + n)
+            yield chunk
+        start += n
+
+
+def stream_records(csv_file, df, code_columns, chunksize=CHUNKSIZE, **read_kwargs):
+    """
+    Yields (index, record) for the rows of `df` (as returned by read_metadata, possibly filtered
+    and reordered) where record is a dict of the metadata columns plus the code columns, which are
+    read from `csv_file` in chunks (row groups for Parquet/Arrow files). Only code of selected rows
+    is kept: if `df` is in file order records are yielded as their chunk is read (and reading stops
+    after the last selected row), otherwise the selected code is collected first and yielded in the
+    order of `df`
+    """
+    if len(df) == 0:
+        return
+    metadata = dict(zip(df.index, df.to_dict('records')))
+    in_file_order = df.index.is_monotonic_increasing
+    last = df.index.max()
+    code = dict()
+    if is_columnar(csv_file):
+        reader = _columnar_chunks(csv_file, code_columns, np.unique(df.index.values))
+    else:
+        reader = pd.read_csv(csv_file, usecols=lambda c: c in code_columns, chunksize=chunksize, **read_kwargs)
+    with closing(reader):
+        for chunk in reader:
+            past_last = chunk.index[-1] >= last
+            chunk = chunk[chunk.index.isin(df.index)]
+            for idx, values in zip(chunk.index, chunk.to_dict('records')):
+                if in_file_order:
+                    record = dict(metadata[idx])
+                    record.update(values)
+                    yield idx, record
+                else:
+                    code[idx] = values
+            if past_last:
+                break
+    if not in_file_order:
+        for idx in df.index:
+            record = dict(metadata[idx])
+            record.update(code.get(idx, {}))
+            yield idx, record
+
+
+def to_columnar(csv_file, out=None, **read_kwargs):
+    """
+    Writes `csv_file` as Parquet (or an uncompressed, memory-mappable Arrow IPC file if `out` ends
+    with .arrow/.feather) with one row group per CHUNKSIZE rows, next to the CSV by default.
+    Loaders then pick it up through columnar_file
+    """
+    import pyarrow as pa
+    out = out or os.path.splitext(csv_file)[0] + '.parquet'
+    table = pa.Table.from_pandas(pd.read_csv(csv_file, **read_kwargs), preserve_index=False)
+    tmp_file = out + '.tmp'
+    if out.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(table, tmp_file, row_group_size=CHUNKSIZE)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, tmp_file, compression='uncompressed', chunksize=CHUNKSIZE)
+    os.replace(tmp_file, out)
+    return out
+
+
+if __name__ == '__main__':
+    # usage: python -m data.stream --csv ../data/CVEFixes_v1.0.7/cvefixed_c_cpp_method.csv [--out <file>.arrow]
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", type=str, required=True)
+    parser.add_argument("--out", type=str, default=None, help="Output file (.parquet, .arrow or .feather). Defaults to <csv>.parquet")
+    args = parser.parse_args()
+
+    st = time.time()
+    print("Wrote {} in {:.1f}s".format(to_columnar(args.csv, args.out), time.time() - st))
@@ -0,0 +1,101 @@
+import json
+import os
+import re
+import pandas as pd
+
+# snippets are tokenized in chunks through the tokenizer's batch path
+_TOKENIZE_CHUNK = 512
+
+
+def dataset_file(data):
+    # file the dataset was loaded from; the index is stored next to it
+    return getattr(data, 'csv_file', None) or getattr(data, 'expected_results', None)
+
+
+class TokenLengthIndex:
+    """
+    Token count of every snippet of a dataset for one tokenizer, cached on disk next to the
+    dataset file as <dataset file>.<tokenizer id>.tokens.json. Only ids missing from the cache
+    are tokenized; the cache is dropped when the dataset file changes
+    """
+    def __init__(self, path, tokenizer_id, source_file):
+        self.path = path
+        self.tokenizer_id = tokenizer_id
+        self.source_file = source_file
+        self.source_stamp = self._stamp(source_file)
+        self.lengths = dict()
+        if os.path.exists(path):
+            try:
+                cached = json.load(open(path))
+                if cached.get("tokenizer") == tokenizer_id and cached.get("source") == self.source_stamp:
+                    self.lengths = cached["lengths"]
+            except (json.JSONDecodeError, KeyError):
+                self.lengths = dict()
+
+    @staticmethod
+    def _stamp(source_file):
+        st = os.stat(source_file)
+        return "{}-{}".format(st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def for_dataset(data, tokenizer_id):
+        source_file = dataset_file(data)
+        path = "{}.{}.tokens.json".format(source_file, re.sub(r"[^A-Za-z0-9_.-]", "_", tokenizer_id))
+        return TokenLengthIndex(path, tokenizer_id, source_file)
+
+    def update(self, data, tokenizer):
+        """
+        Tokenizes the snippets of `data.df` rows that are not in the index yet
+        """
+        todo = data.df[[str(k) not in self.lengths for k in data.df.index]]
+        # only the code of rows missing from the index is read
+        missing = [(str(item[0]), item[3]) for item in (data.get_items(n) for n in data.records(todo))]
+        if len(missing) == 0:
+            return 0
+        for b in range(0, len(missing), _TOKENIZE_CHUNK):
+            chunk = missing[b:b + _TOKENIZE_CHUNK]
+            encoded = tokenizer([s for _, s in chunk], add_special_tokens=False)['input_ids']
+            for (k, _), ids in zip(chunk, encoded):
+                self.lengths[k] = len(ids)
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"tokenizer": self.tokenizer_id, "source": self.source_stamp, "lengths": self.lengths}, f)
+        os.replace(tmp_file, self.path)
+        return len(missing)
+
+    def get(self, id):
+        return self.lengths.get(str(id), None)
+
+    def lengths_for(self, df):
+        return pd.Series([self.lengths[str(k)] for k in df.index], index=df.index, dtype='int64')
+
+    def select(self, data, max_input_tokens=None, length_sort=None, token_budget=None):
+        """
+        Restricts `data` to snippets of at most `max_input_tokens` tokens, optionally sorted by
+        length and capped at `token_budget` input tokens in total, and resets its iterator.
+        Returns the token lengths of the selected rows
+        """
+        df = data.df
+        lengths = self.lengths_for(df)
+        keep = lengths <= max_input_tokens if max_input_tokens is not None else lengths >= 0
+        df, lengths = df[keep.values], lengths[keep.values]
+        if length_sort is not None:
+            order = lengths.reset_index(drop=True).sort_values(ascending=length_sort == 'asc', kind='stable').index
+            df, lengths = df.iloc[order], lengths.iloc[order]
+        if token_budget is not None:
+            within = (lengths.cumsum() <= token_budget).values
+            df, lengths = df[within], lengths[within]
+        data.df = df
+        data.iterator = data.records()
+        return lengths
+
+    @staticmethod
+    def describe(lengths, max_input_tokens=None):
+        if len(lengths) == 0:
+            return "no snippets"
+        q = lengths.quantile([0.5, 0.9, 0.99])
+        summary = "n={} total={} min={} p50={:.0f} p90={:.0f} p99={:.0f} max={}".format(
+            len(lengths), int(lengths.sum()), int(lengths.min()), q[0.5], q[0.9], q[0.99], int(lengths.max()))
+        if max_input_tokens is not None:
+            summary += " over {}={}".format(max_input_tokens, int((lengths > max_input_tokens).sum()))
+        return summary
@@ -1,11 +1,15 @@
 import os
+import json
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 os.environ["HF_HOME"]="~/common-data/XXXX-2/hf_cache"
 from utils.mylogger import MyLogger
 from utils.utils import (
+    open_results,
     store_results,
     parse_llm_results,
-    compute_results,
+    compute_results_df,
     compute_precision_recall_accuracy,
     compute_prec_recall_multiclass,
 )
@@ -15,15 +19,114 @@ from tqdm.contrib.concurrent import thread_map
 from tqdm import tqdm
 
 OUTPUT_DIR = 'shared/v2/study_results_v2/'
+BATCH_WINDOW = 16
 
-def is_too_large(model, prompt, max_input_tokens):    
+def prompt_length(model, prompt):
     l=len(model.tokenizer.tokenize(prompt))
     print(f"Prompt length:{l}")
-    return l > max_input_tokens
+    return l
+
+def build_model_input(item, model_name, kwargs, cwenames):
+    snippet = item[3]
+    prompt_cwe = item[1]
+    if not model_name.lower().startswith("gpt"):
+        query = PROMPTS[kwargs["prompt_type"]].format(snippet, "{} (CWE-{})".format(cwenames.loc[int(prompt_cwe)]['name'], prompt_cwe))
+        system_prompt = PROMPTS_SYSTEM[kwargs["system_prompt_type"]]
+        return [{"role": "system", "content": system_prompt}, {"role": "user", "content": query}]
+    return {
+        "id": str(item[0]),
+        "snippet": snippet,
+        "prompt_cwe": prompt_cwe
+    }
+
+def prediction_exists(output_folder, id, overwrite):
+    """
+    True if a non-empty prediction for this id is already stored (and not marked null),
+    i.e. the item can be skipped when resuming a run
+    """
+    if overwrite:
+        return False
+    result_file = os.path.join(output_folder, id, "result.json")
+    if os.path.exists(result_file):
+        isnull = json.load(open(result_file))['llm_label_raw'] is None
+        print("null", isnull)
+        if isnull:
+            return False
+    return open_results(output_folder).has_prediction(id)
+
+def timed_predict(model, model_input):
+    st = time.time()
+    pred = model.predict(model_input)
+    return pred, time.time() - st
+
+def store_prediction(output_folder, item, snippet, pred, time_taken, logger):
+    logger.log(os.path.join(output_folder, str(item[0])))
+    logger.log("ID: " + str(item[0]))
+    logger.log("CWE: " + str(item[1]))
+    logger.log("Label: " + str(item[2]))
+    logger.log(f"Prediction: {pred}")
+    logger.log(f"Time taken: {time_taken}")
+    logger.log("\n ---------------------------- \n")
+
+    store_results(
+        output_folder,
+        str(item[0]),
+        {
+            "query": snippet,
+            "pred": pred,
+            "cwe": str(item[1]),
+            "label": str(item[2]),
+            "time": time_taken,
+        },
+    )
 
-def run_exp(model_name, benchmark, **kwargs):
-    import time
+def drain_predictions(in_flight, output_folder, logger, return_when):
+    """
+    Waits on the in-flight predictions (until the first one or all of them finish)
+    and stores every completed result
+    """
+    done, _ = wait(list(in_flight.keys()), return_when=return_when)
+    for future in done:
+        item, snippet = in_flight.pop(future)
+        pred, time_taken = future.result()
+        store_prediction(output_folder, item, snippet, pred, time_taken, logger)
+
+def predict_batches(model, pending, batch_size, output_folder, logger):
+    """
+    Runs the pending (length, item, snippet, model_input) tuples through the model's batched
+    generation path. Sorting by length keeps similarly sized prompts in the same batch to minimize padding
+    """
+    pending = sorted(pending, key=lambda p: p[0])
+    for b in tqdm(range(0, len(pending), batch_size)):
+        batch = pending[b:b + batch_size]
+        st = time.time()
+        preds = model.predict([p[3] for p in batch], batch_size=len(batch), no_progress_bar=True)
+        time_taken = (time.time() - st) / len(batch)
+        for (_, item, snippet, _), pred in zip(batch, preds):
+            store_prediction(output_folder, item, snippet, pred, time_taken, logger)
+
+def build_token_index(model_name, data, kwargs, logger):
+    """
+    Tokenizes the dataset once per tokenizer (cached next to the dataset file) and restricts it to
+    snippets within max_input_tokens, before any model weights are loaded. None for hosted models.
+    Only the snippets are counted, so the models still check the length of the rendered prompt
+    """
+    from models.llm import LLM
+    from data.token_index import TokenLengthIndex, dataset_file
+    model_id = LLM.get_model_id(model_name)
+    if model_id is None or dataset_file(data) is None:
+        return None
+    from transformers import AutoTokenizer
+    index = TokenLengthIndex.for_dataset(data, model_id)
+    n_tokenized = index.update(data, AutoTokenizer.from_pretrained(model_id))
+    logger.log(">>Token length index: {} ({} snippets tokenized)".format(index.path, n_tokenized))
+    max_input_tokens = kwargs.get("max_input_tokens", None)
+    logger.log(">>Token lengths: " + TokenLengthIndex.describe(index.lengths_for(data.df), max_input_tokens))
+    lengths = index.select(data, max_input_tokens, kwargs.get("length_sort", None), kwargs.get("token_budget", None))
+    logger.log(">>Data Items within token limits: {} ({})".format(len(data.df), TokenLengthIndex.describe(lengths)))
+    return index
 
+def run_exp(model_name, benchmark, **kwargs):
     timestamp = int(time.time())
     exp_st_time = time.time()
     overwrite = kwargs.get("overwrite", False)
@@ -50,6 +153,7 @@ def run_exp(model_name, benchmark, **kwargs):
     
     os.makedirs(output_folder, exist_ok=True)
     logger = MyLogger(os.path.join(output_folder, "log.txt"))
+    open_results(output_folder, kwargs.get("results_backend", None))
 
     logger.log("Output folder: {}".format(output_folder))
     logger.log("Model name: {}".format(model_name))
@@ -72,6 +176,23 @@ def run_exp(model_name, benchmark, **kwargs):
     model = None
 
     logger.log(">>Data Items Selected: {}".format(len(data.df)))
+    token_index = build_token_index(model_name, data, kwargs, logger)
+    cwenames = pd.read_csv("utils/cwenames_top25.txt", index_col="id")
+    concurrency = kwargs.get("concurrency", None) or 1
+    # local models share one pipeline and their generation params, so they predict one item at a time
+    if LLM.is_local(model_name) and concurrency > 1:
+        logger.log(">>Ignoring --concurrency {} for local model {}, use --batch_size".format(concurrency, model_name))
+        concurrency = 1
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    in_flight = dict()
+    if executor is not None:
+        logger.log(">>Running with {} predictions in flight".format(concurrency))
+    # batched generation only applies to models running locally
+    batch_size = kwargs.get("batch_size", None) or 0
+    if not LLM.is_local(model_name):
+        batch_size = 0
+    pending = []
+
     processed_samples=0
     for i in tqdm(data.iterator):
         item = data.get_items(i)
@@ -81,77 +202,63 @@ def run_exp(model_name, benchmark, **kwargs):
         snippet = item[3] 
         prompt_cwe = item[1]
         code_path = item[4]
-        cwenames = pd.read_csv("utils/cwenames_top25.txt", index_col="id")
 
         print("Prompt CWE:", prompt_cwe)
-       
-        if not model_name.lower().startswith("gpt"):
-            query = PROMPTS[kwargs["prompt_type"]].format(snippet, "{} (CWE-{})".format(cwenames.loc[int(prompt_cwe)]['name'], prompt_cwe))
-            system_prompt = PROMPTS_SYSTEM[kwargs["system_prompt_type"]]
-            model_input = [{"role": "system", "content": system_prompt}, {"role": "user", "content": query}]
-        else:
-            model_input = {
-                "id": str(item[0]),
-                "snippet": snippet,
-                "prompt_cwe": prompt_cwe
-            }
+        model_input = build_model_input(item, model_name, kwargs, cwenames)
 
-        st = time.time()
-        result_file=os.path.join(output_folder, str(item[0]), "result.json")
-        isnull = False
-        if os.path.exists(result_file):
-            import json
-            isnull = json.load(open(result_file))['llm_label_raw'] is None
-            print("null", isnull)
-        #continue
-        if (os.path.exists(os.path.join(output_folder, str(item[0]), "pred.txt"))
-            and os.path.getsize(os.path.join(output_folder, str(item[0]), "pred.txt")) > 0 and (not overwrite) and (not isnull)):
+        if prediction_exists(output_folder, str(item[0]), overwrite):
             logger.log("Skipping ID because its prediction already exists: " + str(item[0]))
             processed_samples+=1
             continue
         else:
             if model is None:
                 model = LLM.get_llm(model_name, kwargs, logger)
-            if "gpt" not in model_name.lower():
-                if is_too_large(model, snippet, kwargs.get("max_input_tokens", 16000)):
+            length = 0
+            if token_index is not None:
+                length = token_index.get(item[0])
+            elif LLM.is_local(model_name):
+                length = prompt_length(model, snippet)
+                if length > kwargs.get("max_input_tokens", 16000):
                     logger.log("Too large, skipping")
                     continue
-            pred = model.predict(model_input)
-            time_taken = time.time() - st
-            logger.log(os.path.join(output_folder, str(item[0])))
-            logger.log("ID: " + str(item[0]))
-            logger.log("CWE: " + str(item[1]))
-            logger.log("Label: " + str(item[2]))
-            logger.log(f"Prediction: {pred}")
-            logger.log(f"Time taken: {time_taken}")
-            logger.log("\n ---------------------------- \n")
-
-            store_results(
-                output_folder,
-                str(item[0]),
-                {
-                    "query": snippet,
-                    "pred": pred,
-                    "cwe": str(item[1]),
-                    "label": str(item[2]),
-                    "time": time_taken,
-                },
-            )
+            if batch_size > 0:
+                pending.append((length, item, snippet, model_input))
+                # bucket over a window of several batches so results keep getting stored as the run progresses
+                if len(pending) >= batch_size * BATCH_WINDOW:
+                    predict_batches(model, pending, batch_size, output_folder, logger)
+                    pending = []
+            elif executor is None:
+                pred, time_taken = timed_predict(model, model_input)
+                store_prediction(output_folder, item, snippet, pred, time_taken, logger)
+            else:
+                # keep at most `concurrency` requests outstanding, storing results as they finish
+                if len(in_flight) >= concurrency:
+                    drain_predictions(in_flight, output_folder, logger, return_when=FIRST_COMPLETED)
+                in_flight[executor.submit(timed_predict, model, model_input)] = (item, snippet)
         
         if kwargs.get('max_samples', None) is not None and processed_samples >= kwargs['max_samples']:
             logger.log(">>Max samples reached!! :: " + str(kwargs['max_samples']))
             break
         processed_samples+=1
+
+    if executor is not None:
+        drain_predictions(in_flight, output_folder, logger, return_when=ALL_COMPLETED)
+        executor.shutdown()
+    if len(pending) > 0:
+        logger.log(">>Running {} predictions in batches of {}".format(len(pending), batch_size))
+        predict_batches(model, pending, batch_size, output_folder, logger)
     
     exp_time_taken = time.time() - exp_st_time
     with open(os.path.join(output_folder, "time_taken.txt"), "w") as f:
         f.write(str(exp_time_taken))
 
     logger.log("Experiment time taken: {}".format(exp_time_taken))
+    if model is not None and getattr(model, 'cache', None) is not None:
+        logger.log("Response cache: {}".format(model.cache.stats()))
+    if model is not None and getattr(model, 'generation_time', 0) > 0:
+        logger.log("Generation throughput: {}".format(model.generation_stats()))
     logger.log("Computing Results...")
-    results = compute_results(output_folder)
-
-    df = pd.DataFrame.from_dict(results, orient="index")
+    df = compute_results_df(output_folder, kwargs.get("hierarchical_cwe", False))
     df.to_csv(os.path.join(output_folder, "results.csv"))
 
     prec_recall = compute_precision_recall_accuracy(df, "true_label", "llm_label")
@@ -189,7 +296,12 @@ def run_exp(model_name, benchmark, **kwargs):
     return output_folder
 
 def get_data(benchmark, kwargs, logger):
-    if benchmark.startswith("owasp"):
+    from data.packed import PackedCorpus, packed_path
+    if PackedCorpus.exists(packed_path(benchmark)):
+        from data.packed import PackedDataset
+        logger.log("Loading packed corpus: {}".format(packed_path(benchmark)))
+        data = PackedDataset(benchmark, logger, **kwargs)
+    elif benchmark.startswith("owasp"):
         from data.owasp import OWASP
 
         data = OWASP(logger, **kwargs)
@@ -236,6 +348,14 @@ if __name__ == "__main__":
     argparse.add_argument("--bits", type=int, required=False, help="Number of bits to use for quantization")
     argparse.add_argument("--flash", action="store_true", help="Enable flash attention")
     argparse.add_argument("--max_input_tokens", type=int, default=16000, help="Max Input Size for LLM; Skipping inputs larger than this")
+    argparse.add_argument("--length_sort", default=None, type=str, choices=["asc", "desc"], help="Order samples by token length (local models only)")
+    argparse.add_argument("--token_budget", default=None, type=int, help="Only run samples until their input tokens add up to this budget (local models only)")
+    argparse.add_argument("--concurrency", type=int, default=1, help="Number of predictions to keep in flight (API-backed models only, ignored for local models)")
+    argparse.add_argument("--batch_size", type=int, default=0, help="Batch size for local models; pending prompts are grouped by token length")
+    argparse.add_argument("--rpm", type=int, default=None, help="Requests per minute allowed by the hosted model provider")
+    argparse.add_argument("--tpm", type=int, default=None, help="Tokens per minute allowed by the hosted model provider")
+    argparse.add_argument("--cache_path", type=str, default=None, help="SQLite file used to cache model responses across runs")
+    argparse.add_argument("--cache_max_mb", type=int, default=1024, help="Max size of the response cache before evicting least recently used entries")
     
 
     # dataset parameters
@@ -259,6 +379,10 @@ if __name__ == "__main__":
     argparse.add_argument("--indices", default=None, type=str, help="Indices to filter by")
 
     argparse.add_argument("--overwrite", action='store_true')
+
+    argparse.add_argument("--hierarchical_cwe", action='store_true', help="Count predicting an ancestor of the true CWE as correct")
+
+    argparse.add_argument("--results_backend", default=None, type=str, choices=["jsonl", "dir"], help="Format for storing per-sample results. Defaults to the format already in the output folder, else jsonl")
     
     argparse.add_argument("--adv", default=None, type=str, help="Run adversarial experiment", choices=["deadcode", "varname", "dummybranch"])
     
@@ -278,6 +402,14 @@ if __name__ == "__main__":
     kwargs["bits"] = args.bits
     kwargs["flash"] = args.flash
     kwargs["max_input_tokens"] = args.max_input_tokens
+    kwargs["length_sort"] = args.length_sort
+    kwargs["token_budget"] = args.token_budget
+    kwargs["concurrency"] = args.concurrency
+    kwargs["batch_size"] = args.batch_size
+    kwargs["rpm"] = args.rpm
+    kwargs["tpm"] = args.tpm
+    kwargs["cache_path"] = args.cache_path
+    kwargs["cache_max_mb"] = args.cache_max_mb
 
     kwargs["n_examples"] = args.n_examples
     kwargs["top_cwe"] = args.top_cwe
@@ -297,6 +429,8 @@ if __name__ == "__main__":
     kwargs["indices"] = args.indices
 
     kwargs["overwrite"] = args.overwrite
+    kwargs["results_backend"] = args.results_backend
+    kwargs["hierarchical_cwe"] = args.hierarchical_cwe
     
     kwargs["adv"] = args.adv
     kwargs["adv_ref"] = args.adv_ref
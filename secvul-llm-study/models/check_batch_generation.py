@@ -0,0 +1,119 @@
+import argparse
+import os
+import tempfile
+import time
+
+# Checks that --batch_size only changes throughput: runs the same prompts through a local model's
+# predict one at a time and in batches and compares the predictions. Without --model_id it builds
+# a tiny random Llama with a locally trained tokenizer, so it runs offline on CPU.
+# usage: python -m models.check_batch_generation [--model codellama] [--model_id <hf id or dir>]
+#        [--samples 12] [--batch_size 4] [--max_new_tokens 24]
+
+_CHAT_TEMPLATE = (
+    "{{ bos_token }}{% for m in messages %}"
+    "{% if m['role'] == 'system' %}<<SYS>>{{ m['content'] }}<</SYS>>"
+    "{% elif m['role'] == 'user' %}[INST]{{ m['content'] }}[/INST]"
+    "{% else %}{{ m['content'] }}{{ eos_token }}{% endif %}{% endfor %}"
+)
+
+_SNIPPET = """int copy_{i}(char *dst, const char *src, int len) {{
+    char buf[{size}];
+    for (int k = 0; k < len; k++)
+        buf[k] = src[k];
+    memcpy(dst, buf, len);
+    return {i};
+}}
+"""
+
+
+def model_class(model):
+    if model == "codellama":
+        from models import codellama
+        return codellama.CodeLlamaModel, codellama._model_name_map
+    if model == "mistral":
+        from models import mistral
+        return mistral.MistralModel, mistral._model_name_map
+    if model == "deepseek":
+        from models import deepseek
+        return deepseek.DeepSeekModel, deepseek._model_name_map
+    raise ValueError("unknown model " + model)
+
+
+def build_tiny_model(path, corpus):
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    tok.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=512, special_tokens=["<s>", "</s>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<s>", eos_token="</s>")
+    tokenizer.chat_template = _CHAT_TEMPLATE
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=4096,
+                         initializer_range=0.5, bos_token_id=tokenizer.bos_token_id,
+                         eos_token_id=tokenizer.eos_token_id)
+    LlamaForCausalLM(config).save_pretrained(path)
+
+
+def build_prompts(n, system_prompt_type):
+    from data.prompt import PROMPTS, PROMPTS_SYSTEM
+    prompts = []
+    for i in range(n):
+        # snippets of different lengths so the batches need left padding
+        snippet = "".join(_SNIPPET.format(i=i * 10 + k, size=16 * (i + 1)) for k in range(1 + i % 4))
+        query = PROMPTS["generic"].format(snippet, "Out-of-bounds Write (CWE-787)")
+        prompts.append([{"role": "system", "content": PROMPTS_SYSTEM[system_prompt_type]},
+                        {"role": "user", "content": query}])
+    return prompts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="codellama", choices=["codellama", "mistral", "deepseek"])
+    parser.add_argument("--model_id", default=None, help="HF model to use instead of the tiny random one")
+    parser.add_argument("--samples", type=int, default=12)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--max_new_tokens", type=int, default=24)
+    parser.add_argument("--system_prompt_type", default="generic")
+    args = parser.parse_args()
+
+    cls, name_map = model_class(args.model)
+    prompts = build_prompts(args.samples, args.system_prompt_type)
+    with tempfile.TemporaryDirectory() as tmp:
+        model_id = args.model_id
+        if model_id is None:
+            model_id = os.path.join(tmp, "tiny")
+            build_tiny_model(model_id, [m["content"] for p in prompts for m in p])
+        name_map["check-batch"] = model_id
+        # the longest prompt is over the limit, so the length rule is checked in both modes too
+        probe = cls("check-batch", None, max_input_tokens=10 ** 6, max_new_tokens=args.max_new_tokens,
+                    system_prompt_type=args.system_prompt_type)
+        limit = max(len(probe.tokenizer.tokenize(probe.render_prompt(p))) for p in prompts) - 1
+        model = cls("check-batch", None, max_input_tokens=limit, max_new_tokens=args.max_new_tokens,
+                    system_prompt_type=args.system_prompt_type)
+
+        st = time.time()
+        single = [model.predict(p) for p in prompts]
+        single_time = time.time() - st
+        st = time.time()
+        batched = model.predict(prompts, batch_size=args.batch_size, no_progress_bar=True)
+        batched_time = time.time() - st
+
+    print("first prediction: {!r}".format(single[0]))
+    mismatches = [i for i, (s, b) in enumerate(zip(single, batched)) if s != b]
+    for i in mismatches:
+        print("MISMATCH {}:\n  single:  {!r}\n  batched: {!r}".format(i, single[i], batched[i]))
+    print("{} prompts ({} over the limit): single {:.2f}s, batches of {} {:.2f}s, {} mismatches".format(
+        len(prompts), sum(s.startswith("Too long, skipping") for s in single), single_time, args.batch_size,
+        batched_time, len(mismatches)))
+    assert len(mismatches) == 0, "batched predictions differ from single ones"
+
+
+if __name__ == "__main__":
+    main()
@@ -22,29 +22,14 @@ class CodeLlamaModel(LLM):
         ]
 
 
+    def set_generation_params(self):
+        super().set_generation_params()
+        if 'dataflow' in self.kwargs['system_prompt_type']:
+            print(">Setting max tokens to ", 2048)
+            self.model_hyperparams['max_new_tokens']=2048
+
     def predict(self, main_prompt, batch_size=0, no_progress_bar=False):
-        if batch_size > 0:
-            prompts = [self.pipe.tokenizer.apply_chat_template(p, tokenize=False, add_generation_prompt=True) for p in main_prompt]
-            #print(prompts[0])
-            self.model_hyperparams['temperature']=0.01
-            return self.predict_main(prompts, batch_size=batch_size, no_progress_bar=no_progress_bar)
-        else:
-            prompt = self.pipe.tokenizer.apply_chat_template(
-            main_prompt, 
-            tokenize=False, 
-            add_generation_prompt=True
-            )
-            l=len(self.tokenizer.tokenize(prompt))
-            self.log("Prompt length:" +str(l))
-            limit=16000 if self.kwargs["max_input_tokens"] is None else self.kwargs["max_input_tokens"]
-            if l > limit:
-                return "Too long, skipping: "+str(l)
-            if 'dataflow' in self.kwargs['system_prompt_type']:
-                print(">Setting max tokens to ", 2048)
-                self.model_hyperparams['max_new_tokens']=2048
-            self.model_hyperparams['temperature']=0.01
-            #print(prompt)
-            return self.predict_main(prompt, no_progress_bar=no_progress_bar)
+        return self.predict_chat(main_prompt, batch_size=batch_size, no_progress_bar=no_progress_bar)
 
 
         # assuming 0 is system and 1 is user
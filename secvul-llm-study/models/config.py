@@ -9,12 +9,21 @@ _DEFAULT_PARAMS = {
     'top_p': 1.0
 }
 
+# requests/min and tokens/min per hosted provider; None disables the bucket
+# (429s are still retried with backoff). --rpm/--tpm override these.
+_RATE_LIMITS = {
+    'openai': {'rpm': None, 'tpm': None},
+    'gemini': {'rpm': None, 'tpm': None},
+    'together': {'rpm': None, 'tpm': None}
+}
+
 
 config = dict()
 config['MODEL_DIR_PATH']=_MODEL_DIR_PATH
 
 config['DATA_DIR_PATH']=_DATA_DIR_PATH
 config['DEFAULT_PARAMS']=_DEFAULT_PARAMS
+config['RATE_LIMITS']=_RATE_LIMITS
 
 
 
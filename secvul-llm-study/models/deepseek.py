@@ -19,32 +19,5 @@ class DeepSeekModel(LLM):
         ]
 
     def predict(self, main_prompt, batch_size=0, no_progress_bar=False):
-        def rename(d):
-            newd = dict()
-            newd["role"]="user"
-            newd["content"]=d[0]['content'] + '\n'+ d[1]['content']
-            #print(d)
-            #print(newd)
-            return [newd]
-            
-        if batch_size > 0:
-            prompts = [self.pipe.tokenizer.apply_chat_template(rename(p), tokenize=False, add_generation_prompt=True) for p in main_prompt]
-            #print(prompts[0])
-            self.model_hyperparams['temperature']=0.0
-            return self.predict_main(prompts, batch_size=batch_size, no_progress_bar=no_progress_bar)
-        else:
-           
-            prompt = self.pipe.tokenizer.apply_chat_template(
-            main_prompt, 
-            tokenize=False, 
-            add_generation_prompt=True
-            )
-            l=len(self.tokenizer.tokenize(prompt))
-            self.log("Prompt length:" +str(l))
-            limit=16000 if self.kwargs["max_input_tokens"] is None else self.kwargs["max_input_tokens"]
-            if l > limit:
-                return "Too long, skipping: "+str(l)
-            self.model_hyperparams['temperature']=0.01
-            #print(prompt)
-            return self.predict_main(prompt, no_progress_bar=no_progress_bar)
+        return self.predict_chat(main_prompt, batch_size=batch_size, no_progress_bar=no_progress_bar)
         
\ No newline at end of file
@@ -4,6 +4,7 @@ import models.config as config
 from utils.mylogger import MyLogger
 import os
 from models.llm import LLM
+from models.ratelimit import estimate_tokens
 import google.generativeai as genai
 from tqdm.contrib.concurrent import thread_map
 
@@ -35,6 +36,7 @@ class GeminiModel(LLM):
                                top_p=_GEMINI_DEFAULT_PARAMS["top_p"],
                                top_k=_GEMINI_DEFAULT_PARAMS["top_k"])
         self.client = genai.GenerativeModel(model_name=model_name)
+        self.rate_limiter = self.get_rate_limiter('gemini')
 
     def predict(self, prompt, batch_size=0, no_progress_bar=False):
         if batch_size == 0:
@@ -55,7 +57,11 @@ class GeminiModel(LLM):
                    {"role": "model", "parts": [{"text": "Understood."}],},
                    {"role": "user", "parts": [{"text": f"{main_prompt[1]['content']}"}],}]
         #print(_GEMINI_DEFAULT_PARAMS)
-        response = self.client.generate_content(history)
+        return self.cached_call(history, _GEMINI_DEFAULT_PARAMS, lambda: self._generate(history, main_prompt))
+
+    def _generate(self, history, main_prompt):
+        response = self.rate_limiter.call(self.client.generate_content, history,
+                                          n_tokens=estimate_tokens(main_prompt, _GEMINI_DEFAULT_PARAMS['max_tokens']))
         response = response.text
         #print(response)
         return response
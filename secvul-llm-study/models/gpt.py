@@ -2,6 +2,7 @@ import models.config as config
 from utils.mylogger import MyLogger
 import os
 from models.llm import LLM
+from models.ratelimit import estimate_tokens
 from tqdm.contrib.concurrent import thread_map
 from openai import OpenAI
 
@@ -20,7 +21,9 @@ class GPTModel(LLM):
             api_key = kwargs["openai_api_key"]
         else:
             api_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=api_key)
+        # retries are handled by the shared rate limiter
+        self.client = OpenAI(api_key=api_key, max_retries=0)
+        self.rate_limiter = self.get_rate_limiter('openai')
         self.logprobs = None
         for k in _OPENAI_DEFAULT_PARAMS:
             if k in kwargs:
@@ -48,18 +51,31 @@ class GPTModel(LLM):
         if 'top_logprobs' in self.kwargs:
              _OPENAI_DEFAULT_PARAMS['top_logprobs']=self.kwargs["top_logprobs"]
         #print(_OPENAI_DEFAULT_PARAMS)
+        self.logprobs = None
+        if 'logprobs' in self.kwargs:
+            # the cache only keeps the response text, a cache hit would leave self.logprobs unset
+            return self._call_openai(prompt, expect_json)
+        params = dict(_OPENAI_DEFAULT_PARAMS, expect_json=expect_json)
+        return self.cached_call(prompt, params, lambda: self._call_openai(prompt, expect_json))
+
+    def _call_openai(self, prompt, expect_json):
+        n_tokens = estimate_tokens(prompt, _OPENAI_DEFAULT_PARAMS['max_tokens'])
         if expect_json:
-            response = self.client.chat.completions.create(
+            response = self.rate_limiter.call(
+                self.client.chat.completions.create,
                 model=self.model_id,
                 messages=prompt,
                 response_format={"type": "json_object"},
+                n_tokens=n_tokens,
                 **_OPENAI_DEFAULT_PARAMS)
         else:
-            response = self.client.chat.completions.create(
-                            model=self.model_id,
-            messages=prompt,
-            #response_format={"type": "json_object"} if expect_json else {},
-            **_OPENAI_DEFAULT_PARAMS)
+            response = self.rate_limiter.call(
+                self.client.chat.completions.create,
+                model=self.model_id,
+                messages=prompt,
+                #response_format={"type": "json_object"} if expect_json else {},
+                n_tokens=n_tokens,
+                **_OPENAI_DEFAULT_PARAMS)
         #print(response)
         if response.choices[0].logprobs != None:
             self.logprobs=response.choices[0].logprobs.content
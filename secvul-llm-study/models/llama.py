@@ -7,6 +7,7 @@ from together import Together
 from utils.mylogger import MyLogger
 import os
 from models.llm import LLM
+from models.ratelimit import estimate_tokens
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:64"
 
 assert torch.cuda.is_available(), "CUDA not visible. Check drivers and CUDA_VISIBLE_DEVICES."
@@ -30,6 +31,7 @@ class LlamaModel(LLM):
         super().__init__(model_name, logger, _model_name_map, **kwargs)
         if "-tai" in self.model_name:
             self.together_client = Together()
+            self.rate_limiter = self.get_rate_limiter('together')
         else:
             self.terminators = [
                 self.pipe.tokenizer.eos_token_id,
@@ -57,30 +59,20 @@ class LlamaModel(LLM):
 
 
     def predict_one_with_together_ai(self, prompt):
-        completion = self.together_client.chat.completions.create(
+        return self.cached_call(prompt, {"temperature": 0},
+                                lambda: self._call_together_ai(prompt))
+
+    def _call_together_ai(self, prompt):
+        completion = self.rate_limiter.call(
+            self.together_client.chat.completions.create,
             model=_model_name_map[self.model_name],
             messages=prompt,
             # response_format={"type": "json_object"},
-            temperature=0)
+            temperature=0,
+            n_tokens=estimate_tokens(prompt, self.model_hyperparams['max_new_tokens']))
         response = completion.choices[0].message.content
         return response
 
     def predict_local(self, main_prompt, batch_size=0, no_progress_bar=False):
         # assuming 0 is system and 1 is user
-
-        #prompt = f"<s>[INST] <<SYS>>\\n{system_prompt}\\n<</SYS>>\\n\\n{user_prompt}[/INST]"
-        if batch_size > 0:
-            prompts = [self.pipe.tokenizer.apply_chat_template(p, tokenize=False, add_generation_prompt=True) for p in main_prompt]
-            self.model_hyperparams['temperature']=0.01
-            return self.predict_main(prompts, batch_size=batch_size, no_progress_bar=no_progress_bar)
-        else:
-            prompt = self.pipe.tokenizer.apply_chat_template(
-            main_prompt,
-            tokenize=False,
-            add_generation_prompt=True
-            )
-
-            #prompt = f"{user_prompt}"
-            #inputs = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=False).to("cuda")
-            self.model_hyperparams['temperature']=0.01
-            return self.predict_main(prompt, no_progress_bar=no_progress_bar)
+        return self.predict_chat(main_prompt, batch_size=batch_size, no_progress_bar=no_progress_bar)
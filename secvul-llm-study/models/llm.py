@@ -2,8 +2,11 @@ from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModelForSeq2Se
 import transformers
 import torch
 import models.config as config
+from models.ratelimit import get_rate_limiter
+from models.cache import ResponseCache
 from utils.mylogger import MyLogger
 import os
+import time
 import tqdm
 
 class LLM:
@@ -30,12 +33,20 @@ class LLM:
             self.log("Error details: {}".format(e))
             exit(1)
 
+        if kwargs.get('cache_path', None) is not None:
+            max_mb = kwargs.get('cache_max_mb', None) or 1024
+            self.cache = ResponseCache(kwargs['cache_path'], max_bytes=max_mb * 1024 * 1024)
+        else:
+            self.cache = None
+
         # nothing else needed if calling gpt
         if model_name.lower().startswith("gpt"):
             return
         # nothing else needed if calling together AI
         elif "-tai" in model_name.lower():
             return
+        elif model_name.lower().startswith("gemini"):
+            return
 
         if model_name.lower().startswith('codet5'):
             model_loader=AutoModelForSeq2SeqLM
@@ -45,6 +56,10 @@ class LLM:
             model_loader=AutoModelForCausalLM
 
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        # half precision is only worth it (and fully supported) on GPU
+        self.dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        self.generated_tokens = 0
+        self.generation_time = 0
         self.log(">>>Loading model")
         if kwargs.get('vllm', None) is not None:
             self.log(">>>Using vLLM")
@@ -56,14 +71,14 @@ class LLM:
             if kwargs['bits'] == 8:
                 self.model = model_loader.from_pretrained(
                     self.model_id,
-                    torch_dtype=torch.float16,
+                    torch_dtype=self.dtype,
                     device_map="auto",
                     load_in_8bit=True
                     )
             elif kwargs['bits'] == 4:
                   self.model = model_loader.from_pretrained(
                     self.model_id,
-                    torch_dtype=torch.float16,
+                    torch_dtype=self.dtype,
                     device_map="auto",
                     load_in_4bit=True
                     )
@@ -73,12 +88,12 @@ class LLM:
         elif kwargs.get('flash2', None) is not None:
             self.model = model_loader.from_pretrained(
                 self.model_id,
-                torch_dtype=torch.float16,
+                torch_dtype=self.dtype,
                 device_map="auto", attn_implementation="flash_attention_2")
         else:
             self.model = model_loader.from_pretrained(
                 self.model_id,
-                torch_dtype=torch.float16,
+                torch_dtype=self.dtype,
                 device_map="auto")
 
 
@@ -95,72 +110,149 @@ class LLM:
         self.pipe.tokenizer.padding_side = 'left'
 
 
+    def get_rate_limiter(self, provider):
+        """
+        Limiter shared by every client of a hosted provider. A custom limiter can be
+        plugged in through the `rate_limiter` kwarg
+        """
+        if self.kwargs.get('rate_limiter', None) is not None:
+            return self.kwargs['rate_limiter']
+        limits = config.config['RATE_LIMITS'].get(provider, {})
+        return get_rate_limiter(provider,
+                                rpm=self.kwargs.get('rpm', None) or limits.get('rpm', None),
+                                tpm=self.kwargs.get('tpm', None) or limits.get('tpm', None),
+                                log=self.log)
+
     def get_model_names(self):
         return list(model_name_map.keys())
 
-    def predict_main(self, prompt, batch_size=0, no_progress_bar=False):
+    def cached_call(self, messages, params, fn):
+        """
+        Returns the cached response for (model, params, messages) or calls `fn` and caches its result
+        """
+        if self.cache is None:
+            return fn()
+        key = self.cache.make_key(self.model_id, params, messages)
+        response = self.cache.get(key)
+        if response is None:
+            response = fn()
+            if response is not None:
+                self.cache.put(key, response)
+        return response
+
+    def cached_batch_call(self, prompts, params, fn):
+        """
+        Batched version of cached_call: `fn` is only called on the prompts missing from the cache
+        """
+        if self.cache is None:
+            return fn(prompts)
+        keys = [self.cache.make_key(self.model_id, params, p) for p in prompts]
+        outputs = [self.cache.get(k) for k in keys]
+        missing = [i for i, o in enumerate(outputs) if o is None]
+        if len(missing) > 0:
+            generated = fn([prompts[i] for i in missing])
+            for i, g in zip(missing, generated):
+                outputs[i] = g
+                if g is not None:
+                    self.cache.put(keys[i], g)
+        return outputs
+
+    def render_prompt(self, messages):
+        return self.pipe.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def prompt_too_long(self, prompt):
+        """
+        Returns the "Too long, skipping" prediction for a rendered prompt over max_input_tokens, else None
+        """
+        l = len(self.tokenizer.tokenize(prompt))
+        self.log("Prompt length:" + str(l))
+        limit = 16000 if self.kwargs.get("max_input_tokens", None) is None else self.kwargs["max_input_tokens"]
+        if l > limit:
+            return "Too long, skipping: " + str(l)
+        return None
+
+    def set_generation_params(self):
+        self.model_hyperparams['temperature'] = 0.01
+
+    def predict_chat(self, main_prompt, batch_size=0, no_progress_bar=False):
+        """
+        Local generation for a chat prompt (system and user messages), or for a list of them when
+        batch_size > 0. Both go through the same rendering, length limit, generation parameters and
+        generate_batch, so batching changes the throughput but not the predictions
+        """
+        self.set_generation_params()
+        chats = main_prompt if batch_size > 0 else [main_prompt]
+        prompts = [self.render_prompt(p) for p in chats]
+        outputs = [self.prompt_too_long(p) for p in prompts]
+        todo = [i for i, o in enumerate(outputs) if o is None]
+        if len(todo) > 0:
+            generated = self.predict_main([prompts[i] for i in todo], batch_size=max(batch_size, 1),
+                                          no_progress_bar=no_progress_bar or batch_size == 0)
+            for i, g in zip(todo, generated):
+                outputs[i] = g
+        return outputs if batch_size > 0 else outputs[0]
+
+    def predict_main(self, prompts, batch_size=1, no_progress_bar=False):
+        # local generation is looked up by the rendered prompts, a single prompt is a batch of one
+        return self.cached_batch_call(prompts, self.model_hyperparams,
+                                      lambda p: self._predict_main(p, batch_size, no_progress_bar))
+
+    def _predict_main(self, prompts, batch_size=1, no_progress_bar=False):
         if self.kwargs.get('vllm', None):
             from vllm import SamplingParams
             params=SamplingParams(temperature=self.model_hyperparams['temperature'], top_p=self.model_hyperparams['top_p'], max_tokens=self.model_hyperparams['max_new_tokens'])
-            output = self.model.generate(prompt, params)
-            return output.outputs[0].text
+            return [output.outputs[0].text for output in self.model.generate(prompts, params)]
 
         if self.kwargs.get('flash'):
             with torch.backends.cuda.sdp_kernel(enable_flash=True, enable_math=False, enable_mem_efficient=False):
                 torch.cuda.synchronize()
                 print(">>flash enabled", torch.backends.cuda.flash_sdp_enabled())
-                print("params", self.model_hyperparams['max_new_tokens'])
-                output = self.pipe(
-                    prompt,
-                    max_new_tokens=self.model_hyperparams['max_new_tokens'],
-                    temperature=self.model_hyperparams['temperature'],
-                    top_p=self.model_hyperparams['top_p'],
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    #eos_token_id=self.tokenizer.eos_token_id,
-                    return_full_text=False
-                    #skip_special_tokens=True
-                )
-        else:
-            if batch_size > 0:
-                output = []
-                from torch.utils.data import Dataset
-                class ListDataset(Dataset):
-                    def __init__(self, original_list):
-                        self.original_list = original_list
-                    def __len__(self):
-                        return len(self.original_list)
-                    def __getitem__(self, i):
-                        return self.original_list[i]
-
-                mydataset=ListDataset(prompt)
-                for result in tqdm.tqdm(self.pipe(mydataset,
-                                                    max_new_tokens=self.model_hyperparams['max_new_tokens'],
-                                                    temperature=self.model_hyperparams['temperature'],
-                                                    top_p=self.model_hyperparams['top_p'],
-                                                    eos_token_id=self.terminators,
-                                                    pad_token_id=self.tokenizer.eos_token_id,
-                                                    #eos_token_id=self.tokenizer.eos_token_id,
-                                                    return_full_text=False,
-                                                    #do_sample=False,
-                                                    batch_size=batch_size), disable=no_progress_bar):
-
-                    output.append(result)
-                return [o[0]['generated_text'] for o in output]
-            else:
-                output = self.pipe(
-                    prompt,
-                    max_new_tokens=self.model_hyperparams['max_new_tokens'],
-                    temperature=self.model_hyperparams['temperature'],
-                    top_p=self.model_hyperparams['top_p'],
-                    eos_token_id=self.terminators,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    #eos_token_id=self.tokenizer.eos_token_id,
-                    return_full_text=False,
-                    do_sample=False
-                    )
-                return output[0]['generated_text']
+                return self.generate_batch(prompts, batch_size, no_progress_bar)
+        return self.generate_batch(prompts, batch_size, no_progress_bar)
 
+    def generate_batch(self, prompts, batch_size, no_progress_bar=False):
+        """
+        Greedy generation for a list of rendered prompts, also used for single prompts (batch_size=1).
+        Prompts are sorted by tokenized length and padded on the left per batch so similar lengths
+        share a batch; outputs keep the input order
+        """
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = 'left'
+        terminators = set(t for t in getattr(self, 'terminators', [self.tokenizer.eos_token_id]) if t is not None)
+
+        # rendered chat templates already contain the special tokens
+        encoded = [self.tokenizer(p, add_special_tokens=False)['input_ids'] for p in prompts]
+        order = sorted(range(len(prompts)), key=lambda i: len(encoded[i]))
+        outputs = [None] * len(prompts)
+        for b in tqdm.tqdm(range(0, len(order), batch_size), disable=no_progress_bar):
+            ids = order[b:b + batch_size]
+            inputs = self.tokenizer.pad({'input_ids': [encoded[i] for i in ids]}, return_tensors='pt').to(self.model.device)
+            st = time.time()
+            with torch.no_grad():
+                generated = self.model.generate(
+                    **inputs,
+                    max_new_tokens=self.model_hyperparams['max_new_tokens'],
+                    do_sample=False,
+                    eos_token_id=list(terminators),
+                    pad_token_id=self.tokenizer.pad_token_id)
+            elapsed = time.time() - st
+            new_tokens = generated[:, inputs['input_ids'].shape[1]:].tolist()
+            n_tokens = 0
+            for i, tokens in zip(ids, new_tokens):
+                # everything after the first terminator is padding
+                end = next((k for k, t in enumerate(tokens) if t in terminators), len(tokens))
+                n_tokens += end
+                outputs[i] = self.tokenizer.decode(tokens[:end], skip_special_tokens=True)
+            self.generated_tokens += n_tokens
+            self.generation_time += elapsed
+            self.log(">>Batch of {} prompts ({} input tokens max): {} new tokens in {:.1f}s, {:.1f} tokens/s".format(
+                len(ids), inputs['input_ids'].shape[1], n_tokens, elapsed, n_tokens / max(elapsed, 1e-6)))
+        return outputs
 
+    def generation_stats(self):
+        return {"generated_tokens": self.generated_tokens, "generation_time": self.generation_time,
+                "tokens_per_sec": self.generated_tokens / self.generation_time if self.generation_time > 0 else 0}
 
     @staticmethod
     def get_llm(model_name, kwargs, logger):
@@ -183,3 +275,27 @@ class LLM:
             logger.log(model_name + " not implemented")
             exit(1)
         return model
+
+    @staticmethod
+    def is_local(model_name):
+        name = model_name.lower()
+        return not (name.startswith("gpt") or name.startswith("gemini") or "-tai" in name)
+
+    @staticmethod
+    def get_model_id(model_name):
+        """
+        HuggingFace id of a local model, without loading it (e.g. to load just its tokenizer)
+        """
+        if not LLM.is_local(model_name):
+            return None
+        if model_name.lower().startswith("codellama"):
+            from models.codellama import _model_name_map
+        elif model_name.lower().startswith("llama"):
+            from models.llama import _model_name_map
+        elif model_name.lower().startswith("mistral") or model_name.lower().startswith("mixtral"):
+            from models.mistral import _model_name_map
+        elif model_name.lower().startswith("deepseek"):
+            from models.deepseek import _model_name_map
+        else:
+            return None
+        return _model_name_map.get(model_name.lower(), None)
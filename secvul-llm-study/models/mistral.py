@@ -23,28 +23,7 @@ class MistralModel(LLM):
         ]
 
     def predict(self, main_prompt, batch_size=0, no_progress_bar=False):
-        def rename(d):
-            newd = dict()
-            newd["role"]="user"
-            newd["content"]=d[0]['content'] + '\n'+ d[1]['content']
-            #print(d)
-            #print(newd)
-            return [newd]
-            
-        if batch_size > 0:
-            prompts = [self.pipe.tokenizer.apply_chat_template(rename(p), tokenize=False, add_generation_prompt=True) for p in main_prompt]
-            #print(prompts[0])
-            self.model_hyperparams['temperature']=0.01
-            return self.predict_main(prompts, batch_size=batch_size, no_progress_bar=no_progress_bar)
-        else:
-            prompt = self.pipe.tokenizer.apply_chat_template(
-            main_prompt, 
-            tokenize=False, 
-            add_generation_prompt=True
-            )
-            self.model_hyperparams['temperature']=0.01
-            #print(prompt)
-            return self.predict_main(prompt, no_progress_bar=no_progress_bar)
+        return self.predict_chat(main_prompt, batch_size=batch_size, no_progress_bar=no_progress_bar)
 
 
         # assuming 0 is system and 1 is user
@@ -66,9 +45,9 @@ if __name__ == '__main__':
     from data.bigvul import BigVul
     from data.cvefixes import CVEFixes
     #bigvul = BigVul(os.path.join(config.config['DATA_DIR_PATH'] ,"MSR_20_Code_vulnerability_CSV_Dataset"), logger=None)
-    cvefixes=CVEFixes("cvefixes-c-cpp-method", logger=None).df
+    cvefixes=CVEFixes("cvefixes-c-cpp-method", logger=None)
     #id, row = bigvul.get_next()
-    row=cvefixes.iloc[0]['code']
+    row=next(cvefixes.records())[1]['code']
     print(row)
     mistral_model = MistralModel("mixtral-8x7b-instruct", logger=None, max_input_tokens=1024, flash=False, system_prompt_type='')
     print(">>>Running Mistral")
@@ -1,11 +1,11 @@
 import openai
 import os
+import models.config as config
 from utils.mylogger import MyLogger
 from utils.prompt_utils import generate_message_list, generate_validation_message_list
-import time
+from models.ratelimit import get_rate_limiter, estimate_tokens
 
 _OPENAI_DEFAULT_PARAMS = {"temperature": 0, "n": 1, "max_tokens": 1024, "stop": ""}
-_DELAY_SECS = 5
 
 class OpenAIModel:
     def __init__(self, logger: MyLogger, model_name="gpt-4", **kwargs):
@@ -23,26 +23,31 @@ class OpenAIModel:
             openai.api_key = kwargs["openai_api_key"]
         else:
             openai.api_key = os.getenv("OPENAI_API_KEY")
+        # same limits as LLM.get_rate_limiter: the rpm/tpm kwargs, then the RATE_LIMITS config
+        limits = config.config['RATE_LIMITS'].get("openai", {})
+        self.rate_limiter = get_rate_limiter("openai",
+                                             rpm=kwargs.get("rpm", None) or limits.get("rpm", None),
+                                             tpm=kwargs.get("tpm", None) or limits.get("tpm", None),
+                                             log=self.log)
 
         print(openai.api_key)
 
-    def call_openai(self, prompt, n_tries=5):
-        while n_tries > 0:
-            try:
-                output = openai.ChatCompletion.create(
-                    model=self.model_id, messages=prompt, **self.model_params
-                )
-                # Only return the first response
-                return output["choices"][0]["message"]
-            except Exception as e:
-                n_tries -= 1
-                error_message = "OpenAI call failed with Exception: ", str(e)
-                self.log(error_message)
-                # Add a time delay to recover the rate limit, if any
-                time.sleep(_DELAY_SECS)
-                # Report this as an error
-                if n_tries == 0:
-                    return {"role": "error", "content": error_message}
+    def call_openai(self, prompt):
+        try:
+            # rate limits and transient errors are retried with back-off inside the limiter
+            output = self.rate_limiter.call(
+                openai.ChatCompletion.create,
+                model=self.model_id, messages=prompt,
+                n_tokens=estimate_tokens(prompt, self.model_params["max_tokens"]),
+                **self.model_params
+            )
+        except openai.error.OpenAIError as e:
+            # the limiter gave up or the error is not retryable: report this as an error
+            error_message = "OpenAI call failed with Exception: " + str(e)
+            self.log(error_message)
+            return {"role": "error", "content": error_message}
+        # Only return the first response
+        return output["choices"][0]["message"]
 
     def get_prompt(self, snippet, prompt_cwe):
         cwe_specific = (
@@ -90,7 +95,6 @@ class OpenAIModel:
                     running_prompt.append({"role": "assistant", "content": ""})
                     break
 
-                time.sleep(_DELAY_SECS)
                 # Store the chat history
                 running_prompt.append(response)
                 # Do not continue the chat if an error occurred
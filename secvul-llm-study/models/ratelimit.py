@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+# status codes worth retrying besides 429
+_RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504, 529}
+_RETRYABLE_ERRORS = ("RateLimit", "ResourceExhausted", "ServiceUnavailable", "Timeout", "APIConnectionError", "InternalServerError")
+
+_limiters = dict()
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `capacity`. Callers reserve units up front
+    and get back how long they have to wait before the reservation is covered
+    """
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            # the bucket may go negative, later callers queue up behind the deficit
+            self.level -= min(amount, self.capacity)
+            return 0 if self.level >= 0 else -self.level / self.rate
+
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min buckets shared by every client of one provider, with
+    jittered exponential backoff on 429s and transient errors (honouring Retry-After)
+    """
+    def __init__(self, rpm=None, tpm=None, max_retries=6, base_delay=1.0, max_delay=60.0, log=print):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.log = log
+        self.cooldown_until = 0
+        self.lock = threading.Lock()
+
+    def set_limits(self, rpm=None, tpm=None):
+        """
+        Replaces the buckets whose limit differs from the given one; None keeps the current limit
+        """
+        if rpm is not None and rpm != self.rpm:
+            self.log("Rate limit changed from {} to {} requests/min".format(self.rpm, rpm))
+            self.rpm = rpm
+            self.requests = TokenBucket(rpm) if rpm else None
+        if tpm is not None and tpm != self.tpm:
+            self.log("Rate limit changed from {} to {} tokens/min".format(self.tpm, tpm))
+            self.tpm = tpm
+            self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, n_tokens=0):
+        delay = 0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None and n_tokens > 0:
+            delay = max(delay, self.tokens.reserve(n_tokens))
+        with self.lock:
+            delay = max(delay, self.cooldown_until - time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        # a throttled provider is throttled for every thread, so all callers pause together
+        with self.lock:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, fn, *args, n_tokens=0, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire(n_tokens)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, get_retry_after(e))
+                self.log("Request failed ({}: {}), retrying in {:.1f}s".format(type(e).__name__, str(e)[:200], delay))
+                attempt += 1
+
+
+def get_status_code(e):
+    for obj in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "http_status", "code", "status"):
+            code = getattr(obj, attr, None)
+            if isinstance(code, int):
+                return code
+    return None
+
+
+def get_retry_after(e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or getattr(e, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        # http-date form, fall back to exponential backoff
+        return None
+    return None
+
+
+def is_retryable(e):
+    code = get_status_code(e)
+    if code == 429 or code in _RETRYABLE_STATUS:
+        return True
+    return any(k in type(e).__name__ for k in _RETRYABLE_ERRORS)
+
+
+def estimate_tokens(messages, max_new_tokens=0):
+    # rough chars/4 estimate; providers count the completion budget against tpm as well
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + max_new_tokens
+
+
+def get_rate_limiter(provider, rpm=None, tpm=None, log=print):
+    """
+    Returns the limiter shared by all clients of `provider`, creating it on first use. Limits given
+    by a later client replace the ones of the shared limiter, as the provider's quota is shared too
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(rpm=rpm, tpm=tpm, log=log)
+        else:
+            _limiters[provider].set_limits(rpm=rpm, tpm=tpm)
+        return _limiters[provider]
@@ -0,0 +1,74 @@
+import argparse
+import os
+import re
+import time
+from glob import glob
+from utils import parse_llm_results, open_results
+
+# Micro-benchmark of parse_llm_results over the predictions stored in experiment folders.
+# Also reports how many predictions parse differently from the previous regex-per-field parser.
+# usage: python utils/bench_parse.py --results_dir shared/v2/study_results_v2 [--repeat 5]
+
+
+def parse_llm_results_reference(pred_text):
+    # previous implementation (kept verbatim, including the count=re.IGNORECASE quirk)
+    results = dict()
+    pred_text = re.sub(r'\\text\{([^}]*)\}', r'\1', pred_text, re.IGNORECASE)
+    pred_text = re.sub(r'\\textbf\{([^}]*)\}', r'\1', pred_text, re.IGNORECASE)
+    vul = re.findall(r"vulnerability\s*[:=]\s*(YES|NO|Y|N|NA|N/A)", pred_text, re.IGNORECASE)
+    results["vulnerability"] = vul[0] if len(vul) > 0 else None
+    vul_type = re.findall(r"type\s*[:=]\s*(CWE[-_]\d+|NA|N/A)", pred_text, re.IGNORECASE)
+    results["vulnerability type"] = vul_type[0] if len(vul_type) > 0 else None
+    vul_name = re.findall(r"name\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
+    results["vulnerability name"] = vul_name[0] if len(vul_name) > 0 else None
+    if results["vulnerability type"] is None and results["vulnerability name"] is not None:
+        vul_type = re.findall(r"(CWE[-_]\d+|NA|N/A)", results["vulnerability name"], re.IGNORECASE)
+        results["vulnerability type"] = vul_type[0] if len(vul_type) > 0 else None
+    results["vulnerability type"] = str(results["vulnerability type"]).split("_")[-1].split("-")[-1].strip()
+    loc = re.findall(r"lines\s*of\s*code\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
+    results["lines of code"] = loc[0] if len(loc) > 0 else None
+    exp = re.findall(r"explanation\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
+    results["explanation"] = exp[0] if len(exp) > 0 else None
+    return results
+
+
+def load_corpus(results_dir):
+    corpus = []
+    for d in sorted(glob(os.path.join(results_dir, "*"))):
+        if not os.path.isdir(d):
+            continue
+        for _, record in open_results(d).records():
+            if record is not None and "pred" in record:
+                corpus.append(record["pred"].strip())
+    return corpus
+
+
+def bench(fn, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        st = time.perf_counter()
+        for pred in corpus:
+            fn(pred)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", type=str, required=True, help="Directory containing experiment folders")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.results_dir)
+    if len(corpus) == 0:
+        print("No predictions found under", args.results_dir)
+        exit(1)
+    chars = sum(len(p) for p in corpus)
+    print("Predictions: {}, characters: {}".format(len(corpus), chars))
+
+    mismatches = sum(1 for p in corpus if parse_llm_results(p) != parse_llm_results_reference(p))
+    print("Predictions parsed differently from the reference parser: {}".format(mismatches))
+
+    for name, fn in [("reference", parse_llm_results_reference), ("parse_llm_results", parse_llm_results)]:
+        t = bench(fn, corpus, args.repeat)
+        print("{:>20}: {:.3f}s  {:.0f} preds/s  {:.1f} MB/s".format(name, t, len(corpus) / t, chars / t / 1e6))
@@ -0,0 +1,46 @@
+import re
+
+# Comment removal shared by the dataset loaders and scripts/build_utsv_cvefixes_csv.py.
+# A single precompiled pattern matches, left to right, either a literal (captured in `keep`
+# and substituted back) or a comment (dropped); everything else is left untouched by re.sub.
+# Unterminated strings and block comments run to the end of the input.
+
+# languages whose comments start with '#' (compared with CVEfixes' programming_language)
+HASH_LANGS = {
+    "Python", "Ruby", "Perl", "Shell", "Makefile", "R", "Haskell", "YAML"
+}
+
+_C_LIKE_RE = re.compile(
+    r"""(?P<keep>R"(?P<delim>[^()\\\s"]{0,16})\(.*?\)(?P=delim)\""""  # C++ raw string (u8/u/U/L prefixes are plain text)
+    r'''|"[^"\\]*(?:\\.[^"\\]*)*"?'''                                                      # string
+    r"""|'[^'\\]*(?:\\.[^'\\]*)*'?)"""                                                     # char literal
+    r"""|/\*.*?(?:\*/|\Z)"""                                                               # block comment
+    r"""|//[^\n]*""",                                                                      # line comment
+    re.DOTALL)
+
+_HASH_RE = re.compile(
+    r'''(?P<keep>"""(?:\\.|[^\\])*?(?:"""|\Z)'''    # triple quoted strings
+    r"""|'''(?:\\.|[^\\])*?(?:'''|\Z)"""
+    r'''|"[^"\\]*(?:\\.[^"\\]*)*"?'''               # strings
+    r"""|'[^'\\]*(?:\\.[^'\\]*)*'?)"""
+    r"""|(?<![$\{\\])#[^\n]*""",                    # comment (not $# / ${#var} / \#)
+    re.DOTALL)
+
+
+def comment_style(language):
+    return "hash" if language in HASH_LANGS else "c"
+
+
+def strip_comments(src, style="c"):
+    """
+    Removes comments from `src` without touching string/char literals. `style` is "c" for
+    // and /* */ comments (C, C++, Java, JavaScript, ...) or "hash" for # comments.
+    Line comments keep their newline
+    """
+    if not src:
+        return ""
+    if style == "hash":
+        return _HASH_RE.sub(r"\g<keep>", src) if "#" in src else src
+    if "/" not in src:
+        return src
+    return _C_LIKE_RE.sub(r"\g<keep>", src)
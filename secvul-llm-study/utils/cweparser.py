@@ -1,3 +1,6 @@
+import os
+import pickle
+import pandas as pd
 
 
 def get_cwe_mappings():
@@ -40,21 +43,119 @@ def is_parent(parent, child, df):
     return False
 
 
-def check_cwe(true_id, predicted_id):
-    import pandas as pd
-    true_id = int(true_id)
-    predicted_id = int(predicted_id)    
-    df = pd.read_csv("cwemappings.csv", delimiter=";")
-    # if predicted id is equal to target id or a parent of target id, return true
-    if true_id == predicted_id:
-        return True
+class CWEIndex:
+    """
+    Transitive closure of the CWE ChildOf hierarchy. Every CWE gets a bit position and
+    ancestors[cwe] is an int bitset of all its ancestors (and itself), so ancestor checks
+    are a single shift-and-mask
+    """
+    def __init__(self, parents):
+        ids = sorted(set(parents.keys()).union(*parents.values()) if len(parents) > 0 else [])
+        self.bit = {c: i for i, c in enumerate(ids)}
+        self.ancestors = dict()
+        for c in ids:
+            # walk up once per CWE at build time; a plain traversal also copes with cycles across views
+            mask = 0
+            seen = {c}
+            stack = [c]
+            while stack:
+                cur = stack.pop()
+                mask |= 1 << self.bit[cur]
+                for p in parents.get(cur, ()):
+                    if p not in seen:
+                        seen.add(p)
+                        stack.append(p)
+            self.ancestors[c] = mask
+
+    def is_ancestor(self, ancestor, cwe):
+        """
+        True if `ancestor` is `cwe` or one of its (transitive) parents
+        """
+        ancestor, cwe = int(ancestor), int(cwe)
+        if ancestor == cwe:
+            return True
+        mask = self.ancestors.get(cwe, None)
+        bit = self.bit.get(ancestor, None)
+        return mask is not None and bit is not None and (mask >> bit) & 1 == 1
+
+    def is_ancestor_batch(self, ancestors, cwes):
+        """
+        Element-wise is_ancestor; entries that are not CWE ids (e.g. N/A) are False
+        """
+        results = []
+        for a, c in zip(ancestors, cwes):
+            try:
+                results.append(self.is_ancestor(a, c))
+            except (TypeError, ValueError):
+                results.append(False)
+        return results
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"bit": self.bit, "ancestors": self.ancestors}, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        index = CWEIndex({})
+        index.bit = data["bit"]
+        index.ancestors = data["ancestors"]
+        return index
+
+
+def read_cwe_parents(source):
+    """
+    child -> set of parent ids, from the CWE xml (cwec_*.xml) or a cwemappings.csv export
+    """
+    parents = dict()
+    if source.endswith(".csv"):
+        df = pd.read_csv(source, delimiter=";")
+        if "relation" in df.columns:
+            df = df[df["relation"] == "ChildOf"]
+        for child, parent in zip(df["childid"], df["parentid"]):
+            parents.setdefault(int(child), set()).add(int(parent))
+        return parents
+
+    import xml.etree.ElementTree as ET
+    root = ET.parse(source).getroot()
+    for element in root[0]:
+        child_id = int(element.attrib["ID"])
+        parents.setdefault(child_id, set())
+        for child in element:
+            if "Related_Weakness" in child.tag:
+                for w in child:
+                    if "Related_Weakness" in w.tag and w.attrib["Nature"] == "ChildOf":
+                        parents[child_id].add(int(w.attrib["CWE_ID"]))
+    return parents
+
+
+_indices = dict()
+_DEFAULT_CWE_SOURCES = ["cwec_v4.12.xml", "cwemappings.csv"]
+
+
+def load_cwe_index(source=None, index_path=None):
+    """
+    Loads the CWE ancestry index persisted next to `source`, (re)building it when missing or stale
+    """
+    if source is None:
+        source = next((s for s in _DEFAULT_CWE_SOURCES if os.path.exists(s)), _DEFAULT_CWE_SOURCES[0])
+    if index_path is None:
+        index_path = source + ".index.pkl"
+    if index_path in _indices:
+        return _indices[index_path]
+    if os.path.exists(index_path) and (not os.path.exists(source) or os.path.getmtime(index_path) >= os.path.getmtime(source)):
+        index = CWEIndex.load(index_path)
     else:
-        # check if target id is a child of predicted id
-        # if len(df[(df['childid'] == true_id) & (df['relation'] == 'ChildOf') & (df['parentid'] == predicted_id)]) > 0:
-        #     return True
-        # else:
-        #     return False
-        return is_parent(predicted_id, true_id, df)
+        index = CWEIndex(read_cwe_parents(source))
+        index.save(index_path)
+    _indices[index_path] = index
+    return index
+
+
+def check_cwe(true_id, predicted_id, source=None):
+    # if predicted id is equal to target id or a parent of target id, return true
+    return load_cwe_index(source).is_ancestor(predicted_id, true_id)
 
 if __name__ == '__main__':
     import sys
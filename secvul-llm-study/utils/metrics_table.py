@@ -3,7 +3,7 @@ import os
 import sys 
 from glob import glob 
 import pandas as pd
-from utils import compute_results, compute_precision_recall_accuracy
+from utils import compute_results_df, compute_precision_recall_accuracy
 model_name_map={
     'gpt-4': 'GPT-4',
     'gpt-3.5': 'GPT-3.5',
@@ -63,10 +63,7 @@ def process(main_dir, lang, common):
                 continue
         print(d)
         
-        results = compute_results(d)
-       
-        
-        df=pd.DataFrame.from_dict(results, orient="index")
+        df=compute_results_df(d)
         # if 'juliet-cpp-1.3' in d:
         #     df=filter(df, indices='results/juliet-cpp-1.3-indices-2k.txt')
         # elif 'juliet-java-1.3' in d:
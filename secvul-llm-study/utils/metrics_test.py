@@ -1,4 +1,4 @@
-from utils import compute_results, compute_precision_recall_accuracy, compute_prec_recall_multiclass, group_metrics
+from utils import compute_results_df, compute_precision_recall_accuracy, compute_prec_recall_multiclass, group_metrics
 import pandas as pd
 import sys
 import os
@@ -6,10 +6,9 @@ import tabulate
 import argparse
 
 
-def gen_table(output_folder, group_by_col=None, dataset_csv_path=None, dataset_index_col=None, top_cwe=False, indices=None, max_samples=None):
-    results = compute_results(output_folder)
+def gen_table(output_folder, group_by_col=None, dataset_csv_path=None, dataset_index_col=None, top_cwe=False, indices=None, max_samples=None, hierarchical_cwe=False):
     table = []
-    df = pd.DataFrame.from_dict(results, orient="index")
+    df = compute_results_df(output_folder, hierarchical_cwe)
     if top_cwe:
         top25=open('utils/cwe_top_25.txt').read().strip().split('\n')
         print("Filtering by top 25 cwes..")
@@ -83,12 +82,11 @@ def gen_table(output_folder, group_by_col=None, dataset_csv_path=None, dataset_i
 
 
 def get_results_from_folder(output_folder, logger=None):
-    results = compute_results(output_folder)
     if logger is None:
         _log = lambda x: print(x)
     else:
         _log = _log
-    df = pd.DataFrame.from_dict(results, orient="index")
+    df = compute_results_df(output_folder)
     # df.to_csv(os.path.join(output_folder, "results.csv"))
 
     prec_recall = compute_precision_recall_accuracy(df, "true_label", "llm_label")
@@ -136,6 +134,7 @@ if __name__ == "__main__":
     argparse.add_argument("--top_cwe", action='store_true')
     argparse.add_argument("--indices", type=str, default=None)
     argparse.add_argument("--max_samples", type=int, default=None)
+    argparse.add_argument("--hierarchical_cwe", action='store_true', help="Count predicting an ancestor of the true CWE as correct")
     args = argparse.parse_args()
 
-    gen_table(args.results_dir, args.group_by, args.dataset_csv_path, args.dataset_index_col, args.top_cwe, args.indices, args.max_samples)
+    gen_table(args.results_dir, args.group_by, args.dataset_csv_path, args.dataset_index_col, args.top_cwe, args.indices, args.max_samples, args.hierarchical_cwe)
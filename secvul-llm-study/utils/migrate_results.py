@@ -0,0 +1,51 @@
+import argparse
+import os
+import shutil
+from glob import glob
+from utils import DirResults, JsonlResults, RESULTS_FILE
+
+# Converts experiment folders with one directory per sample (query/pred/cwe/label/time .txt files)
+# into a single results.jsonl per experiment folder.
+# usage: python utils/migrate_results.py --results_dir shared/v2/study_results_v2 [--delete]
+
+
+def migrate(output_folder, delete=False):
+    if os.path.exists(os.path.join(output_folder, RESULTS_FILE)):
+        print("Already migrated:", output_folder)
+        return 0
+    legacy = DirResults(output_folder)
+    ids = sorted(k for k in os.listdir(output_folder) if os.path.isdir(os.path.join(output_folder, k)))
+    if len(ids) == 0:
+        return 0
+
+    # write to a temp file first so an interrupted migration leaves the folder untouched
+    tmp_folder = output_folder + ".migrating"
+    os.makedirs(tmp_folder, exist_ok=True)
+    store = JsonlResults(tmp_folder)
+    for k in ids:
+        record = legacy.get(k)
+        # text files already end with a newline; JsonlResults adds its own
+        store.store(k, {f: v[:-1] if v.endswith("\n") else v for f, v in record.items()})
+    os.replace(store.path, os.path.join(output_folder, RESULTS_FILE))
+    os.rmdir(tmp_folder)
+
+    migrated = JsonlResults(output_folder)
+    assert len(dict(migrated.records())) == len(ids), "Mismatch after migrating {}".format(output_folder)
+    if delete:
+        for k in ids:
+            shutil.rmtree(os.path.join(output_folder, k))
+    print("Migrated {} samples: {}".format(len(ids), output_folder))
+    return len(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", type=str, required=True, help="Directory containing experiment folders")
+    parser.add_argument("--delete", action="store_true", help="Remove the per-sample directories after migrating")
+    args = parser.parse_args()
+
+    total = 0
+    for d in sorted(glob(os.path.join(args.results_dir, "*"))):
+        if os.path.isdir(d) and not d.endswith(".migrating"):
+            total += migrate(d, args.delete)
+    print("Total migrated samples:", total)
@@ -1,4 +1,5 @@
 from data.prompt import PROMPTS, PROMPTS_SYSTEM
+from utils.utils import open_results
 import pandas as pd
 import os
 
@@ -153,9 +154,9 @@ def generate_step_by_step_dataflow_analysis_message_list(snippet, prompt_cwe=-1,
     return messages
 
 def generate_validation_message_list(id, dataset_results_dir):
-    existing_results_dir = os.path.join(dataset_results_dir, id)
-    prompt_log = open(os.path.join(existing_results_dir, "query.txt")).read().strip()
-    pred = open(os.path.join(existing_results_dir, "pred.txt")).read().strip()
+    existing_results = open_results(dataset_results_dir).get(id)
+    prompt_log = existing_results["query"].strip()
+    pred = existing_results["pred"].strip()
 
     prompt_sep = "-------------------"
     prompts = prompt_log.split(prompt_sep)
@@ -1,4 +1,10 @@
 import os
+import re
+import json
+import hashlib
+import threading
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import pandas as pd
 
 cwe_to_title_mapping = {
@@ -9,51 +15,280 @@ cwe_to_title_mapping = {
 }
 
 
+RESULTS_FILE = "results.jsonl"
+RESULT_FIELDS = ["query", "pred", "cwe", "label", "time"]
+# backend used for new experiment folders; folders with existing results keep their format
+DEFAULT_RESULTS_BACKEND = "jsonl"
+
+
+class DirResults:
+    """
+    Legacy layout: one directory per sample with a <field>.txt file per result field
+    """
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+
+    def store(self, id, results):
+        id_results_dir = os.path.join(self.output_folder, id)
+        os.makedirs(id_results_dir, exist_ok=True)
+        for result in results.keys():
+            with open(os.path.join(id_results_dir, str(result) + ".txt"), "w") as f:
+                f.write(str(results[result]))
+                f.write("\n")
+
+    def get(self, id):
+        id_results_dir = os.path.join(self.output_folder, id)
+        if not os.path.isdir(id_results_dir):
+            return None
+        record = dict()
+        for field in RESULT_FIELDS:
+            if os.path.exists(os.path.join(id_results_dir, field + ".txt")):
+                record[field] = open(os.path.join(id_results_dir, field + ".txt")).read()
+        return record
+
+    def has_prediction(self, id):
+        pred_file = os.path.join(self.output_folder, id, "pred.txt")
+        return os.path.exists(pred_file) and os.path.getsize(pred_file) > 0
+
+    def records(self):
+        for k in os.listdir(self.output_folder):
+            if os.path.isdir(os.path.join(self.output_folder, k)):
+                yield k, self.get(k)
+
+    def fingerprinted_records(self):
+        """
+        Yields (id, fingerprint, load_record) with the fingerprint taken from pred.txt's
+        mtime/size, so unchanged samples never have to be opened
+        """
+        for k in os.listdir(self.output_folder):
+            if os.path.isdir(os.path.join(self.output_folder, k)):
+                try:
+                    st = os.stat(os.path.join(self.output_folder, k, "pred.txt"))
+                    fingerprint = "{}-{}".format(st.st_mtime_ns, st.st_size)
+                except FileNotFoundError:
+                    fingerprint = None
+                yield k, fingerprint, (lambda k=k: self.get(k))
+
+
+class JsonlResults:
+    """
+    Append-only results.jsonl with one record per stored sample; the last record of an id wins.
+    The file is read once into an id -> record index that store() keeps up to date
+    """
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, RESULTS_FILE)
+        self.lock = threading.Lock()
+        self._records = None
+        self._predicted = None
+
+    def store(self, id, results):
+        record = {"id": id}
+        record.update({str(k): str(v) + "\n" for k, v in results.items()})
+        with self.lock:
+            os.makedirs(self.output_folder, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            if self._records is not None:
+                record.pop("id")
+                self._records[id] = record
+                self._set_predicted(id, record)
+
+    def _set_predicted(self, id, record):
+        if len(record.get("pred", "").strip()) > 0:
+            self._predicted.add(id)
+        else:
+            self._predicted.discard(id)
+
+    def _load(self):
+        records = dict()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # partially written last line of an interrupted run
+                        continue
+                    records[record.pop("id")] = record
+        return records
+
+    def _index(self):
+        # called with self.lock held
+        if self._records is None:
+            self._records = self._load()
+            self._predicted = set()
+            for k, record in self._records.items():
+                self._set_predicted(k, record)
+        return self._records
+
+    def get(self, id):
+        with self.lock:
+            return self._index().get(id, None)
+
+    def has_prediction(self, id):
+        with self.lock:
+            self._index()
+            return id in self._predicted
+
+    def records(self):
+        with self.lock:
+            return iter(list(self._index().items()))
+
+    def fingerprinted_records(self):
+        for k, record in self.records():
+            fingerprint = hashlib.sha1(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()
+            yield k, fingerprint, (lambda record=record: record)
+
+
+_RESULTS_BACKENDS = {"dir": DirResults, "jsonl": JsonlResults}
+_open_results = dict()
+
+
+def open_results(output_folder, backend=None):
+    """
+    Returns the results store of an experiment folder. Without an explicit backend the format
+    already present in the folder is used, falling back to DEFAULT_RESULTS_BACKEND
+    """
+    key = os.path.abspath(output_folder)
+    if key not in _open_results or (backend is not None and not isinstance(_open_results[key], _RESULTS_BACKENDS[backend])):
+        if backend is None:
+            if os.path.exists(os.path.join(output_folder, RESULTS_FILE)):
+                backend = "jsonl"
+            elif os.path.isdir(output_folder) and any(
+                    os.path.exists(os.path.join(output_folder, k, "pred.txt")) for k in os.listdir(output_folder)):
+                backend = "dir"
+            else:
+                backend = DEFAULT_RESULTS_BACKEND
+        _open_results[key] = _RESULTS_BACKENDS[backend](output_folder)
+    return _open_results[key]
+
+
 def store_results(experiment_output_dir, id, results):
-    id_results_dir = os.path.join(experiment_output_dir, id)
-    os.makedirs(id_results_dir, exist_ok=True)
-    for result in results.keys():
-        with open(os.path.join(id_results_dir, str(result) + ".txt"), "w") as f:
-            f.write(str(results[result]))
-            f.write("\n")
+    open_results(experiment_output_dir).store(id, results)
+
+
+_LATEX_TEXT_RE = re.compile(r"\\text\{([^}]*)\}", re.IGNORECASE)
+_LATEX_TEXTBF_RE = re.compile(r"\\textbf\{([^}]*)\}", re.IGNORECASE)
+# single scan over the field keys; a field's value is matched right after its key and the
+# first key whose value matches wins, same as a separate findall per field would give
+_FIELD_KEYS_RE = re.compile(
+    r"(?:(vulnerability)|(type)|(name)|(lines\s*of\s*code)|(explanation))\s*[:=]\s*", re.IGNORECASE
+)
+_FIELD_NAMES = ("vulnerability", "type", "name", "loc", "explanation")
+_FIELD_VALUE_RES = (
+    re.compile(r"YES|NO|Y|N|NA|N/A", re.IGNORECASE),
+    re.compile(r"CWE[-_]\d+|NA|N/A", re.IGNORECASE),
+    re.compile(r"[^|]*"),
+    re.compile(r"[^|]*"),
+    re.compile(r"[^|]*"),
+)
+_CWE_RE = re.compile(r"(CWE[-_]\d+|NA|N/A)", re.IGNORECASE)
+_VUL_VALUE_RE = re.compile(r"YES|NO|Y|N|NA|N/A", re.IGNORECASE)
+_JSON_KEYS = {
+    "vulnerability": "vulnerability",
+    "vulnerable": "vulnerability",
+    "vulnerability type": "type",
+    "type": "type",
+    "cwe": "type",
+    "cwe id": "type",
+    "vulnerability name": "name",
+    "name": "name",
+    "lines of code": "loc",
+    "loc": "loc",
+    "explanation": "explanation",
+}
 
 
-def parse_llm_results(pred_text):
-    results = dict()
-    import re
-    pred_text=re.sub(r'\\text\{([^}]*)\}', r'\1', pred_text, re.IGNORECASE)
-    pred_text=re.sub(r'\\textbf\{([^}]*)\}', r'\1', pred_text, re.IGNORECASE)
-    vul = re.findall(
-        "vulnerability\s*[:=]\s*(YES|NO|Y|N|NA|N/A)", pred_text, re.IGNORECASE
-    )
-    results["vulnerability"] = vul[0] if len(vul) > 0 else None
-
-    vul_type = re.findall("type\s*[:=]\s*(CWE[-_]\d+|NA|N/A)", pred_text, re.IGNORECASE)
-    results["vulnerability type"] = vul_type[0] if len(vul_type) > 0 else None
-
-    vul_name = re.findall("name\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
-    results["vulnerability name"] = vul_name[0] if len(vul_name) > 0 else None
-
-    if (
-        results["vulnerability type"] is None
-        and results["vulnerability name"] is not None
-    ):
-        vul_type = re.findall(
-            "(CWE[-_]\d+|NA|N/A)", results["vulnerability name"], re.IGNORECASE
-        )
-        vul_type = vul_type[0] if len(vul_type) > 0 else None
-        results["vulnerability type"] = vul_type
-    results["vulnerability type"] = (
-        str(results["vulnerability type"]).split("_")[-1].split("-")[-1].strip()
-    )
+class ParsedPrediction(NamedTuple):
+    vulnerability: Optional[str]
+    vulnerability_type: str
+    vulnerability_name: Optional[str]
+    lines_of_code: Optional[str]
+    explanation: Optional[str]
 
-    loc = re.findall("lines\s*of\s*code\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
-    results["lines of code"] = loc[0] if len(loc) > 0 else None
+    def as_dict(self):
+        return {
+            "vulnerability": self.vulnerability,
+            "vulnerability type": self.vulnerability_type,
+            "vulnerability name": self.vulnerability_name,
+            "lines of code": self.lines_of_code,
+            "explanation": self.explanation,
+        }
 
-    exp = re.findall("explanation\s*[:=]\s*([^|]*)", pred_text, re.IGNORECASE)
-    results["explanation"] = exp[0] if len(exp) > 0 else None
 
-    return results
+def _parse_json_fields(pred_text):
+    """
+    Fields of a JSON-mode response (GPTModel.predict(expect_json=True)), None if it is not JSON
+    """
+    text = pred_text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.lower().startswith("json"):
+            text = text[4:].strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(obj, dict):
+        return None
+
+    fields = dict()
+    for k, v in obj.items():
+        field = _JSON_KEYS.get(str(k).strip().lower().replace("_", " "), None)
+        if field is None or field in fields or v is None:
+            continue
+        if isinstance(v, bool):
+            v = "YES" if v else "NO"
+        elif isinstance(v, list):
+            v = ", ".join(str(x) for x in v)
+        v = str(v).strip()
+        if field == "vulnerability":
+            v = v if _VUL_VALUE_RE.fullmatch(v) else None
+        elif field == "type":
+            m = _CWE_RE.search(v)
+            v = m.group(1) if m else ("CWE-" + v if v.isdigit() else None)
+        fields[field] = v
+    return fields
+
+
+def parse_prediction(pred_text) -> ParsedPrediction:
+    fields = _parse_json_fields(pred_text)
+    if fields is None:
+        if "\\" in pred_text:
+            pred_text = _LATEX_TEXT_RE.sub(r"\1", pred_text)
+            pred_text = _LATEX_TEXTBF_RE.sub(r"\1", pred_text)
+        fields = dict()
+        for m in _FIELD_KEYS_RE.finditer(pred_text):
+            i = m.lastindex - 1
+            if _FIELD_NAMES[i] in fields:
+                continue
+            value = _FIELD_VALUE_RES[i].match(pred_text, m.end())
+            if value is not None:
+                fields[_FIELD_NAMES[i]] = value.group()
+                if len(fields) == len(_FIELD_NAMES):
+                    break
+
+    vul_type = fields.get("type", None)
+    vul_name = fields.get("name", None)
+    if vul_type is None and vul_name is not None:
+        m = _CWE_RE.search(vul_name)
+        vul_type = m.group(1) if m else None
+    return ParsedPrediction(
+        vulnerability=fields.get("vulnerability", None),
+        vulnerability_type=str(vul_type).split("_")[-1].split("-")[-1].strip(),
+        vulnerability_name=vul_name,
+        lines_of_code=fields.get("loc", None),
+        explanation=fields.get("explanation", None),
+    )
+
+
+def parse_llm_results(pred_text):
+    return parse_prediction(pred_text).as_dict()
 
 
 def parse_llm_results_old(pred_text):
@@ -155,53 +390,133 @@ def cwe_in_predicted_name(cwenames: pd.DataFrame, cwe, name):
     # cwenames.loc[int(cwe)]['name'].lower() in str(llm_results['vulnerability name']).lower()
 
 
-def compute_results(output_folder):
-    results = dict()
-    import pandas as pd
+PARSED_CACHE_FILE = ".parsed_results.json"
+# bump whenever parse_llm_results changes so cached parses are redone
+PARSED_CACHE_VERSION = 2
+_TRUE_VALUES = ["true", "1", "t", "y", "yes"]
+_RESULT_COLUMNS = ["true_label", "true_cwe", "llm_label_raw", "llm_cwe_raw", "llm_label", "correct",
+                   "llm_cwe", "cwe_correct", "explanation", "loc", "time"]
 
-    cwenames = pd.read_csv("utils/cwenames.txt", index_col="id")
 
-    for k in os.listdir(output_folder):
-        if os.path.isdir(os.path.join(output_folder, k)):
-            cur_result = dict()
-            name = k
+@lru_cache(maxsize=None)
+def load_cwenames(path="utils/cwenames.txt"):
+    return pd.read_csv(path, index_col="id")
 
-            true_label = (
-                open(os.path.join(output_folder, k, "label.txt")).read().strip()
-            )
-            cwe = open(os.path.join(output_folder, k, "cwe.txt")).read().strip()
-            time_taken = open(os.path.join(output_folder, k, "time.txt")).read().strip()
 
-            llm_pred = open(os.path.join(output_folder, k, "pred.txt")).read().strip()
-            # print(os.path.join(output_folder, k, "pred.txt"))
+@lru_cache(maxsize=None)
+def load_cwe_name_parts(path="utils/cwenames.txt"):
+    """
+    Maps cwe id -> lower-cased alternative names (the '|' separated name column)
+    """
+    cwenames = load_cwenames(path)
+    return {int(k): str(v).lower().split("|") for k, v in cwenames["name"].items()}
+
+
+def parse_result_record(record):
+    parsed = parse_prediction(record["pred"].strip())
+    return {
+        "label": record["label"].strip(),
+        "cwe": record["cwe"].strip(),
+        "time": record["time"].strip(),
+        "vulnerability": parsed.vulnerability,
+        "vulnerability type": parsed.vulnerability_type,
+        "vulnerability name": parsed.vulnerability_name,
+        "lines of code": parsed.lines_of_code,
+        "explanation": parsed.explanation,
+    }
+
+
+def load_parsed_results(output_folder):
+    """
+    Parsed predictions of an experiment folder. Parses are cached in the folder and only
+    samples whose prediction changed since the last call are re-parsed
+    """
+    cache_file = os.path.join(output_folder, PARSED_CACHE_FILE)
+    cache = dict()
+    if os.path.exists(cache_file):
+        try:
+            cache = json.load(open(cache_file))
+        except json.JSONDecodeError:
+            cache = dict()
+    entries = cache.get("entries", {}) if cache.get("version", None) == PARSED_CACHE_VERSION else {}
+
+    parsed = dict()
+    changed = False
+    for k, fingerprint, load_record in open_results(output_folder).fingerprinted_records():
+        entry = entries.get(k, None)
+        if entry is None or fingerprint is None or entry["fingerprint"] != fingerprint:
             try:
-                llm_results = parse_llm_results(llm_pred)                
-                cur_result["true_label"] = is_true(true_label)
-                cur_result["true_cwe"] = cwe
-                cur_result["llm_label_raw"]=llm_results["vulnerability"]
-                cur_result["llm_cwe_raw"]=llm_results["vulnerability type"]
-
-                cur_result["llm_label"] = is_true(llm_results["vulnerability"])
-                cur_result["correct"] = is_true(llm_results["vulnerability"]) == is_true(true_label)
-
-                if llm_results["vulnerability type"] == cwe or cwe_in_predicted_name(cwenames, cwe, llm_results["vulnerability name"]):
-                    cur_result["llm_cwe"] = cwe
-                    cur_result["cwe_correct"] = True
-                else:
-                    cur_result["llm_cwe"] = llm_results["vulnerability type"]
-                    cur_result["cwe_correct"] = False
-
-                # print(cur_result['llm_cwe'], cwe)
-                # cur_result['cwe_correct'] =  cur_result['llm_cwe'] == cwe
-                cur_result["explanation"] = llm_results["explanation"]
-                cur_result["loc"] = llm_results["lines of code"]
-                cur_result["time"] = time_taken
+                entry = parse_result_record(load_record())
             except Exception as e:
-                print("Error: ", os.path.join(output_folder, k, "pred.txt"), str(e))
-                continue
-            results[name] = cur_result
-
-    return results
+                print("Error: ", output_folder, k, str(e))
+                entry = {"error": str(e)}
+            entry["fingerprint"] = fingerprint
+            changed = True
+        parsed[k] = entry
+    if changed or len(parsed) != len(entries):
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": PARSED_CACHE_VERSION, "entries": parsed}, f)
+        os.replace(tmp_file, cache_file)
+
+    parsed = {k: v for k, v in parsed.items() if "error" not in v}
+    return pd.DataFrame.from_dict(parsed, orient="index",
+                                  columns=["label", "cwe", "time", "vulnerability", "vulnerability type",
+                                           "vulnerability name", "lines of code", "explanation"])
+
+
+def compute_results_df(output_folder, hierarchical_cwe=False):
+    """
+    One row per sample (indexed by id) with the parsed prediction and label/CWE correctness.
+    With hierarchical_cwe, predicting an ancestor of the true CWE also counts as correct
+    """
+    parsed = load_parsed_results(output_folder)
+    name_parts = load_cwe_name_parts()
+
+    df = pd.DataFrame(index=parsed.index)
+    df["true_label"] = parsed["label"].astype(str).str.lower().isin(_TRUE_VALUES)
+    df["true_cwe"] = parsed["cwe"]
+    df["llm_label_raw"] = parsed["vulnerability"]
+    df["llm_cwe_raw"] = parsed["vulnerability type"]
+    df["llm_label"] = parsed["vulnerability"].astype(str).str.lower().isin(_TRUE_VALUES)
+    df["correct"] = df["llm_label"] == df["true_label"]
+
+    type_match = parsed["vulnerability type"] == parsed["cwe"]
+    # name matching is only needed where the CWE id itself did not match
+    needs_name = ~type_match & parsed["vulnerability name"].notnull()
+    name_match = pd.Series(False, index=parsed.index)
+    invalid = []
+    for k, cwe, name in zip(parsed.index[needs_name], parsed["cwe"][needs_name], parsed["vulnerability name"][needs_name]):
+        try:
+            names = name_parts.get(int(cwe), [])
+        except ValueError as e:
+            print("Error: ", output_folder, k, str(e))
+            invalid.append(k)
+            continue
+        name = name.lower()
+        name_match[k] = any(n in name for n in names)
+
+    df["cwe_correct"] = type_match | name_match
+    if hierarchical_cwe:
+        try:
+            from utils.cweparser import load_cwe_index
+        except ImportError:
+            # metrics scripts run from inside utils/
+            from cweparser import load_cwe_index
+        undecided = ~df["cwe_correct"]
+        df.loc[undecided, "cwe_correct"] = load_cwe_index().is_ancestor_batch(
+            parsed["vulnerability type"][undecided], parsed["cwe"][undecided])
+    df["llm_cwe"] = parsed["cwe"].where(df["cwe_correct"], parsed["vulnerability type"])
+    df["explanation"] = parsed["explanation"]
+    df["loc"] = parsed["lines of code"]
+    df["time"] = parsed["time"]
+    return df[_RESULT_COLUMNS].drop(index=invalid)
+
+
+def compute_results(output_folder, hierarchical_cwe=False):
+    df = compute_results_df(output_folder, hierarchical_cwe)
+    # missing fields are None (not NaN) like the per-sample dicts always were
+    return df.astype(object).where(df.notnull(), None).to_dict(orient="index")
 
 
 def group_metrics(